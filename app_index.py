@@ -0,0 +1,102 @@
+from bisect import bisect_right
+
+from identity_cache import IdentityCache
+
+# App indexes already built per scenario list, keyed by the identity of the list
+_INDEX_CACHE = IdentityCache()
+
+
+class AppNodeIndex:
+    '''
+    Maps every application in a scenario to the ordered list of nodes that run it.
+
+    The nodes of every app are kept in scenario order (add inserts by node position, not at the end), so
+    current_node returns the same node the linear scan over server_current_usage["apps"] finds, also after a
+    migration to an earlier node.
+    '''
+
+    def __init__(self, scenario_nodes: list):
+        '''
+        :param scenario_nodes: List of edge nodes in the scenario, as loaded from scenarios.json
+        :type scenario_nodes: list
+        '''
+        self.position = {node["node_id"]: i for i, node in enumerate(scenario_nodes)}
+        self.app_nodes = {}
+        for node in scenario_nodes:
+            for app_name in node["server_current_usage"].get("apps", []):
+                self.add(app_name, node["node_id"])
+
+    def __contains__(self, app_name: str) -> bool:
+        return app_name in self.app_nodes
+
+    def nodes_of(self, app_name: str) -> list:
+        '''Returns every node where app_name is running, empty if it is not running.'''
+        return list(self.app_nodes.get(app_name, ()))
+
+    def current_node(self, app_name: str) -> str:
+        '''Returns the first node where app_name is running, or None.'''
+        nodes = self.app_nodes.get(app_name)
+        return nodes[0] if nodes else None
+
+    def add(self, app_name: str, node_id: str):
+        '''Records that app_name has been deployed on node_id, after the nodes that come before it in the scenario.'''
+        nodes = self.app_nodes.setdefault(app_name, [])
+        unknown = len(self.position)
+        nodes.insert(bisect_right(nodes, self.position.get(node_id, unknown), key=lambda node: self.position.get(node, unknown)), node_id)
+
+    def remove(self, app_name: str, node_id: str=None):
+        '''Records that app_name has been stopped on node_id, or on its current node if node_id is None.'''
+        nodes = self.app_nodes.get(app_name)
+        if not nodes:
+            return
+        if node_id is None:
+            node_id = nodes[0]
+        if node_id in nodes:
+            nodes.remove(node_id)
+        if not nodes:
+            del self.app_nodes[app_name]
+
+    def move(self, app_name: str, src_node: str, dst_node: str):
+        '''Records the migration of app_name from src_node to dst_node.'''
+        self.remove(app_name, src_node)
+        self.add(app_name, dst_node)
+
+    def apply(self, function_name: str, app_name: str, chosen_node: str, current_node: str=None):
+        '''
+        Updates the index with the outcome of a deploy_app/migrate_app/stop_app call.
+        Failed placements (chosen_node not a node id of the scenario, such as "NO_NODES_AVAILABLE" or an error
+        message) leave the index untouched.
+
+        :param function_name: deploy_app, migrate_app or stop_app
+        :type function_name: str
+        :param app_name: Application affected by the call
+        :type app_name: str
+        :param chosen_node: Node returned by the call ("N/A" for stop_app)
+        :type chosen_node: str
+        :param current_node: Node the app was running on, for migrate_app/stop_app
+        :type current_node: str
+        '''
+        if function_name == "stop_app":
+            self.remove(app_name, current_node)
+        elif chosen_node not in self.position:
+            return
+        elif function_name == "deploy_app":
+            self.add(app_name, chosen_node)
+        elif function_name == "migrate_app":
+            self.move(app_name, current_node, chosen_node)
+
+
+def get_app_index(scenario_nodes: list, pin: bool=False) -> AppNodeIndex:
+    '''
+    Returns the AppNodeIndex of a scenario list, building it only the first time the list is seen.
+    Call clear_app_index_cache if the node dicts are modified outside the index.
+
+    :param pin: Keep the index in the cache until the scenario is released, for owners that keep updating it
+    :type pin: bool
+    '''
+    return _INDEX_CACHE.get_or_build(scenario_nodes, AppNodeIndex, pin)
+
+
+def clear_app_index_cache():
+    '''Drops every cached AppNodeIndex.'''
+    _INDEX_CACHE.clear()
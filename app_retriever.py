@@ -0,0 +1,182 @@
+import argparse
+import json
+import math
+import re
+from collections import defaultdict
+
+from intent_resolver import STOPWORDS, normalize
+from llm_backends import estimate_tokens
+from prompt_builder import build_context_prompt
+
+# Score added to an app whose name or app_id is written in the query, so named apps always rank first
+MENTION_SCORE = 1000.0
+
+# Words (accent-free, lowercase) too common in the queries to tell apps apart, on top of the resolver STOPWORDS
+RETRIEVAL_STOPWORDS = STOPWORDS | {"este", "esta", "estos", "estas", "como", "pero", "porque", "quiero", "necesito", "necesita", "favor",
+                                   "nodo", "nodos", "edge", "todos", "todas", "tambien", "mismo", "otra", "otro"}
+
+
+def _stem(word: str) -> str:
+    '''Drops the plural ending and keeps the first 5 letters, so that "museos" and "museo" or "minas" and "mina" meet.'''
+    if word.endswith("es") and len(word) > 5:
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    return word[:5]
+
+
+def _stems(text: str) -> set:
+    '''Stems of the words of text with at least 4 letters that are not stopwords.'''
+    return {_stem(word) for word in re.findall(r"[^\W\d_]+", normalize(text)) if len(word) >= 4 and word not in RETRIEVAL_STOPWORDS}
+
+
+class AppRetriever:
+    '''
+    Local retrieval of the apps (and nodes) a query is about, so that each prompt carries a few catalogue rows
+    instead of all of them.
+
+    Apps are scored with a TF-IDF inverted index over the stems of their names and descriptions (name stems
+    weighted by name_weight), plus MENTION_SCORE when the query writes the app name or app_id. Nodes are
+    selected by the zone or node_id written in the query and by running the selected apps. The index is built
+    once, so the cost of a query depends on its own words and not on the size of the catalogue.
+    '''
+
+    def __init__(self, apps_dataset: dict, top_k: int=3, name_weight: float=3.0):
+        '''
+        :param apps_dataset: Dataset containing the applications, keyed by name
+        :type apps_dataset: dict
+        :param top_k: Number of apps spliced into each prompt
+        :type top_k: int
+        :param name_weight: Weight of a stem of the app name against one of its description
+        :type name_weight: float
+        '''
+        self.apps_dataset = apps_dataset
+        self.top_k = top_k
+        self.order = {app_name: i for i, app_name in enumerate(apps_dataset)}
+
+        # Normalized name or app_id -> app name, as whole-word patterns
+        aliases = {}
+        for app_name, app in apps_dataset.items():
+            aliases[normalize(app_name)] = app_name
+            aliases[normalize(app["app_id"])] = app_name
+        self.alias_patterns = [(re.compile(r"(?<!\w)" + re.escape(alias) + r"(?!\w)"), app_name) for alias, app_name in aliases.items()]
+
+        # Stem -> {app name: weight}, and the inverse document frequency of every stem
+        self.index = defaultdict(dict)
+        for app_name, app in apps_dataset.items():
+            for stem in _stems(app["description"]):
+                self.index[stem][app_name] = 1.0
+            for stem in _stems(app_name):
+                self.index[stem][app_name] = name_weight
+        self.idf = {stem: math.log((1 + len(apps_dataset)) / len(postings)) for stem, postings in self.index.items()}
+
+    def scores(self, query: str) -> dict:
+        '''Returns app name -> relevance score for every app sharing a stem with query or named in it.'''
+        scores = defaultdict(float)
+        for stem in _stems(query):
+            for app_name, weight in self.index.get(stem, {}).items():
+                scores[app_name] += weight * self.idf[stem]
+        text = normalize(query)
+        for pattern, app_name in self.alias_patterns:
+            if pattern.search(text):
+                scores[app_name] += MENTION_SCORE
+        return scores
+
+    def top_apps(self, query: str, k: int=None) -> list:
+        '''
+        Returns the k most relevant apps of query (top_k by default), best first; ties keep the catalogue order.
+        Apps named in the query are always returned, even if there are more than k.
+
+        :rtype: list
+        '''
+        scores = self.scores(query)
+        ranking = sorted(scores, key=lambda app_name: (-scores[app_name], self.order[app_name]))
+        mentioned = sum(1 for score in scores.values() if score >= MENTION_SCORE)
+        return ranking[:max(self.top_k if k is None else k, mentioned)]
+
+    def select_nodes(self, query: str, scenario_nodes: list, apps: list) -> list:
+        '''
+        Returns the nodes of the scenario whose zone or node_id is written in query or that run one of apps,
+        in scenario order, or every node if none does.
+        '''
+        text = normalize(query)
+        selected = [node for node in scenario_nodes
+                    if re.search(r"(?<!\w)(" + re.escape(normalize(node["zone"])) + "|" + re.escape(normalize(node["node_id"])) + r")(?!\w)", text)
+                    or any(app_name in node["server_current_usage"].get("apps", []) for app_name in apps)]
+        return selected or scenario_nodes
+
+    def context_prompt(self, query: str, scenario_nodes: list, rules: str=None) -> str:
+        '''
+        Builds the context prompt of one query with only its top apps and nodes, memoized by build_context_prompt.
+
+        :param query: The user query
+        :type query: str
+        :param scenario_nodes: List of edge nodes of the active scenario
+        :type scenario_nodes: list
+        :param rules: Placement rules appended at the end of the prompt (PLACEMENT_RULES by default)
+        :type rules: str
+        :return: Context prompt
+        :rtype: str
+        '''
+        if rules is None:
+            from hackathon_functions import PLACEMENT_RULES
+            rules = PLACEMENT_RULES
+        apps = self.top_apps(query)
+        context_prompt, _ = build_context_prompt({app_name: self.apps_dataset[app_name] for app_name in apps},
+                                                 self.select_nodes(query, scenario_nodes, apps), rules)
+        return context_prompt
+
+    def recall(self, solutions: dict, k: int=None) -> dict:
+        '''
+        Measures how often the apps of the expected function calls are among the retrieved ones.
+
+        :param solutions: Content of test-queries-with-solutions.json
+        :type solutions: dict
+        :param k: Apps retrieved per query (top_k by default)
+        :type k: int
+        :return: k, queries, expected apps, hits, recall and the misses (suite, query, app name)
+        :rtype: dict
+        '''
+        k = self.top_k if k is None else k
+        queries = expected = hits = 0
+        misses = []
+        for suite_name, expected_list in solutions.items():
+            for expected_item in expected_list:
+                queries += 1
+                retrieved = self.top_apps(expected_item["query"], k)
+                for app_name in {function["args"]["app_name"] for function in expected_item["expected_result"]["function"]}:
+                    expected += 1
+                    if app_name in retrieved:
+                        hits += 1
+                    else:
+                        misses.append((suite_name, expected_item["query"], app_name))
+        return {"k": k, "queries": queries, "apps": expected, "hits": hits, "recall": hits / expected if expected else 1.0, "misses": misses}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the recall of the per-query app retrieval against test-queries-with-solutions.json and the prompt size it saves")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--solutions", default="test-queries-with-solutions.json")
+    parser.add_argument("--show-misses", action="store_true")
+    cli_args = parser.parse_args()
+
+    from hackathon_functions import PLACEMENT_RULES
+    with open("apps.json", "r", encoding="utf-8") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r", encoding="utf-8") as f:
+        scenarios_dataset = json.load(f)
+    with open(cli_args.solutions, "r", encoding="utf-8") as f:
+        solutions = json.load(f)
+
+    for k in cli_args.k:
+        retriever = AppRetriever(apps_dataset, k)
+        report = retriever.recall(solutions)
+        full_tokens = retrieved_tokens = 0
+        for suite_name, expected_list in solutions.items():
+            full_tokens += len(expected_list) * build_context_prompt(apps_dataset, scenarios_dataset[suite_name], PLACEMENT_RULES)[1]
+            retrieved_tokens += sum(estimate_tokens(retriever.context_prompt(item["query"], scenarios_dataset[suite_name], PLACEMENT_RULES)) for item in expected_list)
+        print(f"k={k}: recall {report['hits']}/{report['apps']} ({report['recall']:.1%}), "
+              f"prompt medio ~{retrieved_tokens // report['queries']} tokens (completo ~{full_tokens // report['queries']})")
+        if cli_args.show_misses:
+            for suite_name, query, app_name in report["misses"]:
+                print(f"    {suite_name}: falta {app_name} en: {query}")
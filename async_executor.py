@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from llm_backends import estimate_tokens
+
+# Requests per minute of the backends that need pacing (gemini, record) when --rpm is not given in concurrent mode,
+# the same rate as the one second sleep between queries of the sequential loop
+PACED_REQUESTS_PER_MINUTE = 60
+
+
+class TokenBucket:
+    '''
+    Token bucket refilled continuously at rate_per_minute, holding at most one minute of budget.
+    It starts empty, so the first calls already go out at rate_per_minute instead of spending a whole minute of
+    budget at once (60 paced requests would otherwise leave together, unlike the one per second of the sequential loop).
+    The level may go negative when a call turns out to cost more than estimated; later acquires wait for it.
+    '''
+
+    def __init__(self, rate_per_minute: float):
+        '''
+        :param rate_per_minute: Units (requests or tokens) allowed per minute
+        :type rate_per_minute: float
+        '''
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.level = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount: float=1):
+        '''Waits until amount units are available and takes them. Amounts over the capacity are capped.'''
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self._refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) / self.rate_per_second)
+                self._refill()
+            self.level -= amount
+
+    def adjust(self, amount: float):
+        '''Takes (or gives back, if negative) amount units without waiting, to correct an estimate.'''
+        self._refill()
+        self.level -= amount
+
+
+class RateLimiter:
+    '''Requests-per-minute and tokens-per-minute limits of the Gemini API, each one optional.'''
+
+    def __init__(self, requests_per_minute: float=None, tokens_per_minute: float=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, estimated_tokens: int):
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(estimated_tokens)
+
+    def record(self, estimated_tokens: int, used_tokens: int):
+        '''Corrects the tokens bucket with the tokens reported by the response.'''
+        if self.tokens is not None:
+            self.tokens.adjust(used_tokens - estimated_tokens)
+
+
+async def call_gemini_concurrently(prompts: list, tools: dict, max_in_flight: int=8, rate_limiter: RateLimiter=None, return_exceptions: bool=False) -> list:
+    '''
+    Runs task_call_gemini for every prompt with at most max_in_flight calls at the same time.
+
+    :param prompts: Complete system prompts (context prompt plus query), one per query
+    :type prompts: list
+    :param tools: deploy_app, migrate_app and stop_app declarations, as passed to task_call_gemini
+    :type tools: dict
+    :param max_in_flight: Maximum number of concurrent calls
+    :type max_in_flight: int
+    :param rate_limiter: Optional requests/tokens per minute limits
+    :type rate_limiter: RateLimiter
+    :param return_exceptions: Return the exception of a failed call in its position instead of raising it
+    :type return_exceptions: bool
+    :return: Responses in the same order as prompts
+    :rtype: list
+    '''
+    from hackathon_functions import task_call_gemini
+
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def call(prompt):
+        async with semaphore:
+            estimated_tokens = estimate_tokens(prompt)
+            if rate_limiter is not None:
+                await rate_limiter.acquire(estimated_tokens)
+            # The SDK call is blocking, so it runs in the default thread pool
+            response = await asyncio.to_thread(task_call_gemini, complete_system_prompt=prompt, **tools)
+            if rate_limiter is not None:
+                rate_limiter.record(estimated_tokens, response["prompt_tokens"] + response["completion_tokens"])
+            return response
+
+    return await asyncio.gather(*(call(prompt) for prompt in prompts), return_exceptions=return_exceptions)
+
+
+def execute_queries_concurrently(prompts: list, tools: dict, max_in_flight: int=8, requests_per_minute: float=None, tokens_per_minute: float=None) -> list:
+    '''Synchronous entry point of call_gemini_concurrently for main.py, returning the responses in prompt order.'''
+    async def run():
+        return await call_gemini_concurrently(prompts, tools, max_in_flight, RateLimiter(requests_per_minute, tokens_per_minute))
+    return asyncio.run(run())
@@ -0,0 +1,273 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+CATEGORIES = ["uRLLC", "eMBB", "mMTC"]
+ZONES = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Bilbao", "Coruña", "Canarias", "Zaragoza", "Málaga", "Murcia"]
+
+
+def generate_apps(n_apps: int, seed: int=0, base_apps: dict=None) -> dict:
+    '''
+    Generates an applications dataset shaped like apps.json: the apps of base_apps first, then synthetic ones.
+
+    :param n_apps: Number of applications in the dataset
+    :type n_apps: int
+    :param seed: Seed of the random generator
+    :type seed: int
+    :param base_apps: Real applications to include, e.g. the content of apps.json
+    :type base_apps: dict
+    :return: Applications keyed by name
+    :rtype: dict
+    '''
+    rng = random.Random(seed)
+    apps = dict(list((base_apps or {}).items())[:n_apps])
+    while len(apps) < n_apps:
+        i = len(apps) + 1
+        category = rng.choice(CATEGORIES)
+        apps[f"Synthetic {category} App {i}"] = {
+            "app_id": f"app{i}",
+            "category_5G": category,
+            "description": f"Aplicación sintética {category} número {i} generada para medir el rendimiento del despliegue en nodos edge.",
+            "min_requirements": {"cpu_cores": rng.choice([2, 4, 8, 16, 32, 64]), "ram_gb": rng.choice([4, 8, 16, 32, 64, 128])},
+        }
+    return apps
+
+
+def generate_scenario(n_nodes: int, apps_dataset: dict, seed: int=0) -> list:
+    '''
+    Generates the edge nodes of a scenario shaped like scenarios.json, with KPI and usage ranges similar to the real ones.
+
+    :param n_nodes: Number of edge nodes
+    :type n_nodes: int
+    :param apps_dataset: Applications that can appear as running on the nodes
+    :type apps_dataset: dict
+    :param seed: Seed of the random generator
+    :type seed: int
+    :return: List of edge nodes
+    :rtype: list
+    '''
+    rng = random.Random(seed)
+    app_names = list(apps_dataset)
+    nodes = []
+    for i in range(n_nodes):
+        cpu_cores = rng.choice([32, 64, 96, 128, 160])
+        ram_gb = rng.choice([64, 128, 256, 512, 1024])
+        # Usage goes from idle to full, with empty usage dicts like in some real scenarios
+        if rng.random() < 0.1:
+            usage = {}
+        else:
+            usage = {
+                "apps": rng.sample(app_names, rng.randint(0, min(3, len(app_names)))),
+                "cpu_cores": int(cpu_cores * rng.betavariate(2, 2)),
+                "ram_gb": int(ram_gb * rng.betavariate(2, 2)),
+            }
+        nodes.append({
+            "node_id": f"node_{i}",
+            "zone": rng.choice(ZONES),
+            "server_capabilities": {"cpu_cores": cpu_cores, "ram_gb": ram_gb},
+            "server_kpis": {
+                "latency_ms": round(rng.lognormvariate(2, 0.8)),
+                "throughput_mbps": rng.choice([500, 600, 900, 1200, 2000, 2500, 4000, 5000, 8000, 10000]),
+                "availability_percent": rng.choice([99.0, 99.5, 99.9, 99.99, 99.999]),
+                "packet_loss_percent": rng.choice([0.001, 0.01, 0.02, 0.05, 0.1, 0.2]),
+                "connection_density": int(10 ** rng.uniform(3, 6.3)),
+                "energy_efficiency": rng.choice([0, 0.5, 1]),
+            },
+            "server_current_usage": usage,
+        })
+    return nodes
+
+
+def generate_requests(n_requests: int, apps_dataset: dict, seed: int=0) -> list:
+    '''
+    Generates function calls shaped like the expected_result entries of test-queries-with-solutions.json:
+    mostly deploy_app with zero to three KPI constraints, plus migrate_app and stop_app.
+
+    :param n_requests: Number of function calls
+    :type n_requests: int
+    :param apps_dataset: Applications used in the calls
+    :type apps_dataset: dict
+    :param seed: Seed of the random generator
+    :type seed: int
+    :return: List of {"function_name", "args"} dicts
+    :rtype: list
+    '''
+    rng = random.Random(seed)
+    app_names = list(apps_dataset)
+    kpi_values = {
+        "latency_ms": [2, 5, 10, 20, 30],
+        "throughput_mbps": [500, 1000, 2000, 3000],
+        "availability_percent": [99, 99.9, 99.99],
+        "packet_loss_percent": [0, 0.05, 0.1],
+        "connection_density": [1000, 5000, 40000, 100000],
+        "energy_efficiency": [0.5, 1],
+    }
+    requests = []
+    for _ in range(n_requests):
+        function_name = rng.choices(["deploy_app", "migrate_app", "stop_app"], weights=[6, 2, 2])[0]
+        args = {"app_name": rng.choice(app_names)}
+        if function_name != "stop_app":
+            for kpi_name in rng.sample(list(kpi_values), rng.randint(0, 3)):
+                args[kpi_name] = rng.choice(kpi_values[kpi_name])
+        requests.append({"function_name": function_name, "args": args})
+    return requests
+
+
+def measure(operation, inputs: list, time_budget_s: float=2.0, max_iterations: int=1000) -> dict:
+    '''
+    Times operation over inputs (cycling through them) until the time budget or the iteration limit is reached,
+    then runs a few more iterations under tracemalloc to get the peak memory.
+
+    :param operation: Function called with one input per iteration
+    :param inputs: Inputs for the iterations
+    :type inputs: list
+    :return: iterations, throughput_per_s, p50_ms, p99_ms and peak_memory_kb
+    :rtype: dict
+    '''
+    latencies = []
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as sink:
+        while len(latencies) < max_iterations and (not latencies or time.perf_counter() - started < time_budget_s):
+            value = inputs[len(latencies) % len(inputs)]
+            t0 = time.perf_counter()
+            operation(value)
+            latencies.append(time.perf_counter() - t0)
+            # Debug prints of the pipeline go to the sink, which is emptied so it does not grow with the run
+            sink.seek(0)
+            sink.truncate()
+
+        tracemalloc.start()
+        for value in inputs[:min(len(inputs), 5)]:
+            operation(value)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "iterations": len(latencies),
+        "throughput_per_s": len(latencies) / sum(latencies) if sum(latencies) > 0 else float("inf"),
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def run_benchmarks(sizes: list, n_apps: int=50, n_requests: int=200, seed: int=0, time_budget_s: float=2.0) -> dict:
+    '''
+    Benchmarks every stage of the pipeline on synthetic scenarios of each size.
+
+    :param sizes: Numbers of nodes of the synthetic scenarios
+    :type sizes: list
+    :return: Results keyed by "stage@size"
+    :rtype: dict
+    '''
+    import hackathon_functions
+    from hackathon_functions import logic_app_placement, task_select_nodes_with_resources, task_generate_context_prompt, task_process_function_calls
+    from node_index import NodeRankIndex
+    from placement_engine import NodeColumns
+    from prompt_builder import clear_prompt_cache
+    from records import EdgeNode
+
+    with open("apps.json", "r") as f:
+        apps_dataset = generate_apps(n_apps, seed, json.load(f))
+    requests = generate_requests(n_requests, apps_dataset, seed)
+    placements = [(function["args"]["app_name"], {k: float(v) for k, v in function["args"].items() if k != "app_name"}) for function in requests if function["function_name"] == "deploy_app"]
+
+    results = {}
+    for size in sizes:
+        nodes = generate_scenario(size, apps_dataset, seed)
+        columns = NodeColumns(nodes)
+        index = NodeRankIndex(nodes)
+        node_records = [EdgeNode.from_dict(node) for node in nodes]
+        requirements = [apps_dataset[app_name]["min_requirements"] for app_name, _ in placements]
+
+        def generate_prompt(_):
+            clear_prompt_cache()
+            task_generate_context_prompt(apps_dataset, {"bench": nodes}, {}, "bench")
+
+        stages = {
+            "select_nodes": (lambda req: task_select_nodes_with_resources(nodes, req["cpu_cores"], req["ram_gb"]), requirements),
+            "placement_python": (lambda p: logic_app_placement(p[0], apps_dataset, nodes, p[1]), placements),
+            "placement_records": (lambda p: logic_app_placement(p[0], apps_dataset, node_records, p[1]), placements),
+            "placement_numpy": (lambda p: columns.place(p[0], apps_dataset, p[1]), placements),
+            "numpy_columns_load": (lambda _: NodeColumns(nodes), [None]),
+            "placement_index": (lambda p: index.place(p[0], apps_dataset, p[1]), placements),
+            "node_index_load": (lambda _: NodeRankIndex(nodes), [None]),
+            "process_function_calls": (lambda function: task_process_function_calls(function, apps_dataset, nodes), requests),
+            "context_prompt": (generate_prompt, [None]),
+        }
+
+        previous_engine = hackathon_functions.PLACEMENT_ENGINE
+        hackathon_functions.PLACEMENT_ENGINE = "python"
+        try:
+            for stage, (operation, inputs) in stages.items():
+                results[f"{stage}@{size}"] = measure(operation, inputs, time_budget_s)
+                print(f"{stage}@{size}: {results[f'{stage}@{size}']}")
+        finally:
+            hackathon_functions.PLACEMENT_ENGINE = previous_engine
+
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float=0.2) -> list:
+    '''
+    Compares the p50 latency of every stage with a baseline.
+
+    :param threshold: Relative slowdown above which a stage counts as a regression
+    :type threshold: float
+    :return: (key, baseline p50, new p50, ratio) of the regressed stages
+    :rtype: list
+    '''
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline or baseline[key]["p50_ms"] <= 0:
+            continue
+        ratio = result["p50_ms"] / baseline[key]["p50_ms"]
+        print(f"{key}: p50 {baseline[key]['p50_ms']:.4f} ms -> {result['p50_ms']:.4f} ms (x{ratio:.2f})")
+        if ratio > 1 + threshold:
+            regressions.append((key, baseline[key]["p50_ms"], result["p50_ms"], ratio))
+    return regressions
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the placement pipeline on synthetic scenarios")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000], help="Numbers of nodes of the synthetic scenarios (up to 100000)")
+    parser.add_argument("--apps", type=int, default=50, help="Number of applications, the ones of apps.json first")
+    parser.add_argument("--requests", type=int, default=200, help="Number of synthetic function calls")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time-budget", type=float, default=2.0, help="Seconds spent timing each stage and size")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file where the results are saved")
+    parser.add_argument("--compare", metavar="BASELINE", default=None, help="Baseline JSON to compare with; exits with 1 if a stage regressed")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative p50 slowdown counted as a regression")
+    cli_args = parser.parse_args()
+
+    results = run_benchmarks(cli_args.sizes, cli_args.apps, cli_args.requests, cli_args.seed, cli_args.time_budget)
+    with open(cli_args.output, "w") as f:
+        json.dump({
+            "meta": {"commit": _git_commit(), "python": platform.python_version(), "machine": platform.machine(), "sizes": cli_args.sizes, "seed": cli_args.seed},
+            "results": results,
+        }, f, indent=4)
+    print(f"Results saved to {cli_args.output}")
+
+    if cli_args.compare:
+        with open(cli_args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, cli_args.threshold)
+        for key, old, new, ratio in regressions:
+            print(f"REGRESSION {key}: {old:.4f} ms -> {new:.4f} ms (x{ratio:.2f})")
+        if regressions:
+            exit(1)
@@ -0,0 +1,165 @@
+from bisect import bisect_left, insort
+
+from hackathon_functions import deploy_app_func, migrate_app_func, stop_app_func
+from app_index import get_app_index
+from identity_cache import IdentityCache, release
+from placement_engine import cached_node_columns
+
+# Cluster states attached to scenario lists, keyed by the identity of the list
+_STATES = IdentityCache()
+
+
+class ClusterState:
+    '''
+    Live model of one scenario that commits the outcome of every deploy/migrate/stop call.
+
+    The node dicts of the scenario are updated in place (server_current_usage CPU, RAM and apps), together with
+    the AppNodeIndex and, if already built, the NodeColumns of the scenario. Free CPU and free RAM are also kept in
+    two sorted lists so task_select_nodes_with_resources can answer with a bisect instead of scanning every node.
+    '''
+
+    def __init__(self, scenario_nodes: list, apps_dataset: dict):
+        '''
+        :param scenario_nodes: List of edge nodes in the scenario, modified in place by each commit
+        :type scenario_nodes: list
+        :param apps_dataset: Dataset containing application requirements
+        :type apps_dataset: dict
+        '''
+        self.nodes = scenario_nodes
+        self.apps_dataset = apps_dataset
+        self.position = {node["node_id"]: i for i, node in enumerate(scenario_nodes)}
+        # Pinned: migrate_app_func and stop_app_func read the cached index, which must be the one commit() updates
+        self.app_index = get_app_index(scenario_nodes, pin=True)
+
+        self.free_cpu = []
+        self.free_ram = []
+        for node in scenario_nodes:
+            usage = node["server_current_usage"]
+            self.free_cpu.append(node["server_capabilities"]["cpu_cores"] - usage.get("cpu_cores", 0))
+            self.free_ram.append(node["server_capabilities"]["ram_gb"] - usage.get("ram_gb", 0))
+        self._by_free_cpu = sorted((free, i) for i, free in enumerate(self.free_cpu))
+        self._by_free_ram = sorted((free, i) for i, free in enumerate(self.free_ram))
+
+        _STATES.set(scenario_nodes, self, pin=True)
+
+    def nodes_with_resources(self, cpu_cores: float, ram_gb: float, current_node: str=None) -> list:
+        '''
+        Range query equivalent of task_select_nodes_with_resources, returning the nodes in scenario order.
+
+        :param cpu_cores: CPU cores required by the application
+        :type cpu_cores: float
+        :param ram_gb: RAM (GB) required by the application
+        :type ram_gb: float
+        :param current_node: Node to exclude when migrating
+        :type current_node: str
+        :return: Nodes with enough free CPU and RAM
+        :rtype: list
+        '''
+        cpu_start = bisect_left(self._by_free_cpu, (cpu_cores, -1))
+        ram_start = bisect_left(self._by_free_ram, (ram_gb, -1))
+
+        # Walk the shorter of both ranges and check the other resource directly
+        if len(self._by_free_cpu) - cpu_start <= len(self._by_free_ram) - ram_start:
+            positions = [i for _, i in self._by_free_cpu[cpu_start:] if self.free_ram[i] >= ram_gb]
+        else:
+            positions = [i for _, i in self._by_free_ram[ram_start:] if self.free_cpu[i] >= cpu_cores]
+        positions.sort()
+
+        excluded = self.position.get(current_node)
+        return [self.nodes[i] for i in positions if i != excluded]
+
+    def _change_usage(self, node_id: str, app_name: str, sign: int):
+        '''Adds (sign=1) or removes (sign=-1) app_name and its requirements from the usage of node_id.'''
+        i = self.position[node_id]
+        node = self.nodes[i]
+        requirements = self.apps_dataset[app_name]["min_requirements"]
+
+        usage = node["server_current_usage"]
+        usage.setdefault("apps", [])
+        cpu_used = max(usage.get("cpu_cores", 0) + sign * requirements["cpu_cores"], 0)
+        ram_used = max(usage.get("ram_gb", 0) + sign * requirements["ram_gb"], 0)
+        usage["cpu_cores"] = cpu_used
+        usage["ram_gb"] = ram_used
+        if sign > 0:
+            usage["apps"].append(app_name)
+        elif app_name in usage["apps"]:
+            usage["apps"].remove(app_name)
+
+        self._update_free(self._by_free_cpu, self.free_cpu, i, node["server_capabilities"]["cpu_cores"] - cpu_used)
+        self._update_free(self._by_free_ram, self.free_ram, i, node["server_capabilities"]["ram_gb"] - ram_used)
+
+        columns = cached_node_columns(self.nodes)
+        if columns is not None:
+            columns.set_usage(node_id, cpu_used, ram_used)
+
+    @staticmethod
+    def _update_free(sorted_free: list, free: list, i: int, new_free: float):
+        '''Moves node i to its new position in one of the sorted free capacity lists.'''
+        del sorted_free[bisect_left(sorted_free, (free[i], i))]
+        free[i] = new_free
+        insort(sorted_free, (new_free, i))
+
+    def commit(self, function_name: str, app_name: str, chosen_node: str, current_node: str=None):
+        '''
+        Applies the outcome of a deploy_app/migrate_app/stop_app call to the scenario.
+        Failed placements and unknown apps or nodes leave the state untouched.
+
+        :param function_name: deploy_app, migrate_app or stop_app
+        :type function_name: str
+        :param app_name: Application affected by the call
+        :type app_name: str
+        :param chosen_node: Node returned by the call ("N/A" for stop_app)
+        :type chosen_node: str
+        :param current_node: Node the app was running on, for migrate_app/stop_app
+        :type current_node: str
+        '''
+        if app_name not in self.apps_dataset:
+            return
+        if function_name != "stop_app" and chosen_node not in self.position:
+            return
+
+        if function_name in ("migrate_app", "stop_app") and current_node in self.position:
+            self._change_usage(current_node, app_name, -1)
+        if function_name in ("deploy_app", "migrate_app"):
+            self._change_usage(chosen_node, app_name, 1)
+
+        self.app_index.apply(function_name, app_name, chosen_node, current_node)
+
+    def process(self, function: dict) -> tuple:
+        '''
+        Stateful version of task_process_function_calls: runs the call against the live scenario and commits it.
+
+        :param function: Function call returned by the model, with function_name and args
+        :type function: dict
+        :return: State message and chosen node, as task_process_function_calls
+        :rtype: tuple
+        '''
+        function_name = function["function_name"]
+        args = function["args"]
+        app_name = args.get("app_name")
+        current_node = self.app_index.current_node(app_name)
+
+        if function_name == "deploy_app":
+            state, chosen_node = deploy_app_func(app_name, args, self.apps_dataset, self.nodes)
+        elif function_name == "migrate_app":
+            state, chosen_node = migrate_app_func(app_name, args, self.apps_dataset, self.nodes)
+        elif function_name == "stop_app":
+            state, chosen_node = stop_app_func(app_name, self.nodes)
+        else:
+            return f"Función {function_name} no reconocida.", "N/A"
+
+        self.commit(function_name, app_name, chosen_node, current_node)
+        return state, chosen_node
+
+    def detach(self):
+        '''
+        Stops routing task_select_nodes_with_resources for this scenario through the state and releases the indexes
+        cached for the scenario list, which the state kept pinned.
+        '''
+        if _STATES.get(self.nodes) is self:
+            release(self.nodes)
+
+
+def get_cluster_state(scenario_nodes: list):
+    '''Returns the ClusterState attached to a scenario list, or None.'''
+    return _STATES.get(scenario_nodes)
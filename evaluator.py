@@ -0,0 +1,178 @@
+import argparse
+import json
+import time
+
+from results_writer import iter_results
+
+
+def compare_item(expected_item: dict, actual_item: dict) -> list:
+    '''
+    Runs the checks of test_gemini_query on one query and returns every mismatch instead of stopping at the first.
+
+    :param expected_item: Entry of test-queries-with-solutions.json
+    :type expected_item: dict
+    :param actual_item: Result of the same query, as stored in results.json (None if it is missing)
+    :type actual_item: dict
+    :return: Mismatches, each with check, position (function index or None), expected, actual and a message
+    :rtype: list
+    '''
+    if actual_item is None:
+        return [{"check": "missing", "position": None, "expected": expected_item["query"], "actual": None, "message": "Falta el resultado"}]
+
+    issues = []
+    if expected_item["query"] != actual_item.get("query"):
+        issues.append({"check": "query", "position": None, "expected": expected_item["query"], "actual": actual_item.get("query"),
+                       "message": "La query no coincide. Revisar orden de tests."})
+
+    exp_funcs = expected_item.get("expected_result", {}).get("function", [])
+    act_funcs = actual_item.get("execution_result", {}).get("function", [])
+    if len(exp_funcs) != len(act_funcs):
+        issues.append({"check": "function_count", "position": None, "expected": len(exp_funcs), "actual": len(act_funcs),
+                       "message": f"Diferente número de funciones. Esperado: {len(exp_funcs)}, Obtenido: {len(act_funcs)}"})
+
+    for j, (ef, af) in enumerate(zip(exp_funcs, act_funcs)):
+        if ef["function_name"] != af["function_name"]:
+            issues.append({"check": "function_name", "position": j, "expected": ef["function_name"], "actual": af["function_name"],
+                           "message": f"Nombre de función incorrecto. Esperado: '{ef['function_name']}', Obtenido: '{af['function_name']}'"})
+        if ef["args"] != af["args"]:
+            issues.append({"check": "args", "position": j, "expected": ef["args"], "actual": af["args"],
+                           "message": f"Argumentos incorrectos en la función '{ef['function_name']}'. Esperado: {ef['args']}, Obtenido: {af['args']}"})
+
+    for key, check, label in (("chosen_node", "chosen_node", "Nodo elegido"), ("state", "state", "Estado")):
+        for j, (expected, actual) in enumerate(zip(expected_item.get(key, []), actual_item.get(key, []))):
+            if expected != actual:
+                issues.append({"check": check, "position": j, "expected": expected, "actual": actual,
+                               "message": f"{label} incorrecto en la función {j+1}. Esperado: {expected}, Obtenido: {actual}"})
+    return issues
+
+
+def iter_result_files(paths: list):
+    '''
+    Yields (suite, result) pairs from results.json files (loaded whole) or results JSONL files (streamed line by line).
+
+    :param paths: Result files, in the order their records were written
+    :type paths: list
+    '''
+    for path in paths:
+        if path.endswith(".jsonl"):
+            for record in iter_results(path):
+                yield record.pop("test"), record
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                results = json.load(f)
+            for suite_name, actual_list in results.items():
+                for actual_item in actual_list:
+                    yield suite_name, actual_item
+
+
+def _ratio(counts: dict) -> dict:
+    counts["accuracy"] = counts["correct"] / counts["total"] if counts["total"] else 0.0
+    return counts
+
+
+def evaluate(solutions: dict, results, max_diffs: int=100) -> dict:
+    '''
+    Scores the results against the solutions in a single pass. Results are matched to the expected queries
+    by suite and position, so they can come from any iterator, e.g. iter_result_files over a huge JSONL file.
+
+    :param solutions: Content of test-queries-with-solutions.json
+    :type solutions: dict
+    :param results: Iterable of (suite, result) pairs in execution order
+    :param max_diffs: Maximum number of failed queries kept in the diff report
+    :type max_diffs: int
+    :return: Overall, per suite, per function and per KPI accuracy, plus the diffs of the failed queries
+    :rtype: dict
+    '''
+    per_suite = {suite_name: {"total": len(expected_list), "correct": 0} for suite_name, expected_list in solutions.items()}
+    per_function = {}
+    per_kpi = {}
+    diffs = []
+    failed = 0
+    extra = 0
+    seen = {suite_name: 0 for suite_name in solutions}
+
+    def score(suite_name: str, i: int, expected_item: dict, actual_item):
+        nonlocal failed
+        issues = compare_item(expected_item, actual_item)
+        if not issues:
+            per_suite[suite_name]["correct"] += 1
+        else:
+            failed += 1
+            if len(diffs) < max_diffs:
+                diffs.append({"suite": suite_name, "query_index": i, "query": expected_item["query"], "issues": issues})
+
+        # Each expected function (and each of its args) counts as correct when the function at the same position matches
+        wrong_positions = {issue["position"] for issue in issues if issue["check"] in ("function_name", "chosen_node", "state")}
+        act_funcs = actual_item.get("execution_result", {}).get("function", []) if actual_item is not None else []
+        for j, ef in enumerate(expected_item.get("expected_result", {}).get("function", [])):
+            af = act_funcs[j] if j < len(act_funcs) else None
+            function_counts = per_function.setdefault(ef["function_name"], {"total": 0, "correct": 0})
+            function_counts["total"] += 1
+            if af is not None and af["args"] == ef["args"] and j not in wrong_positions:
+                function_counts["correct"] += 1
+            for arg_name, value in ef["args"].items():
+                kpi_counts = per_kpi.setdefault(arg_name, {"total": 0, "correct": 0})
+                kpi_counts["total"] += 1
+                if af is not None and af["args"].get(arg_name) == value:
+                    kpi_counts["correct"] += 1
+
+    for suite_name, actual_item in results:
+        expected_list = solutions.get(suite_name)
+        i = seen.get(suite_name, 0)
+        if expected_list is None or i >= len(expected_list):
+            extra += 1
+            continue
+        seen[suite_name] = i + 1
+        score(suite_name, i, expected_list[i], actual_item)
+
+    # Expected queries without a result
+    for suite_name, expected_list in solutions.items():
+        for i in range(seen[suite_name], len(expected_list)):
+            score(suite_name, i, expected_list[i], None)
+
+    total = sum(counts["total"] for counts in per_suite.values())
+    return {
+        "queries": total,
+        "correct": total - failed,
+        "accuracy": (total - failed) / total if total else 0.0,
+        "extra_results": extra,
+        "per_suite": {name: _ratio(counts) for name, counts in per_suite.items()},
+        "per_function": {name: _ratio(counts) for name, counts in per_function.items()},
+        "per_kpi": {name: _ratio(counts) for name, counts in per_kpi.items()},
+        "diffs": diffs,
+    }
+
+
+def print_report(report: dict):
+    print(f"TOTAL: {report['correct']}/{report['queries']} ({report['accuracy']:.1%})")
+    for section in ("per_suite", "per_function", "per_kpi"):
+        for name, counts in report[section].items():
+            print(f"  {section[4:]} {name}: {counts['correct']}/{counts['total']} ({counts['accuracy']:.1%})")
+    if report["extra_results"]:
+        print(f"  Resultados sin query esperada: {report['extra_results']}")
+    for diff in report["diffs"]:
+        print(f"--- {diff['suite']}[Número {diff['query_index'] + 1}]: {diff['query']}")
+        for issue in diff["issues"]:
+            print(f"    {issue['message']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score results.json or results JSONL files against test-queries-with-solutions.json in one pass")
+    parser.add_argument("results", nargs="*", default=["results.json"], help="results.json or results*.jsonl files, in execution order")
+    parser.add_argument("--solutions", default="test-queries-with-solutions.json")
+    parser.add_argument("--report", metavar="PATH", default=None, help="Save the full report, diffs included, as JSON in PATH")
+    parser.add_argument("--max-diffs", type=int, default=100, help="Maximum number of failed queries in the diff report")
+    cli_args = parser.parse_args()
+
+    started = time.perf_counter()
+    with open(cli_args.solutions, "r", encoding="utf-8") as f:
+        solutions = json.load(f)
+    report = evaluate(solutions, iter_result_files(cli_args.results), cli_args.max_diffs)
+    print_report(report)
+    print(f"Evaluado en {time.perf_counter() - started:.3f}s")
+
+    if cli_args.report:
+        with open(cli_args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4, ensure_ascii=False)
+    if report["correct"] != report["queries"]:
+        exit(1)
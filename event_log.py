@@ -0,0 +1,432 @@
+import glob
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from cluster_state import ClusterState
+from placement_engine import cached_node_columns
+
+# Function names stored as one byte per event
+OPERATIONS = ("deploy_app", "migrate_app", "stop_app")
+OPERATION_CODES = {function_name: code for code, function_name in enumerate(OPERATIONS)}
+
+LOG_MAGIC = b"CSEVLOG1"
+SNAPSHOT_MAGIC = b"CSSNAP01"
+SNAPSHOT_VERSION = 1
+
+# Event record: payload length and CRC32, then the payload (operation code and three length-prefixed strings)
+RECORD = struct.Struct("<HI")
+STRING_LENGTH = struct.Struct("<H")
+NO_STRING = 0xFFFF
+
+# Snapshot: header with the offsets of its sections, fixed-width node records, a uint32 array of string ids
+# (apps of each node and nodes of each app), app index entries and the string table
+SNAPSHOT_HEADER = struct.Struct("<8sHQQIIIQQQQ")
+NODE_RECORD = struct.Struct("<Iddii")
+APP_RECORD = struct.Struct("<Iii")
+STRING_RECORD = struct.Struct("<IH")
+REF = struct.Struct("<I")
+
+
+def _pack_event(function_name: str, app_name: str, chosen_node: str, current_node: str) -> bytes:
+    payload = bytearray((OPERATION_CODES[function_name],))
+    for value in (app_name, chosen_node, current_node):
+        if value is None:
+            payload += STRING_LENGTH.pack(NO_STRING)
+        else:
+            data = value.encode("utf-8")
+            payload += STRING_LENGTH.pack(len(data)) + data
+    return RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _unpack_event(payload: bytes) -> tuple:
+    values = [OPERATIONS[payload[0]]]
+    position = 1
+    for _ in range(3):
+        (length,) = STRING_LENGTH.unpack_from(payload, position)
+        position += STRING_LENGTH.size
+        if length == NO_STRING:
+            values.append(None)
+        else:
+            values.append(payload[position:position + length].decode("utf-8"))
+            position += length
+    return tuple(values)
+
+
+class EventLog:
+    '''
+    Append-only binary log of committed deploy/migrate/stop outcomes: (function_name, app_name, chosen_node, current_node).
+
+    Every record carries its length and CRC32, so a record torn by a crash is detected and cut off when the log is
+    opened again. Appends are flushed at once and forced to disk every fsync_interval_s, as in ResultsWriter.
+    '''
+
+    def __init__(self, path: str, fsync_interval_s: float=1.0):
+        '''
+        :param path: Log file, created if it does not exist
+        :type path: str
+        :param fsync_interval_s: Minimum seconds between two fsync calls (0 forces every append to disk)
+        :type fsync_interval_s: float
+        '''
+        self.path = path
+        self.fsync_interval_s = fsync_interval_s
+        if not os.path.exists(path) or os.path.getsize(path) < len(LOG_MAGIC):
+            with open(path, "wb") as f:
+                f.write(LOG_MAGIC)
+        self.file = open(path, "r+b")
+        if self.file.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            self.file.close()
+            raise ValueError(f"{path} no es un log de eventos")
+        self.file.seek(0, os.SEEK_END)
+        self.last_sync = time.monotonic()
+
+    def iter_events(self, offset: int=len(LOG_MAGIC), stop_seq: int=None):
+        '''
+        Yields (offset after the event, event) for every complete event from offset on. The log ends at the first
+        record that is cut, empty, fails its CRC or cannot be decoded.
+
+        :param offset: Byte offset of the first event to read, e.g. the log_offset of a snapshot
+        :type offset: int
+        :param stop_seq: Maximum number of events to read
+        :type stop_seq: int
+        '''
+        self.file.flush()
+        size = os.path.getsize(self.path)
+        if size <= offset:
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            read = 0
+            while offset + RECORD.size <= size and (stop_seq is None or read < stop_seq):
+                length, crc = RECORD.unpack_from(data, offset)
+                end = offset + RECORD.size + length
+                # Every event has at least its operation code, so a zero length is a zero-filled (preallocated) tail,
+                # whose CRC of b"" would also match
+                if length == 0 or end > size:
+                    return
+                payload = data[offset + RECORD.size:end]
+                if zlib.crc32(payload) != crc:
+                    return
+                try:
+                    event = _unpack_event(payload)
+                except (IndexError, struct.error, UnicodeDecodeError):
+                    return
+                offset = end
+                read += 1
+                yield offset, event
+
+    def truncate(self, offset: int):
+        '''Cuts the log at offset, dropping a torn or corrupt tail.'''
+        self.file.flush()
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def append(self, function_name: str, app_name: str, chosen_node: str, current_node: str=None) -> int:
+        '''Appends one event and returns the byte offset right after it.'''
+        self.file.write(_pack_event(function_name, app_name, chosen_node, current_node))
+        self.file.flush()
+        if time.monotonic() - self.last_sync >= self.fsync_interval_s:
+            self.sync()
+        return self.file.tell()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def write_snapshot(path: str, seq: int, log_offset: int, scenario_nodes: list, app_nodes: dict):
+    '''
+    Writes the usage of every node and the node order of every app after event seq, atomically.
+
+    :param path: Snapshot file
+    :type path: str
+    :param seq: Number of events applied
+    :type seq: int
+    :param log_offset: Byte offset of the log right after event seq
+    :type log_offset: int
+    :param scenario_nodes: List of edge nodes of the scenario, in scenario order
+    :type scenario_nodes: list
+    :param app_nodes: App name -> nodes running it, in AppNodeIndex order
+    :type app_nodes: dict
+    '''
+    strings = {}
+
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    refs = []
+    node_records = []
+    for node in scenario_nodes:
+        usage = node["server_current_usage"]
+        apps = usage.get("apps")
+        node_records.append(NODE_RECORD.pack(string_id(node["node_id"]), usage.get("cpu_cores", math.nan), usage.get("ram_gb", math.nan),
+                                             len(refs), -1 if apps is None else len(apps)))
+        refs.extend(string_id(app_name) for app_name in apps or ())
+    app_records = []
+    for app_name, nodes in app_nodes.items():
+        app_records.append(APP_RECORD.pack(string_id(app_name), len(refs), len(nodes)))
+        refs.extend(string_id(node_id) for node_id in nodes)
+
+    encoded = [value.encode("utf-8") for value in strings]
+    string_records = []
+    blob_offset = 0
+    for data in encoded:
+        string_records.append(STRING_RECORD.pack(blob_offset, len(data)))
+        blob_offset += len(data)
+
+    nodes_offset = SNAPSHOT_HEADER.size
+    refs_offset = nodes_offset + NODE_RECORD.size * len(node_records)
+    apps_offset = refs_offset + REF.size * len(refs)
+    strings_offset = apps_offset + APP_RECORD.size * len(app_records)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, seq, log_offset, len(node_records), len(app_records), len(encoded),
+                                  nodes_offset, refs_offset, apps_offset, strings_offset)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(b"".join(node_records))
+        f.write(struct.pack(f"<{len(refs)}I", *refs))
+        f.write(b"".join(app_records))
+        f.write(b"".join(string_records))
+        f.write(b"".join(encoded))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    '''Read-only, memory-mapped view of a snapshot file; a single node can be read without decoding the rest.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.seq, self.log_offset, self.n_nodes, self.n_apps, self.n_strings,
+         self.nodes_offset, self.refs_offset, self.apps_offset, self.strings_offset) = SNAPSHOT_HEADER.unpack_from(self.data, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            self.close()
+            raise ValueError(f"{path} no es un snapshot válido")
+        self.blob_offset = self.strings_offset + STRING_RECORD.size * self.n_strings
+
+    def string(self, i: int) -> str:
+        offset, length = STRING_RECORD.unpack_from(self.data, self.strings_offset + STRING_RECORD.size * i)
+        start = self.blob_offset + offset
+        return self.data[start:start + length].decode("utf-8")
+
+    def _refs(self, start: int, count: int) -> list:
+        return [self.string(i) for i in struct.unpack_from(f"<{count}I", self.data, self.refs_offset + REF.size * start)]
+
+    def node(self, i: int) -> tuple:
+        '''Returns (node_id, cpu_used, ram_used, apps) of the node at position i; absent values are None.'''
+        node_string, cpu_used, ram_used, apps_start, apps_count = NODE_RECORD.unpack_from(self.data, self.nodes_offset + NODE_RECORD.size * i)
+        return self.string(node_string), _number(cpu_used), _number(ram_used), None if apps_count < 0 else self._refs(apps_start, apps_count)
+
+    def app_nodes(self) -> dict:
+        '''Returns app name -> nodes running it, in AppNodeIndex order.'''
+        app_nodes = {}
+        for i in range(self.n_apps):
+            app_string, start, count = APP_RECORD.unpack_from(self.data, self.apps_offset + APP_RECORD.size * i)
+            app_nodes[self.string(app_string)] = self._refs(start, count)
+        return app_nodes
+
+    def close(self):
+        self.data.close()
+
+
+def _number(value: float):
+    '''Usage value read from a snapshot: None if it was absent, an int if it is whole (as in the JSON datasets).'''
+    if math.isnan(value):
+        return None
+    return int(value) if value.is_integer() else value
+
+
+def _snapshot_path(path: str, seq: int) -> str:
+    return f"{path}.{seq:012d}.snap"
+
+
+class EventSourcedClusterState:
+    '''
+    ClusterState whose committed calls are recorded in an EventLog, with a snapshot of the node usage every
+    snapshot_interval events.
+
+    Opening it on an existing log restores the latest valid snapshot (memory-mapped) and replays only the events
+    after it through ClusterState.commit, without computing any placement again, so a restarted worker is back in
+    milliseconds. The snapshot of event 0 (the scenario as first given) is always kept; older periodic snapshots
+    beyond keep_snapshots are deleted. state_at answers point-in-time queries from the nearest snapshot.
+    '''
+
+    def __init__(self, path: str, scenario_nodes: list, apps_dataset: dict, snapshot_interval: int=1000, keep_snapshots: int=4, fsync_interval_s: float=1.0):
+        '''
+        :param path: Event log file; snapshots are written next to it as path.<seq>.snap
+        :type path: str
+        :param scenario_nodes: List of edge nodes of the scenario as first given; restored in place on recovery
+        :type scenario_nodes: list
+        :param apps_dataset: Dataset containing application requirements
+        :type apps_dataset: dict
+        :param snapshot_interval: Events between two snapshots
+        :type snapshot_interval: int
+        :param keep_snapshots: Periodic snapshots kept besides the one of event 0
+        :type keep_snapshots: int
+        '''
+        self.path = path
+        self.nodes = scenario_nodes
+        self.apps_dataset = apps_dataset
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = keep_snapshots
+        self.position = {node["node_id"]: i for i, node in enumerate(scenario_nodes)}
+        self.log = EventLog(path, fsync_interval_s)
+        self.stats = {"snapshot_seq": 0, "replayed": 0, "recovery_ms": 0.0}
+
+        started = time.perf_counter()
+        snapshots = self.snapshots()
+        if not snapshots:
+            # New log: the scenario as given is the state at event 0
+            self.cluster_state = ClusterState(scenario_nodes, apps_dataset)
+            write_snapshot(_snapshot_path(path, 0), 0, len(LOG_MAGIC), scenario_nodes, self.cluster_state.app_index.app_nodes)
+            self.seq = 0
+            self.log_offset = len(LOG_MAGIC)
+        else:
+            self._recover(snapshots)
+        self.stats["recovery_ms"] = (time.perf_counter() - started) * 1000
+
+    def snapshots(self) -> list:
+        '''Returns the (seq, path) of the snapshots of the log, oldest first.'''
+        found = []
+        for snapshot_path in glob.glob(glob.escape(self.path) + ".*.snap"):
+            try:
+                found.append((int(snapshot_path[len(self.path) + 1:-len(".snap")]), snapshot_path))
+            except ValueError:
+                pass
+        return sorted(found)
+
+    def _open_latest(self, snapshots: list, max_seq: int=None) -> Snapshot:
+        for seq, snapshot_path in reversed(snapshots):
+            if max_seq is not None and seq > max_seq:
+                continue
+            try:
+                snapshot = Snapshot(snapshot_path)
+            except (OSError, ValueError, struct.error):
+                continue
+            if snapshot.n_nodes == len(self.nodes):
+                return snapshot
+            snapshot.close()
+        raise ValueError(f"No hay un snapshot válido de {self.path} para este escenario")
+
+    def _recover(self, snapshots: list):
+        snapshot = self._open_latest(snapshots)
+        try:
+            for i, node in enumerate(self.nodes):
+                node_id, cpu_used, ram_used, apps = snapshot.node(i)
+                if node_id != node["node_id"]:
+                    raise ValueError(f"El snapshot {snapshot.path} no corresponde a este escenario")
+                usage = node["server_current_usage"]
+                for key, value in (("cpu_cores", cpu_used), ("ram_gb", ram_used), ("apps", apps)):
+                    if value is None:
+                        usage.pop(key, None)
+                    else:
+                        usage[key] = value
+            app_nodes = snapshot.app_nodes()
+            self.seq = snapshot.seq
+            self.log_offset = snapshot.log_offset
+        finally:
+            snapshot.close()
+
+        # Indexes built from the scenario before the restore must see the restored usage
+        self.cluster_state = ClusterState(self.nodes, self.apps_dataset)
+        self.cluster_state.app_index.app_nodes = app_nodes
+        columns = cached_node_columns(self.nodes)
+        if columns is not None:
+            for node in self.nodes:
+                usage = node["server_current_usage"]
+                columns.set_usage(node["node_id"], usage.get("cpu_cores", 0), usage.get("ram_gb", 0))
+        self.stats["snapshot_seq"] = self.seq
+
+        for offset, event in self.log.iter_events(self.log_offset):
+            self.cluster_state.commit(*event)
+            self.seq += 1
+            self.log_offset = offset
+            self.stats["replayed"] += 1
+        # Anything after the last complete event is a torn write
+        self.log.truncate(self.log_offset)
+
+    def process(self, function: dict) -> tuple:
+        '''
+        ClusterState.process that also records the outcome in the log (and snapshots every snapshot_interval events).
+
+        :param function: Function call with function_name and args
+        :type function: dict
+        :return: State message and chosen node, as task_process_function_calls
+        :rtype: tuple
+        '''
+        function_name = function["function_name"]
+        app_name = function["args"].get("app_name")
+        current_node = self.cluster_state.app_index.current_node(app_name)
+        state, chosen_node = self.cluster_state.process(function)
+        if function_name in OPERATION_CODES and isinstance(app_name, str):
+            self.log_offset = self.log.append(function_name, app_name, chosen_node, current_node)
+            self.seq += 1
+            if self.seq % self.snapshot_interval == 0:
+                self.snapshot()
+        return state, chosen_node
+
+    def snapshot(self):
+        '''Writes a snapshot of the current state and drops the periodic snapshots beyond keep_snapshots.'''
+        self.log.sync()
+        write_snapshot(_snapshot_path(self.path, self.seq), self.seq, self.log_offset, self.nodes, self.cluster_state.app_index.app_nodes)
+        periodic = [snapshot_path for seq, snapshot_path in self.snapshots() if seq > 0]
+        for snapshot_path in periodic[:-max(self.keep_snapshots, 1)]:
+            os.remove(snapshot_path)
+
+    def state_at(self, node_id: str, seq: int) -> dict:
+        '''
+        Point-in-time query: usage of node_id right after event seq (0 is the scenario as first given).
+        Reads only that node from the nearest snapshot at or before seq and replays the events up to seq.
+
+        :param node_id: Node to query
+        :type node_id: str
+        :param seq: Number of events applied
+        :type seq: int
+        :return: cpu_cores, ram_gb and apps of the node, as in server_current_usage
+        :rtype: dict
+        '''
+        if node_id not in self.position:
+            raise KeyError(node_id)
+        if not 0 <= seq <= self.seq:
+            raise ValueError(f"El evento {seq} no existe (el log tiene {self.seq})")
+
+        snapshot = self._open_latest(self.snapshots(), seq)
+        try:
+            _, cpu_used, ram_used, apps = snapshot.node(self.position[node_id])
+            start_seq, offset = snapshot.seq, snapshot.log_offset
+        finally:
+            snapshot.close()
+        cpu_used = cpu_used or 0
+        ram_used = ram_used or 0
+        apps = list(apps or [])
+
+        # Same rules as ClusterState.commit, restricted to this node
+        for _, (function_name, app_name, chosen_node, current_node) in self.log.iter_events(offset, seq - start_seq):
+            if app_name not in self.apps_dataset or (function_name != "stop_app" and chosen_node not in self.position):
+                continue
+            requirements = self.apps_dataset[app_name]["min_requirements"]
+            if function_name in ("migrate_app", "stop_app") and current_node == node_id:
+                cpu_used = max(cpu_used - requirements["cpu_cores"], 0)
+                ram_used = max(ram_used - requirements["ram_gb"], 0)
+                if app_name in apps:
+                    apps.remove(app_name)
+            if function_name in ("deploy_app", "migrate_app") and chosen_node == node_id:
+                cpu_used += requirements["cpu_cores"]
+                ram_used += requirements["ram_gb"]
+                apps.append(app_name)
+        return {"cpu_cores": cpu_used, "ram_gb": ram_used, "apps": apps}
+
+    def close(self):
+        self.log.close()
@@ -1,29 +1,49 @@
-from google import genai
 import os
-import dotenv
+from app_index import get_app_index
+from prompt_builder import build_context_prompt
+from records import EdgeNode
+from tracing import TRACER
 # Add any other imports you need here
 
-dotenv.load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+# Gemini client, created by get_gemini_client on the first real API call so that importing this module
+# (placement logic, KPI tables) does not load the google-genai SDK nor read .env
+client = None
+
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+
+# Optional backend that replaces the Gemini API in gemini_api_call, set with set_llm_backend
+llm_backend = None
+
+# Optional LLMResponseCache (see llm_cache.py) used by task_call_gemini, set with set_llm_cache
+llm_cache = None
+
+# Optional IntentResolver (see intent_resolver.py) tried by task_call_gemini before calling the model
+intent_resolver = None
+
+# Debug prints of the placement logic; off by default so the hot path does no string formatting (main.py --debug)
+DEBUG = os.getenv("HACKATHON_DEBUG", "0") == "1"
+
+# Placement engine used by logic_app_placement: "python" (dict based), "numpy" (columnar, see placement_engine.py)
+# or "index" (pre-ranked nodes and KPI bitsets, see node_index.py)
+PLACEMENT_ENGINE = os.getenv("PLACEMENT_ENGINE", "python")
 
 #################################### TASK 0: Complete app placement logic ######################################################
 
 # Define KPI preferences per application category
 KPIS_PREFERENCES = {
-    "uRLLC": [],
-    "eMBB": [],
-    "mMTC": []
+    "uRLLC": ["latency_ms", "availability_percent", "packet_loss_percent"],
+    "eMBB": ["throughput_mbps", "packet_loss_percent", "latency_ms"],
+    "mMTC": ["connection_density", "energy_efficiency", "availability_percent"]
 }
 
 # Add +1 or -1 depending on whether higher or lower values are better for each KPI
 KPIS_ORDER_OPERAND = {
-    "latency_ms": 0,
-    "availability_percent": 0,
-    "packet_loss_percent": 0,
-    "throughput_mbps": 0,
-    "connection_density": 0,
-    "energy_efficiency": 0
+    "latency_ms": 1,
+    "availability_percent": -1,
+    "packet_loss_percent": 1,
+    "throughput_mbps": -1,
+    "connection_density": -1,
+    "energy_efficiency": -1
 }
 
 ############################################################ END TASK 0 #############################################################
@@ -47,10 +67,23 @@ def deploy_app_func(app_name: str, args: dict, apps_dataset: dict, scenario_node
 
     chosen_node = logic_app_placement(app_name, apps_dataset, scenario_nodes, kpis_user, current_node=None)
 
+    return deploy_state_message(app_name, chosen_node), chosen_node
+
+def deploy_state_message(app_name: str, chosen_node: str) -> str:
+    '''
+    Builds the deployment result message for the node returned by the placement logic.
+
+    :param app_name: Name of the deployed application
+    :type app_name: str
+    :param chosen_node: Selected edge node ID or NO_NODES_AVAILABLE
+    :type chosen_node: str
+    :return: Deployment result message
+    :rtype: str
+    '''
     if chosen_node == "NO_NODES_AVAILABLE":
-        return f"No hay nodos edge disponibles para desplegar la aplicación {app_name} con los requisitos especificados.", chosen_node           
+        return f"No hay nodos edge disponibles para desplegar la aplicación {app_name} con los requisitos especificados."
 
-    return f"La aplicación {app_name} será desplegada en el nodo edge {chosen_node}.",chosen_node   
+    return f"La aplicación {app_name} será desplegada en el nodo edge {chosen_node}."
 
 def migrate_app_func(app_name: str, args: dict, apps_dataset: dict, scenario_nodes: list) -> str:
     '''
@@ -69,18 +102,32 @@ def migrate_app_func(app_name: str, args: dict, apps_dataset: dict, scenario_nod
     '''
     kpis_user = {arg: float(args[arg]) for arg in args if arg != "app_name"}
 
-    current_node = None
-    for node in scenario_nodes:
-        if node["server_current_usage"] != {} and app_name in node["server_current_usage"]["apps"]:
-            current_node = node["node_id"]
-            break
+    running_nodes = get_app_index(scenario_nodes).nodes_of(app_name)
+    current_node = running_nodes[0] if running_nodes else None
+    if DEBUG and len(running_nodes) > 1:
+        print(f"[DEBUG]: App {app_name} is running on several nodes: {running_nodes}")
 
     chosen_node = logic_app_placement(app_name, apps_dataset, scenario_nodes, kpis_user, current_node)
 
+    return migrate_state_message(app_name, current_node, chosen_node), chosen_node
+
+def migrate_state_message(app_name: str, current_node: str, chosen_node: str) -> str:
+    '''
+    Builds the migration result message for the node returned by the placement logic.
+
+    :param app_name: Name of the migrated application
+    :type app_name: str
+    :param current_node: Node the application was running on
+    :type current_node: str
+    :param chosen_node: Selected edge node ID or NO_NODES_AVAILABLE
+    :type chosen_node: str
+    :return: Migration result message
+    :rtype: str
+    '''
     if chosen_node == "NO_NODES_AVAILABLE":
-        return f"No hay nodos edge disponibles para migrar la aplicación {app_name} con los requisitos especificados.", chosen_node
+        return f"No hay nodos edge disponibles para migrar la aplicación {app_name} con los requisitos especificados."
 
-    return f"La aplicación {app_name} será migrada del nodo {current_node} al nodo edge {chosen_node}.", chosen_node
+    return f"La aplicación {app_name} será migrada del nodo {current_node} al nodo edge {chosen_node}."
 
 def stop_app_func(app_name: str, scenario_nodes: list) -> str:
     '''
@@ -91,13 +138,32 @@ def stop_app_func(app_name: str, scenario_nodes: list) -> str:
     :return: Stop result message
     :rtype: str
     '''
-    current_node = None
-    for node in scenario_nodes:
-        if node["server_current_usage"] != {} and app_name in node["server_current_usage"]["apps"]:
-            current_node = node["node_id"]
-            break
-    
-    return f"La aplicación {app_name} será detenida del nodo {current_node}.", "N/A"
+    running_nodes = get_app_index(scenario_nodes).nodes_of(app_name)
+    current_node = running_nodes[0] if running_nodes else None
+    if DEBUG and len(running_nodes) > 1:
+        print(f"[DEBUG]: App {app_name} is running on several nodes: {running_nodes}")
+
+    return stop_state_message(app_name, current_node), "N/A"
+
+def stop_state_message(app_name: str, current_node: str) -> str:
+    '''Builds the stop result message of an application running on current_node.'''
+    return f"La aplicación {app_name} será detenida del nodo {current_node}."
+
+def placement_sort_key(app_category: str, nodes: list):
+    '''
+    Returns the sort key that ranks nodes by the KPIS_PREFERENCES of app_category, with the KPIS_ORDER_OPERAND signs applied.
+    EdgeNode records (see records.py) are read through their slots instead of the two dict lookups per KPI.
+
+    :param app_category: 5G category of the application
+    :type app_category: str
+    :param nodes: Nodes that will be sorted, dicts or EdgeNode records
+    :type nodes: list
+    '''
+    first, second, third = KPIS_PREFERENCES[app_category]
+    first_operand, second_operand, third_operand = (KPIS_ORDER_OPERAND[kpi_name] for kpi_name in (first, second, third))
+    if nodes and isinstance(nodes[0], EdgeNode):
+        return lambda node: (first_operand * getattr(node, first), second_operand * getattr(node, second), third_operand * getattr(node, third))
+    return lambda node: (first_operand * node["server_kpis"][first], second_operand * node["server_kpis"][second], third_operand * node["server_kpis"][third])
 
 def logic_app_placement(app_name: str, apps_data: dict, edge_nodes: list, kpis_user: dict={}, current_node: str=None) -> str:
     '''
@@ -116,6 +182,14 @@ def logic_app_placement(app_name: str, apps_data: dict, edge_nodes: list, kpis_u
     :return: Selected edge node ID or error message
     :rtype: str
     '''
+    if PLACEMENT_ENGINE == "numpy":
+        from placement_engine import numpy_app_placement
+        with TRACER.span("placement.numpy"):
+            return numpy_app_placement(app_name, apps_data, edge_nodes, kpis_user, current_node)
+    if PLACEMENT_ENGINE == "index":
+        from node_index import index_app_placement
+        with TRACER.span("placement.index"):
+            return index_app_placement(app_name, apps_data, edge_nodes, kpis_user, current_node)
 
     if app_name not in apps_data:
         return "Aplicación no encontrada en el dataset."
@@ -123,7 +197,8 @@ def logic_app_placement(app_name: str, apps_data: dict, edge_nodes: list, kpis_u
     cpu_cores = apps_data[app_name]["min_requirements"]["cpu_cores"]
     ram_gb = apps_data[app_name]["min_requirements"]["ram_gb"]    
 
-    free_nodes = task_select_nodes_with_resources(edge_nodes, cpu_cores, ram_gb, current_node)    
+    with TRACER.span("placement.select_nodes"):
+        free_nodes = task_select_nodes_with_resources(edge_nodes, cpu_cores, ram_gb, current_node)    
 
     if len(free_nodes) == 0:
         return "NO_NODES_AVAILABLE"
@@ -133,64 +208,110 @@ def logic_app_placement(app_name: str, apps_data: dict, edge_nodes: list, kpis_u
     nodes_filtered = free_nodes.copy()
 
     if len(kpis_user) > 0:
+        with TRACER.span("placement.kpi_filter", nodes=len(nodes_valid)):
+            if DEBUG:
                 print("[DEBUG]: User provided KPIs:", kpis_user)
-                for kpi_name, kpi_value in kpis_user.items():
-                    if kpi_name in KPIS_PREFERENCES[app_category]:                       
-                        for node in nodes_valid:
-                            if kpi_name in ["latency_ms", "packet_loss_percent"]:
-                                if node["server_kpis"][kpi_name] > kpi_value:
-                                    if node in nodes_filtered:
-                                        nodes_filtered.remove(node)
+            for kpi_name, kpi_value in kpis_user.items():
+                if kpi_name in KPIS_PREFERENCES[app_category]:                       
+                    for node in nodes_valid:
+                        if kpi_name in ["latency_ms", "packet_loss_percent"]:
+                            if node["server_kpis"][kpi_name] > kpi_value:
+                                if node in nodes_filtered:
+                                    nodes_filtered.remove(node)
+                                    if DEBUG:
                                         print(f"[DEBUG]: Node {node['node_id']} removed for not meeting {kpi_name} <= {kpi_value}")
-                            else:
-                                if node["server_kpis"][kpi_name] < kpi_value:
-                                    if node in nodes_filtered:
-                                        nodes_filtered.remove(node)
+                        else:
+                            if node["server_kpis"][kpi_name] < kpi_value:
+                                if node in nodes_filtered:
+                                    nodes_filtered.remove(node)
+                                    if DEBUG:
                                         print(f"[DEBUG]: Node {node['node_id']} removed for not meeting {kpi_name} >= {kpi_value}")
-                if len(nodes_filtered) == 0:
-                    return "NO_NODES_AVAILABLE"
-
-    print(f"[DEBUG]: Nodes valid after filtering: {[node['node_id'] for node in nodes_filtered]}")
-    if app_category == "uRLLC":
-            print("[DEBUG]: App category uRLLC")          
-            nodes_filtered.sort(key=lambda x: (
-            KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][0]] * x["server_kpis"][KPIS_PREFERENCES[app_category][0]],  
-            KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][1]] * x["server_kpis"][KPIS_PREFERENCES[app_category][1]],  
-            KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][2]] * x["server_kpis"][KPIS_PREFERENCES[app_category][2]]))  
-
-    elif app_category == "eMBB":
-            print("[DEBUG]: App category eMBB")           
-            nodes_filtered.sort(key=lambda x: (
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][0]] * x["server_kpis"][KPIS_PREFERENCES[app_category][0]],  
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][1]] * x["server_kpis"][KPIS_PREFERENCES[app_category][1]],  
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][2]] * x["server_kpis"][KPIS_PREFERENCES[app_category][2]]))  
-        
-    elif app_category == "mMTC":
-            print("[DEBUG]: App category mMTC")
-            nodes_filtered.sort(key=lambda x: (
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][0]] * x["server_kpis"][KPIS_PREFERENCES[app_category][0]],  
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][1]] * x["server_kpis"][KPIS_PREFERENCES[app_category][1]],  
-                KPIS_ORDER_OPERAND[KPIS_PREFERENCES[app_category][2]] * x["server_kpis"][KPIS_PREFERENCES[app_category][2]]))  
- 
-    else :
-        return "Categoría de aplicación no reconocida."
+            if len(nodes_filtered) == 0:
+                return "NO_NODES_AVAILABLE"
+
+    if DEBUG:
+        print(f"[DEBUG]: Nodes valid after filtering: {[node['node_id'] for node in nodes_filtered]}")
+    with TRACER.span("placement.sort", nodes=len(nodes_filtered)):
+        if app_category == "uRLLC":
+            if DEBUG:
+                print("[DEBUG]: App category uRLLC")          
+            nodes_filtered.sort(key=placement_sort_key(app_category, nodes_filtered))
+
+        elif app_category == "eMBB":
+            if DEBUG:
+                print("[DEBUG]: App category eMBB")           
+            nodes_filtered.sort(key=placement_sort_key(app_category, nodes_filtered))
+            
+        elif app_category == "mMTC":
+            if DEBUG:
+                print("[DEBUG]: App category mMTC")
+            nodes_filtered.sort(key=placement_sort_key(app_category, nodes_filtered))
+     
+        else :
+            return "Categoría de aplicación no reconocida."
 
     return nodes_filtered[0]["node_id"] if nodes_filtered else "NO_NODES_AVAILABLE"
 
 ################################################ TASK 1: Complete Gemini 2.5 call functions ################################################
 def gemini_api_call(tools_list, prompt) -> dict:
     '''You need to complete the call to Gemini 2.5 here, using the provided tools and prompt.'''
+    # An offline backend (see llm_backends.py) replaces the real call when set with set_llm_backend
+    if llm_backend is not None:
+        return llm_backend.generate(tools_list, prompt)
+
+    return gemini_generate_content(tools_list, prompt)
+
+def get_gemini_client():
+    '''
+    Returns the Gemini client, loading .env and the google-genai SDK and creating the client on the first call.
+    A client given to set_gemini_client is returned as is.
+
+    :return: The genai.Client used by gemini_generate_content
+    '''
+    global client
+    if client is None:
+        import dotenv
+        from google import genai
+
+        dotenv.load_dotenv()
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise RuntimeError("GEMINI_API_KEY no está definida: configúrala en .env o usa un backend offline (--llm-backend replay/stub).")
+        client = genai.Client(api_key=api_key)
+    return client
+
+def set_gemini_client(new_client):
+    '''
+    Replaces the client returned by get_gemini_client.
+
+    :param new_client: Preconfigured or fake client with a models.generate_content method, or None to create it again on the next call
+    '''
+    global client
+    client = new_client
+
+def gemini_generate_content(tools_list, prompt) -> dict:
+    '''
+    Real call to the Gemini API with the given tools and prompt.
+
+    :param tools_list: Function declarations given to the model
+    :type tools_list: list
+    :param prompt: Prompt, as a string or a list of role/parts messages
+    :return: Function calls and token counts of the response
+    :rtype: dict
+    '''
+    from google.genai import types
 
     # You need to create an object from the provided tools list
-    tools =
+    tools = types.Tool(function_declarations=tools_list)
 
     # Create config with tools and add tool_config if needed
     config = {
-    
+        "tools": [tools],
+        "tool_config": {"function_calling_config": {"mode": "ANY"}},
     }
 
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-lite",
+    response = get_gemini_client().models.generate_content(
+        model=GEMINI_MODEL,
         contents=prompt,
         config=config,
     )
@@ -226,9 +347,64 @@ def task_call_gemini(complete_system_prompt, deploy_app, migrate_app, stop_app):
     You need to call gemini_api_call from here, with the complete_system_prompt and the three functions as tools, and return the response.
     '''
     # Invoke gemini_api_call HERE with the appropriate parameters
-    response = 
+    tools_list = [deploy_app, migrate_app, stop_app]
+    with TRACER.span("llm_call") as span:
+        response = None
+        if intent_resolver is not None:
+            from llm_backends import prompt_query
+            response = intent_resolver.resolve(prompt_query(complete_system_prompt))
+            span["source"] = "resolver"
+
+        if response is None and llm_cache is not None:
+            response = llm_cache.get_or_call(GEMINI_MODEL, complete_system_prompt, tools_list, lambda: gemini_api_call(tools_list=tools_list, prompt=complete_system_prompt),
+                                             llm_backend_identity())
+            span["source"] = "cache"
+        elif response is None:
+            response = gemini_api_call(tools_list=tools_list, prompt=complete_system_prompt)
+            span["source"] = "api"
+
+        span["prompt_tokens"] = response["prompt_tokens"]
+        span["completion_tokens"] = response["completion_tokens"]
     return response
 
+def llm_backend_identity() -> str:
+    '''
+    Returns the identity of the answers of the current backend, used in the response cache keys:
+    "gemini" for the real model, "stub" or "replay" for the offline backends.
+    '''
+    if llm_backend is None:
+        return "gemini"
+    return getattr(llm_backend, "cache_identity", type(llm_backend).__name__)
+
+def set_llm_backend(backend):
+    '''
+    Sets the backend used by gemini_api_call instead of the Gemini API.
+
+    :param backend: Object with a generate(tools_list, prompt) method (see llm_backends.py), or None for the real API
+    '''
+    global llm_backend
+    llm_backend = backend
+
+def set_intent_resolver(resolver):
+    '''
+    Sets the local resolver that answers unambiguous queries without calling Gemini.
+
+    :param resolver: IntentResolver instance, or None to send every query to the model
+    :type resolver: IntentResolver
+    '''
+    global intent_resolver
+    intent_resolver = resolver
+
+def set_llm_cache(cache):
+    '''
+    Sets the response cache used by task_call_gemini.
+
+    :param cache: LLMResponseCache instance, or None to always call the API
+    :type cache: LLMResponseCache
+    '''
+    global llm_cache
+    llm_cache = cache
+
 ################################################################# END TASK 1 ###########################################################################################
 
 ################################################ TASK 2: Complete function call processing ################################################
@@ -237,6 +413,18 @@ def task_process_function_calls(function, apps_dataset: dict, scenario_nodes: li
     '''You need to process each function call here, calling the appropriate function (deploy_app_func, migrate_app_func, stop_app_func) based on the function name, and return the chosen node and state.'''
 
     # Hint: you need to call the deploy_app_func, migrate_app_func and stop_app_func functions defined above, depending on the case.
+    function_name = function["function_name"]
+    args = function["args"]
+    app_name = args.get("app_name")
+
+    if function_name == "deploy_app":
+        state, chosen_node = deploy_app_func(app_name, args, apps_dataset, scenario_nodes)
+    elif function_name == "migrate_app":
+        state, chosen_node = migrate_app_func(app_name, args, apps_dataset, scenario_nodes)
+    elif function_name == "stop_app":
+        state, chosen_node = stop_app_func(app_name, scenario_nodes)
+    else:
+        state, chosen_node = f"Función {function_name} no reconocida.", "N/A"
 
     return state, chosen_node
 
@@ -247,12 +435,26 @@ def task_select_nodes_with_resources(edge_nodes: list, cpu_cores: int, ram_gb: i
     '''You need to implement the logic to filter and return only the nodes that have enough CPU and RAM to host the application.'''
 
     # You need to add HERE the logic to choose just the nodes that have enough CPU and RAM to host the application
-
-    
+    # A live ClusterState keeps the nodes sorted by free capacity, so the filter becomes a range query
+    from cluster_state import get_cluster_state
+    cluster_state = get_cluster_state(edge_nodes)
+    if cluster_state is not None:
+        free_nodes = cluster_state.nodes_with_resources(cpu_cores, ram_gb)
+    elif edge_nodes and isinstance(edge_nodes[0], EdgeNode):
+        free_nodes = [node for node in edge_nodes if node.free_cpu() >= cpu_cores and node.free_ram() >= ram_gb]
+    else:
+        free_nodes = []
+        for node in edge_nodes:
+            usage = node["server_current_usage"]
+            free_cpu = node["server_capabilities"]["cpu_cores"] - usage.get("cpu_cores", 0)
+            free_ram = node["server_capabilities"]["ram_gb"] - usage.get("ram_gb", 0)
+            if free_cpu >= cpu_cores and free_ram >= ram_gb:
+                free_nodes.append(node)
 
     # The last step is to remove current node from the list if we are migrating
     if current_node:
-        print("[DEBUG]:Current node:", current_node)
+        if DEBUG:
+            print("[DEBUG]:Current node:", current_node)
         free_nodes = [node for node in free_nodes if node["node_id"] != current_node]
 
     return free_nodes
@@ -262,6 +464,9 @@ def task_select_nodes_with_resources(edge_nodes: list, cpu_cores: int, ram_gb: i
 
 # You can add HERE whatever helper functions you consider necessary
 
+# Placement rules appended to every context prompt
+PLACEMENT_RULES = "Las reglas a seguir para desplegar o migrar un app en orden son: \n1. La app se debe desplegar en un nodo edge que tenga suficiente capacidad de CPU y memoria para soportar la app.\n2. En caso de que existan múltiples nodos candidatos (es decir, nodos que ya han verificado tener suficiente CPU y memoria RAM libre para alojar la aplicación), debes seleccionar el nodo óptimo aplicando estrictamente las siguientes reglas de desempate según la categoría 5G de la aplicación. Para aplicaciones uRLLC (Ultra-Reliable Low Latency Communications), que son críticas y requieren respuesta inmediata, el orden de prioridad de los KPIs es: en primer lugar minimizar la latencia (latency_ms) por ser el factor más determinante, en segundo lugar maximizar la disponibilidad (availability_percent) para garantizar la fiabilidad del servicio, y en tercer lugar minimizar la pérdida de paquetes (packet_loss_percent). Para aplicaciones eMBB (Enhanced Mobile Broadband), que consumen gran ancho de banda multimedia, el orden de prioridad es: en primer lugar maximizar el throughput (throughput_mbps) siendo esencial para la transmisión de datos, en segundo lugar minimizar la pérdida de paquetes (packet_loss_percent) para evitar artefactos o pixelación, y en tercer lugar minimizar la latencia (latency_ms) para mejorar la interactividad. Finalmente, para aplicaciones mMTC (Massive Machine Type Communications), que conectan miles de dispositivos IoT, el orden de prioridad es: en primer lugar maximizar la densidad de conexión (connection_density) para soportar el volumen masivo de dispositivos, en segundo lugar maximizar la eficiencia energética (energy_efficiency) prefiriendo nodos con eficiencia 'high' sobre 'medium' o 'low', y en tercer lugar maximizar la disponibilidad (availability_percent)."
+
 def task_generate_context_prompt(apps_dataset: dict, scenarios_dataset: dict, functions: dict, test_index: str) -> str:
     '''
     You need to generate the context prompt for Gemini 2.5 here, using whathever you consider necessary from the apps dataset, scenario nodes and test queries dataset.
@@ -272,9 +477,13 @@ def task_generate_context_prompt(apps_dataset: dict, scenarios_dataset: dict, fu
 
     # Hint: You may reduce the initial prompt size by summarizing the datasets if needed, or selecting only the most relevant information to include in the prompt. You may also consider creating helper functions to format the datasets
     # You can add HERE whatever code you consider necessary to generate the context prompt
+    # Only the nodes of the active scenario are sent, encoded as compact tables (see prompt_builder.py). The app
+    # table is left out when the generated function declarations already carry the catalogue
+    from tool_declarations import catalogue_in_declarations
+    apps_in_prompt = None if catalogue_in_declarations(functions, apps_dataset) else apps_dataset
+    context_prompt, prompt_tokens = build_context_prompt(apps_in_prompt, scenarios_dataset[test_index], PLACEMENT_RULES)
+    print(f"Context prompt for test {test_index}: ~{prompt_tokens} tokens")
 
-    context_prompt = "Eres un asistente para gestionar aplicaciones en una red de nodos edge. En tu base de datos tienes informacion de los siguientes nodos edge en diferentes escenarios: " + str(scenarios_dataset) + "\n\n En las cuales se pueden desplegar este tipo de aplicaciones siguientes aplicaciones: " + str(apps_dataset) + "Las reglas a seguir para desplegar o migrar un app en orden son: \n1. La app se debe desplegar en un nodo edge que tenga suficiente capacidad de CPU y memoria para soportar la app.\n2. En caso de que existan múltiples nodos candidatos (es decir, nodos que ya han verificado tener suficiente CPU y memoria RAM libre para alojar la aplicación), debes seleccionar el nodo óptimo aplicando estrictamente las siguientes reglas de desempate según la categoría 5G de la aplicación. Para aplicaciones uRLLC (Ultra-Reliable Low Latency Communications), que son críticas y requieren respuesta inmediata, el orden de prioridad de los KPIs es: en primer lugar minimizar la latencia (latency_ms) por ser el factor más determinante, en segundo lugar maximizar la disponibilidad (availability_percent) para garantizar la fiabilidad del servicio, y en tercer lugar minimizar la pérdida de paquetes (packet_loss_percent). Para aplicaciones eMBB (Enhanced Mobile Broadband), que consumen gran ancho de banda multimedia, el orden de prioridad es: en primer lugar maximizar el throughput (throughput_mbps) siendo esencial para la transmisión de datos, en segundo lugar minimizar la pérdida de paquetes (packet_loss_percent) para evitar artefactos o pixelación, y en tercer lugar minimizar la latencia (latency_ms) para mejorar la interactividad. Finalmente, para aplicaciones mMTC (Massive Machine Type Communications), que conectan miles de dispositivos IoT, el orden de prioridad es: en primer lugar maximizar la densidad de conexión (connection_density) para soportar el volumen masivo de dispositivos, en segundo lugar maximizar la eficiencia energética (energy_efficiency) prefiriendo nodos con eficiencia 'high' sobre 'medium' o 'low', y en tercer lugar maximizar la disponibilidad (availability_percent)."
-    
     return context_prompt
 
 ########################################################### END TASK 4 #############################################################################################
@@ -0,0 +1,321 @@
+import http.client
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Status codes retried by default: rate limited, and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TransportError(Exception):
+    '''Request that failed for good: non retryable status, retries exhausted, deadline or open circuit.'''
+
+    def __init__(self, message: str, status: int=None, body: str=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+class DeadlineExceeded(TransportError):
+    pass
+
+
+class CircuitOpenError(TransportError):
+    pass
+
+
+class RetryPolicy:
+    '''Jittered exponential backoff: attempt n waits a random time up to min(max_delay_s, base_delay_s * 2**n).'''
+
+    def __init__(self, max_attempts: int=5, base_delay_s: float=0.5, max_delay_s: float=20.0, retry_statuses: tuple=RETRY_STATUSES, rng: random.Random=None):
+        '''
+        :param max_attempts: Attempts per call, the first one included
+        :type max_attempts: int
+        :param base_delay_s: Upper bound of the first backoff
+        :type base_delay_s: float
+        :param max_delay_s: Upper bound of every backoff, and of a Retry-After honoured from the server
+        :type max_delay_s: float
+        :param retry_statuses: HTTP statuses that are retried
+        :type retry_statuses: tuple
+        '''
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.retry_statuses = retry_statuses
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt: int, retry_after_s: float=None) -> float:
+        '''Seconds to wait after the failed attempt number attempt (0 based); a Retry-After from the server wins.'''
+        if retry_after_s is not None:
+            return min(retry_after_s, self.max_delay_s)
+        return self.rng.uniform(0, min(self.max_delay_s, self.base_delay_s * 2 ** attempt))
+
+
+class CircuitBreaker:
+    '''
+    Stops calling a failing endpoint: after failure_threshold consecutive failures the circuit opens and calls fail
+    immediately for reset_timeout_s; then one trial call is let through (half open) and its outcome closes or reopens it.
+    '''
+
+    def __init__(self, failure_threshold: int=5, reset_timeout_s: float=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout_s else "open"
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ConnectionPool:
+    '''Keep-alive HTTP(S) connections to one host, reused across calls and threads.'''
+
+    def __init__(self, base_url: str, max_size: int=8):
+        '''
+        :param base_url: Scheme, host and optional port, e.g. https://generativelanguage.googleapis.com
+        :type base_url: str
+        :param max_size: Maximum idle connections kept open
+        :type max_size: int
+        '''
+        parts = urlsplit(base_url)
+        self.connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.idle = queue.LifoQueue(max_size)
+        self.created = 0
+
+    def acquire(self, timeout_s: float):
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.connection_class(self.host, self.port, timeout=timeout_s)
+            self.created += 1
+        connection.timeout = timeout_s
+        if connection.sock is not None:
+            connection.sock.settimeout(timeout_s)
+        return connection
+
+    def release(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def discard(self, connection):
+        connection.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def parse_retry_after(value: str):
+    '''Seconds of a Retry-After header, given as seconds or as an HTTP date; None if absent or invalid.'''
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class HttpTransport:
+    '''
+    JSON over HTTP with pooled keep-alive connections, retries with jittered backoff (honouring Retry-After on 429/503),
+    a deadline per call covering every attempt and wait, and a circuit breaker shared by all the calls.
+    '''
+
+    def __init__(self, base_url: str, pool_size: int=8, timeout_s: float=30.0, retry_policy: RetryPolicy=None, circuit_breaker: CircuitBreaker=None):
+        '''
+        :param base_url: Scheme, host and optional port of the API
+        :type base_url: str
+        :param pool_size: Maximum idle connections kept open
+        :type pool_size: int
+        :param timeout_s: Socket timeout of each attempt
+        :type timeout_s: float
+        '''
+        self.pool = ConnectionPool(base_url, pool_size)
+        self.timeout_s = timeout_s
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "failures": 0}
+
+    def post_json(self, path: str, payload: dict, headers: dict=None, deadline_s: float=None) -> dict:
+        '''
+        POSTs payload as JSON and returns the decoded JSON response.
+
+        :param path: Request path (and query string), appended to the path of base_url
+        :type path: str
+        :param payload: JSON body
+        :type payload: dict
+        :param headers: Extra headers, e.g. the API key
+        :type headers: dict
+        :param deadline_s: Maximum seconds for the whole call, retries included; None means only the attempt timeouts
+        :type deadline_s: float
+        :return: Decoded response body
+        :rtype: dict
+        '''
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        request_headers = {"Content-Type": "application/json", "Connection": "keep-alive", **(headers or {})}
+        deadline = time.monotonic() + deadline_s if deadline_s is not None else None
+        self.stats["calls"] += 1
+
+        for attempt in range(self.retry_policy.max_attempts):
+            if not self.circuit_breaker.allow():
+                self.stats["failures"] += 1
+                raise CircuitOpenError("Circuito abierto: demasiados fallos seguidos de la API")
+
+            timeout_s = self.timeout_s
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["failures"] += 1
+                    raise DeadlineExceeded("Plazo de la llamada agotado")
+                timeout_s = min(timeout_s, remaining)
+
+            self.stats["attempts"] += 1
+            status, response_headers, response_body, error = self._attempt(path, body, request_headers, timeout_s)
+
+            if error is None and 200 <= status < 300:
+                self.circuit_breaker.record_success()
+                return json.loads(response_body) if response_body else {}
+
+            retryable = error is not None or status in self.retry_policy.retry_statuses
+            # Rate limiting means the endpoint is healthy, so only errors and 5xx count towards the circuit breaker
+            if error is not None or status >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+            if not retryable or attempt == self.retry_policy.max_attempts - 1:
+                self.stats["failures"] += 1
+                if error is not None:
+                    raise TransportError(f"Error de conexión: {error}") from error
+                raise TransportError(f"La API respondió {status}", status, response_body.decode("utf-8", "replace"))
+
+            delay = self.retry_policy.delay(attempt, parse_retry_after(response_headers.get("Retry-After")) if error is None else None)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                self.stats["failures"] += 1
+                raise DeadlineExceeded("Plazo de la llamada agotado esperando para reintentar", status)
+            self.stats["retries"] += 1
+            time.sleep(delay)
+
+    def _attempt(self, path: str, body: bytes, headers: dict, timeout_s: float) -> tuple:
+        '''One request on a pooled connection: (status, headers, body, None) or (None, {}, b"", exception).'''
+        connection = self.pool.acquire(timeout_s)
+        try:
+            connection.request("POST", self.pool.base_path + path, body=body, headers=headers)
+            response = connection.getresponse()
+            response_body = response.read()
+        except (OSError, http.client.HTTPException) as error:
+            # Covers timeouts, refused connections and keep-alive connections closed by the server
+            self.pool.discard(connection)
+            return None, {}, b"", error
+
+        if response.will_close:
+            self.pool.discard(connection)
+        else:
+            self.pool.release(connection)
+        return response.status, response.headers, response_body, None
+
+    def close(self):
+        self.pool.close()
+
+
+class StubServer:
+    '''
+    Local HTTP server for tests that answers POSTs from a script of faults before replying normally.
+    Each fault is a dict with an optional "status", "headers", "body" and "delay_s"; once the script is
+    exhausted, every request gets 200 and response_body. Runs in a background thread on a free port.
+    '''
+
+    def __init__(self, response_body: dict, faults: list=None):
+        self.response_body = response_body
+        self.faults = list(faults or [])
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with stub.lock:
+                    stub.requests.append({"path": self.path, "headers": dict(self.headers), "payload": payload})
+                    stub.connections.add(self.client_address)
+                    fault = stub.faults.pop(0) if stub.faults else {}
+                if fault.get("delay_s"):
+                    time.sleep(fault["delay_s"])
+                data = json.dumps(fault.get("body", stub.response_body if "status" not in fault else {"error": fault["status"]})).encode("utf-8")
+                try:
+                    self.send_response(fault.get("status", 200))
+                    for name, value in fault.get("headers", {}).items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError, socket.timeout):
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
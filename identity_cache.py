@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+# Every IdentityCache created, so release() can drop a scenario list from all of them at once
+_CACHES = []
+
+
+class IdentityCache:
+    '''
+    Objects derived from a list (indexes, columns, states), keyed by the identity of the list.
+
+    Lists cannot be weakly referenced, so every entry keeps its list alive and checks it with "is" on lookup,
+    which also means an id can never be reused while its entry exists. To keep those references from living
+    forever the cache holds at most maxsize lists, evicting the least recently used one, and the owner of a
+    scenario (the pipeline or the service) calls release() when it is done with it.
+
+    Entries set with pin=True belong to an object that keeps updating them (a ClusterState and its AppNodeIndex)
+    and are never evicted, since a rebuilt copy would miss those updates; they stay until discard() or release().
+    '''
+
+    def __init__(self, maxsize: int=64):
+        '''
+        :param maxsize: Maximum number of lists kept alive by the cache
+        :type maxsize: int
+        '''
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.pinned = set()
+        _CACHES.append(self)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key_list: list):
+        '''Returns the object cached for key_list, or None.'''
+        entry = self.entries.get(id(key_list))
+        if entry is None or entry[0] is not key_list:
+            return None
+        self.entries.move_to_end(id(key_list))
+        return entry[1]
+
+    def get_or_build(self, key_list: list, build, pin: bool=False):
+        '''
+        Returns the object cached for key_list, calling build(key_list) and caching it the first time.
+        With pin=True the entry (new or not) is also pinned.
+        '''
+        value = self.get(key_list)
+        if value is None:
+            value = build(key_list)
+            self.set(key_list, value, pin)
+        elif pin:
+            self.pinned.add(id(key_list))
+        return value
+
+    def set(self, key_list: list, value, pin: bool=False):
+        '''Caches value for key_list, evicting the least recently used unpinned list if the cache is full.'''
+        self.entries[id(key_list)] = (key_list, value)
+        self.entries.move_to_end(id(key_list))
+        if pin:
+            self.pinned.add(id(key_list))
+        if len(self.entries) > self.maxsize:
+            for key in [key for key in self.entries if key not in self.pinned][:len(self.entries) - self.maxsize]:
+                del self.entries[key]
+
+    def discard(self, key_list: list, value=None):
+        '''Drops (and unpins) the entry of key_list, only if it caches value when value is given.'''
+        entry = self.entries.get(id(key_list))
+        if entry is not None and entry[0] is key_list and (value is None or entry[1] is value):
+            del self.entries[id(key_list)]
+            self.pinned.discard(id(key_list))
+
+    def clear(self):
+        self.entries.clear()
+        self.pinned.clear()
+
+
+def release(key_list: list):
+    '''Drops key_list from every IdentityCache, so neither the list nor the objects built from it are kept alive.'''
+    for cache in _CACHES:
+        cache.discard(key_list)
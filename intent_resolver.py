@@ -0,0 +1,292 @@
+import json
+import math
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from hackathon_functions import KPIS_ORDER_OPERAND
+
+# Object pronouns Spanish attaches to imperatives and infinitives ("despliegala", "paralos", "lanzame")
+CLITIC = r"(?:me|nos|lo|la|los|las|le|les)?"
+
+# Verbs (accent-free, lowercase) that identify each function, matched as whole words or phrases
+INTENT_PATTERNS = {
+    "deploy_app": r"\b(?:despliega|desplieguen|despliegue|desplegar|lanza|lancen|lanzar|inicia|inicien|iniciar|arranca|arranquen|arrancar|ejecuta|ejecuten|ejecutar|pon|ponga|poner|instala|instalar)" + CLITIC + r"\b|\b(?:instancia|replica|usar)\b",
+    "migrate_app": r"\b(?:migra|migren|migrar|mueve|muevan|mover|traslada|trasladen|trasladar)" + CLITIC + r"\b|\botro nodo\b",
+    "stop_app": r"\bpara(?:me|lo|la|los|las)\b|(?:^|[.,;:!?]\s*|\by\s+)para (?:el|la|los|las)\b|\b(?:apaga|apaguen|apagar|paren|parar|deten|detengan|detener|corta|corten|cortar|quita|quiten|quitar|mata|maten|matar|elimina|eliminen|eliminar|libera|liberar)" + CLITIC + r"\b|\b(?:ha|han) (?:terminado|acabado|finalizado)\b",
+}
+
+# Words that describe the current situation rather than a requirement; their numbers must not become arguments
+SITUATION_PATTERN = r"\b(actual|actualmente|tiene|ping|lag|ahora)\b"
+
+# Negation or cancellation right before the verb ("no lo despliegues", "mejor no", "cancela el despliegue")
+NEGATION_PATTERN = r"\b(no|nunca|jamas|tampoco|ni|sin)\W+(?:\w+\W+){0,2}$"
+CANCEL_PATTERN = r"\b(cancel\w*|anul\w*|olvid\w*|deshaz|deshacer|revert\w*|revierte)\b"
+
+# Memory and storage requests are not KPIs of the placement functions; the model decides what to do with them
+RESOURCE_PATTERN = r"\b(ram|memoria|disco|almacenamiento|storage|ssd|hdd)\b|\d\s*(?:[kmgt]i?b)\b"
+
+# Phrasing that makes a number an upper or a lower bound, written before or after it
+UPPER_BOUND_BEFORE = r"(menos de|menor (?:de|que|a)|inferior a|por debajo de|bajo|como maximo|como mucho|maximo(?: de| del)?|no mas de|hasta|a lo sumo|<=?)\W*$"
+LOWER_BOUND_BEFORE = r"(mas de|mayor (?:de|que|a)|superior a|por encima de|sobre|como minimo|minimo(?: de| del)?|al menos|por lo menos|>=?)\W*$"
+UPPER_BOUND_AFTER = r"^\W*(o menos|como maximo|como mucho|o inferior)\b"
+LOWER_BOUND_AFTER = r"^\W*(o mas|como minimo|o superior)\b"
+
+NUMBER = r"(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+
+# (kpi_name, regex with the number as group 1, optional conversion of the matched value)
+KPI_PATTERNS = [
+    ("latency_ms", r"latencia\D{0,20}?" + NUMBER + r"\s*ms\b", None),
+    ("latency_ms", r"latencia\s+" + NUMBER + r"(?!\s*[%\d])", None),
+    ("throughput_mbps", NUMBER + r"\s*mbps\b", None),
+    ("throughput_mbps", NUMBER + r"\s*gbps\b", lambda value: value * 1000),
+    ("availability_percent", r"disponibilidad\D{0,10}?" + NUMBER + r"\s*%", None),
+    ("availability_percent", r"disponibilidad\D{0,10}?" + r"(\d)\s*nueves", lambda value: round(100 - 100 / 10 ** value, int(value))),
+    ("packet_loss_percent", r"(?:packet loss|perdida de paquetes)\D{0,20}?" + NUMBER + r"\s*%?", None),
+    ("connection_density", r"densidad\D{0,15}?" + NUMBER, None),
+    ("connection_density", NUMBER + r"\s*(?:conexiones|dispositivos|sensores|usuarios)\b", None),
+]
+
+# Textual energy efficiency levels and the value used in the scenarios
+EFFICIENCY_LEVELS = {"alta": 1, "high": 1, "media": 0.5, "medium": 0.5, "baja": 0, "low": 0}
+EFFICIENCY_PATTERN = r"eficiencia(?: energetica)?\W{0,3}(?:sea\W{0,3})?(alta|high|media|medium|baja|low)\b"
+
+STOPWORDS = {"aplicacion", "sistema", "tiempo", "real", "para", "desde", "donde", "entre", "sobre", "mediante", "cada", "toda", "miles", "cientos"}
+
+
+def normalize(text: str) -> str:
+    '''Lowercase text without accents, so that "Despliégala" and "despliegala" compare equal.'''
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def _to_number(text: str):
+    value = float(text.replace(",", ""))
+    return int(value) if value.is_integer() else value
+
+
+def _stem(word: str) -> str:
+    return word[:6]
+
+
+class IntentResolver:
+    '''
+    Deterministic pre-router that turns unambiguous queries into the {"function": [...]} structure of gemini_api_call.
+
+    An app is recognised by its name or app_id written in the query, or, if no app is named, by the keywords of its
+    description when one app clearly outscores the rest. Each app needs exactly one intent verb, and every number
+    in the query must be explained by a latency, throughput, availability, packet loss or density pattern, phrased
+    as the bound (maximum or minimum) its KPI takes. Negated or cancelled verbs and RAM or storage requests are
+    left to the model. Whenever any of that fails, resolve returns None and the query goes to Gemini.
+    '''
+
+    def __init__(self, apps_dataset: dict, keyword_min_score: float=4.0, keyword_margin: float=2.0):
+        '''
+        :param apps_dataset: Dataset containing the applications, keyed by name
+        :type apps_dataset: dict
+        :param keyword_min_score: Minimum description keyword score to accept an app that is not named
+        :type keyword_min_score: float
+        :param keyword_margin: Ratio the best keyword score must have over the second one
+        :type keyword_margin: float
+        '''
+        self.keyword_min_score = keyword_min_score
+        self.keyword_margin = keyword_margin
+        self.hits = 0
+        self.calls = 0
+        # The counters are shared by the threads of the concurrent executor
+        self.lock = threading.Lock()
+
+        # Normalized name or app_id -> app name, longest first so that overlapping names prefer the longer one
+        aliases = {}
+        for app_name, app in apps_dataset.items():
+            aliases[normalize(app_name)] = app_name
+            aliases[normalize(app["app_id"])] = app_name
+        self.aliases = sorted(aliases.items(), key=lambda alias: -len(alias[0]))
+        self.alias_patterns = [(re.compile(r"(?<!\w)" + re.escape(alias) + r"(?!\w)"), app_name) for alias, app_name in self.aliases]
+
+        # Inverted index of description keyword stems, weighted by inverse document frequency
+        self.keyword_index = defaultdict(set)
+        for app_name, app in apps_dataset.items():
+            for word in re.findall(r"\w+", normalize(app["description"] + " " + app_name)):
+                if len(word) >= 5 and word not in STOPWORDS:
+                    self.keyword_index[_stem(word)].add(app_name)
+        self.idf = {stem: math.log(len(apps_dataset) / len(apps)) for stem, apps in self.keyword_index.items()}
+
+    def find_apps(self, text: str) -> list:
+        '''Returns the (start, end, app_name) mentions of app names or ids in normalized text, in order.'''
+        mentions = []
+        taken = [False] * len(text)
+        for pattern, app_name in self.alias_patterns:
+            for match in pattern.finditer(text):
+                if not any(taken[match.start():match.end()]):
+                    mentions.append((match.start(), match.end(), app_name))
+                    for i in range(match.start(), match.end()):
+                        taken[i] = True
+        return sorted(mentions)
+
+    def keyword_app(self, text: str):
+        '''Returns the app whose description keywords best match text, if the match is clear enough, or None.'''
+        scores = defaultdict(float)
+        for stem in {_stem(word) for word in re.findall(r"\w+", text) if len(word) >= 5 and word not in STOPWORDS}:
+            for app_name in self.keyword_index.get(stem, ()):
+                scores[app_name] += self.idf[stem]
+        ranking = sorted(scores.items(), key=lambda item: -item[1])
+        if not ranking or ranking[0][1] < self.keyword_min_score:
+            return None
+        if len(ranking) > 1 and ranking[0][1] < self.keyword_margin * ranking[1][1]:
+            return None
+        return ranking[0][0]
+
+    @staticmethod
+    def intent(text: str):
+        '''Returns the only function whose verbs appear in text, or None if there are none or several.'''
+        found = [function_name for function_name, pattern in INTENT_PATTERNS.items() if re.search(pattern, text)]
+        return found[0] if len(found) == 1 else None
+
+    @staticmethod
+    def negated(text: str) -> bool:
+        '''Returns True if some intent verb of text is preceded by a negation ("no lo despliegues", "mejor no apagues").'''
+        for pattern in INTENT_PATTERNS.values():
+            for match in re.finditer(pattern, text):
+                if re.search(NEGATION_PATTERN, text[max(0, match.start() - 40):match.start()]):
+                    return True
+        return False
+
+    @staticmethod
+    def extract_kpis(text: str):
+        '''
+        Extracts the KPI arguments of text. Returns None if a number is left unexplained, a KPI gets two values or
+        a value is phrased as the opposite bound of its KPI ("menos de 2 Gbps" cannot be a minimum throughput).
+
+        :param text: Normalized text of one app clause, without the app name
+        :type text: str
+        :return: KPI arguments
+        :rtype: dict
+        '''
+        kpis = {}
+        consumed = []
+        for kpi_name, pattern, convert in KPI_PATTERNS:
+            for match in re.finditer(pattern, text):
+                value = _to_number(match.group(1))
+                if convert is not None:
+                    value = convert(value)
+                    value = int(value) if float(value).is_integer() else value
+                if kpi_name in kpis and kpis[kpi_name] != value:
+                    return None
+                before = text[max(0, match.start(1) - 25):match.start(1)]
+                after = text[match.end():match.end() + 20]
+                upper = re.search(UPPER_BOUND_BEFORE, before) or re.search(UPPER_BOUND_AFTER, after)
+                lower = re.search(LOWER_BOUND_BEFORE, before) or re.search(LOWER_BOUND_AFTER, after)
+                # Users give a maximum of the KPIs where lower is better (operand 1) and a minimum of the rest
+                if (upper and KPIS_ORDER_OPERAND[kpi_name] < 0) or (lower and KPIS_ORDER_OPERAND[kpi_name] > 0):
+                    return None
+                kpis[kpi_name] = value
+                consumed.append(match.span(1))
+
+        match = re.search(EFFICIENCY_PATTERN, text)
+        if match:
+            kpis["energy_efficiency"] = EFFICIENCY_LEVELS[match.group(1)]
+
+        # Units such as km2 are not quantities
+        for match in re.finditer(NUMBER, re.sub(r"km2|km²", "   ", text)):
+            if not any(start <= match.start() < end for start, end in consumed):
+                return None
+        return kpis
+
+    def resolve(self, query: str):
+        '''
+        Resolves query locally if it is unambiguous.
+
+        :param query: The user query
+        :type query: str
+        :return: Result with the same structure as gemini_api_call (no tokens spent), or None to fall back to Gemini
+        :rtype: dict
+        '''
+        with self.lock:
+            self.calls += 1
+        text = normalize(query)
+        if re.search(SITUATION_PATTERN, text) or re.search(RESOURCE_PATTERN, text) or re.search(CANCEL_PATTERN, text):
+            return None
+        if self.negated(text):
+            return None
+
+        mentions = self.find_apps(text)
+        if not mentions:
+            app_name = self.keyword_app(text)
+            if app_name is None:
+                return None
+            mentions = [(0, 0, app_name)]
+
+        functions = []
+        for i, (start, end, app_name) in enumerate(mentions):
+            previous_end = mentions[i - 1][1] if i > 0 else 0
+            next_start = mentions[i + 1][0] if i + 1 < len(mentions) else len(text)
+
+            prefix = text[previous_end:start]
+            suffix = text[end:next_start]
+
+            # The verb is searched before the app first ("Apaga X"), then after it ("X ha terminado"). Only the last
+            # app can take the verb after it: for an earlier one that text starts the clause of the next app
+            function_name = self.intent(prefix)
+            if function_name is None and i == len(mentions) - 1:
+                function_name = self.intent(suffix)
+            if function_name is None:
+                return None
+
+            # Numbers between two apps belong to the first one; the first app also takes the text before it
+            clause = (prefix if i == 0 else "") + " " + suffix
+            kpis = self.extract_kpis(clause)
+            if kpis is None:
+                return None
+
+            args = {"app_name": app_name}
+            if function_name != "stop_app":
+                args.update(kpis)
+            elif kpis:
+                return None
+            functions.append({"function_name": function_name, "args": args})
+
+        with self.lock:
+            self.hits += 1
+        return {"function": functions, "prompt_tokens": 0, "completion_tokens": 0}
+
+
+def evaluate_resolver(resolver: IntentResolver, solutions_path: str="test-queries-with-solutions.json") -> dict:
+    '''
+    Runs the resolver over every query of the solutions file and compares the resolved calls with expected_result.
+
+    :return: Number of queries, local hits, hit rate, correct hits, accuracy on hits and the wrong resolutions
+    :rtype: dict
+    '''
+    with open(solutions_path, "r", encoding="utf-8") as f:
+        solutions = json.load(f)
+
+    total = hits = correct = 0
+    wrong = []
+    for expected_list in solutions.values():
+        for expected_item in expected_list:
+            total += 1
+            resolved = resolver.resolve(expected_item["query"])
+            if resolved is None:
+                continue
+            hits += 1
+            if resolved["function"] == expected_item["expected_result"]["function"]:
+                correct += 1
+            else:
+                wrong.append({"query": expected_item["query"], "expected": expected_item["expected_result"]["function"], "resolved": resolved["function"]})
+
+    return {
+        "queries": total,
+        "hits": hits,
+        "hit_rate": hits / total if total else 0.0,
+        "correct": correct,
+        "accuracy": correct / hits if hits else 0.0,
+        "wrong": wrong,
+    }
+
+
+if __name__ == "__main__":
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    print(json.dumps(evaluate_resolver(IntentResolver(apps_dataset)), indent=4, ensure_ascii=False))
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time
+
+from llm_cache import cache_key
+
+
+def prompt_query(prompt) -> str:
+    '''
+    Returns the user query of a prompt: the text of the last user message, or the prompt itself if it is a string.
+
+    :param prompt: Prompt, as a string or a list of role/parts messages
+    :return: Query text
+    :rtype: str
+    '''
+    if isinstance(prompt, str):
+        return prompt
+    for message in reversed(prompt):
+        if message.get("role") == "user":
+            return "".join(part.get("text", "") for part in message.get("parts", []))
+    return ""
+
+
+def estimate_tokens(prompt) -> int:
+    '''Rough token count of a prompt (about 4 characters per token), used by offline backends.'''
+    text = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False)
+    return len(text) // 4
+
+
+class GeminiBackend:
+    '''Backend that performs the real call to the Gemini API.'''
+
+    # Identity of the answers in the response cache keys; the real model ones are shared by every real backend
+    cache_identity = "gemini"
+
+    def generate(self, tools_list, prompt) -> dict:
+        from hackathon_functions import gemini_generate_content
+        return gemini_generate_content(tools_list, prompt)
+
+
+class GeminiRestBackend:
+    '''
+    Backend that calls the generateContent REST endpoint of Gemini through an HttpTransport (see http_transport.py),
+    so the calls share keep-alive connections, retry transient errors with backoff and stop at a deadline.
+    The function declarations are sent as they are, so they must follow the REST schema.
+    '''
+
+    cache_identity = "gemini"
+
+    def __init__(self, api_key: str=None, base_url: str="https://generativelanguage.googleapis.com", transport=None, deadline_s: float=60.0):
+        '''
+        :param api_key: Gemini API key, GEMINI_API_KEY (or .env) by default
+        :type api_key: str
+        :param base_url: API root, replaced by the URL of a StubServer in tests
+        :type base_url: str
+        :param transport: HttpTransport to use instead of a default one for base_url
+        :param deadline_s: Maximum seconds per call, retries included
+        :type deadline_s: float
+        '''
+        from http_transport import HttpTransport
+
+        if api_key is None:
+            import dotenv
+            dotenv.load_dotenv()
+            api_key = os.getenv("GEMINI_API_KEY")
+        self.api_key = api_key
+        self.transport = transport if transport is not None else HttpTransport(base_url)
+        self.deadline_s = deadline_s
+
+    def generate(self, tools_list, prompt) -> dict:
+        from hackathon_functions import GEMINI_MODEL
+
+        contents = [{"role": "user", "parts": [{"text": prompt}]}] if isinstance(prompt, str) else prompt
+        payload = {
+            "contents": contents,
+            "tools": [{"functionDeclarations": tools_list}],
+            "toolConfig": {"functionCallingConfig": {"mode": "ANY"}},
+        }
+        response = self.transport.post_json(f"/v1beta/models/{GEMINI_MODEL}:generateContent", payload,
+                                            headers={"x-goog-api-key": self.api_key or ""}, deadline_s=self.deadline_s)
+
+        function_calls = []
+        for candidate in response.get("candidates", []):
+            for part in candidate.get("content", {}).get("parts", []):
+                if "functionCall" in part:
+                    function_calls.append({"function_name": part["functionCall"]["name"], "args": part["functionCall"].get("args", {})})
+        usage = response.get("usageMetadata", {})
+        return {
+            "function": function_calls,
+            "prompt_tokens": usage.get("promptTokenCount", 0),
+            "completion_tokens": usage.get("candidatesTokenCount", 0),
+        }
+
+
+class RecordingBackend:
+    '''
+    Backend that forwards every call to another backend and appends the response to a JSONL file,
+    one line per call with the content key, the query and the result.
+    '''
+
+    def __init__(self, record_path: str, backend=None):
+        '''
+        :param record_path: JSONL file where the responses are appended
+        :type record_path: str
+        :param backend: Backend that answers the calls, the real Gemini API by default
+        '''
+        self.record_path = record_path
+        self.backend = backend if backend is not None else GeminiBackend()
+        self.cache_identity = getattr(self.backend, "cache_identity", type(self.backend).__name__)
+
+    def generate(self, tools_list, prompt) -> dict:
+        from hackathon_functions import GEMINI_MODEL
+
+        result = self.backend.generate(tools_list, prompt)
+        record = {
+            "key": cache_key(GEMINI_MODEL, prompt, tools_list),
+            "query": prompt_query(prompt),
+            "result": result,
+        }
+        with open(self.record_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return result
+
+
+class ReplayBackend:
+    '''
+    Offline backend that answers from previously known responses, with an optional injected latency.
+
+    A call is looked up first by its exact content key (model, prompt and tools), then by the query text alone,
+    so recordings remain usable after a change in the context prompt. Unknown queries get no function calls.
+    '''
+
+    def __init__(self, by_key: dict=None, by_query: dict=None, latency_s: float=0.0, cache_identity: str="replay"):
+        '''
+        :param by_key: Results indexed by cache_key
+        :type by_key: dict
+        :param by_query: Results indexed by query text
+        :type by_query: dict
+        :param latency_s: Seconds to wait before answering each call, to emulate the network
+        :type latency_s: float
+        :param cache_identity: Identity of these answers in the response cache keys ("replay" or "stub")
+        :type cache_identity: str
+        '''
+        self.by_key = by_key or {}
+        self.by_query = by_query or {}
+        self.latency_s = latency_s
+        self.cache_identity = cache_identity
+        self.calls = 0
+        self.misses = 0
+        # generate runs in worker threads when calls are concurrent
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_recording(cls, record_path: str, latency_s: float=0.0):
+        '''Builds a replay backend from a JSONL file written by RecordingBackend.'''
+        by_key = {}
+        by_query = {}
+        if os.path.isfile(record_path):
+            with open(record_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        by_key[record["key"]] = record["result"]
+                        by_query[record["query"]] = record["result"]
+        return cls(by_key, by_query, latency_s)
+
+    @classmethod
+    def from_solutions(cls, solutions_path: str="test-queries-with-solutions.json", latency_s: float=0.0):
+        '''Builds a stub backend that answers each test query with its expected_result.'''
+        with open(solutions_path, "r", encoding="utf-8") as f:
+            solutions = json.load(f)
+
+        by_query = {}
+        for expected_list in solutions.values():
+            for expected_item in expected_list:
+                functions = expected_item["expected_result"]["function"]
+                by_query[expected_item["query"]] = {
+                    "function": functions,
+                    "prompt_tokens": 0,
+                    "completion_tokens": estimate_tokens(json.dumps(functions, ensure_ascii=False)),
+                }
+        return cls(by_query=by_query, latency_s=latency_s, cache_identity="stub")
+
+    def generate(self, tools_list, prompt) -> dict:
+        from hackathon_functions import GEMINI_MODEL
+
+        with self.lock:
+            self.calls += 1
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+
+        result = None
+        if self.by_key:
+            result = self.by_key.get(cache_key(GEMINI_MODEL, prompt, tools_list))
+        if result is None:
+            result = self.by_query.get(prompt_query(prompt))
+        if result is None:
+            with self.lock:
+                self.misses += 1
+            return {"function": [], "prompt_tokens": estimate_tokens(prompt), "completion_tokens": 0}
+
+        # Prompt tokens of the stub follow the prompt actually sent, so prompt size changes stay visible
+        return {
+            "function": result["function"],
+            "prompt_tokens": result["prompt_tokens"] or estimate_tokens(prompt),
+            "completion_tokens": result["completion_tokens"],
+        }
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+def cache_key(model: str, prompt, tools_list: list, backend: str="gemini") -> str:
+    '''
+    Content address of a Gemini call: SHA-256 of the model, the prompt (context prompt and query) and the tools,
+    plus the backend identity when the answers do not come from the real model, so that stub or replayed
+    answers never satisfy a later real run.
+
+    :param model: Gemini model name
+    :type model: str
+    :param prompt: Prompt sent to the model, a string or the list of role/parts messages
+    :param tools_list: Function declarations given to the model
+    :type tools_list: list
+    :param backend: Identity of the backend that answers the call ("gemini" for the real model)
+    :type backend: str
+    :return: Hex digest identifying the call
+    :rtype: str
+    '''
+    fields = [model, prompt, tools_list] if backend == "gemini" else [backend, model, prompt, tools_list]
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    '''
+    Two level cache of gemini_api_call results: an in-memory LRU in front of a directory with one JSON file per call.
+
+    The stored result keeps prompt_tokens and completion_tokens, so a hit reports the same token accounting as the
+    original call. When the directory grows over max_disk_bytes, the least recently used files are deleted.
+    Lookups, stores and counters are guarded by a lock, so the cache can be shared by the threads of the
+    concurrent executor; the call itself runs outside the lock.
+    '''
+
+    def __init__(self, cache_dir: str=".llm_cache", max_memory_entries: int=1024, max_disk_bytes: int=256 * 1024 * 1024):
+        '''
+        :param cache_dir: Directory of the on-disk store, created if needed
+        :type cache_dir: str
+        :param max_memory_entries: Number of results kept in the in-memory LRU
+        :type max_memory_entries: int
+        :param max_disk_bytes: Size limit of the on-disk store
+        :type max_disk_bytes: int
+        '''
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_saved = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Size of every file on disk, ordered from least to most recently used
+        files = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".json"):
+                stat = os.stat(os.path.join(cache_dir, name))
+                files.append((stat.st_mtime, name[:-len(".json")], stat.st_size))
+        self.disk = OrderedDict((key, size) for _, key, size in sorted(files))
+        self.disk_bytes = sum(self.disk.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _remember(self, key: str, result: dict):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str):
+        '''Returns the cached result for key, or None.'''
+        with self.lock:
+            return self._get(key)
+
+    def _get(self, key: str):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+
+        if key not in self.disk:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            self.disk_bytes -= self.disk.pop(key)
+            return None
+        os.utime(self._path(key))
+        self.disk.move_to_end(key)
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: dict):
+        '''Stores result in both levels and evicts the oldest files if the disk limit is exceeded.'''
+        with self.lock:
+            self._put(key, result)
+
+    def _put(self, key: str, result: dict):
+        self._remember(key, result)
+
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+
+        self.disk_bytes += len(data) - self.disk.pop(key, 0)
+        self.disk[key] = len(data)
+        while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+            old_key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.memory.pop(old_key, None)
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def get_or_call(self, model: str, prompt, tools_list: list, call, backend: str="gemini") -> dict:
+        '''
+        Returns the cached result of the call, or runs call() and caches its result.
+        Responses without function calls are not cached, so they are retried on the next run.
+
+        :param model: Gemini model name
+        :type model: str
+        :param prompt: Prompt sent to the model
+        :param tools_list: Function declarations given to the model
+        :type tools_list: list
+        :param call: Function without arguments that performs the real call
+        :type call: callable
+        :param backend: Identity of the backend behind call, part of the key
+        :type backend: str
+        :return: Result with function, prompt_tokens and completion_tokens, as gemini_api_call
+        :rtype: dict
+        '''
+        key = cache_key(model, prompt, tools_list, backend)
+        with self.lock:
+            result = self._get(key)
+            if result is not None:
+                self.hits += 1
+                self.tokens_saved += result["prompt_tokens"] + result["completion_tokens"]
+                return result
+            self.misses += 1
+
+        result = call()
+        if result["function"]:
+            self.put(key, result)
+        return result
+
+    def stats(self) -> dict:
+        '''Returns hits, misses, tokens saved and the current size of both levels.'''
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "tokens_saved": self.tokens_saved,
+                "memory_entries": len(self.memory),
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+            }
@@ -1,45 +1,355 @@
+import argparse
 import json
 import os
 import time
 
+from results_writer import ResultsWriter, compact_results
+from tracing import TRACER
+
 tokens_count_total = 0
 
-def append_to_results_file(query:str, response: str, test_i: str, state: str, chosen_node: str="N/A"):
+# State of a worker process of --workers mode, filled once by _init_worker
+_WORKER = {}
+
+def build_complete_system_prompt(context_prompt: str, query: str) -> list:
     '''
-    Function to append results to a JSON file.
-    
+    Builds the messages sent to Gemini for one query: the context prompt as a model message followed by the user query.
+
+    :param context_prompt: Context prompt of the test
+    :type context_prompt: str
     :param query: The user query
     :type query: str
-    :param response: The model response, with function calls
-    :type response: str
+    :return: List of role/parts messages
+    :rtype: list
+    '''
+    complete_system_prompt = [
+        {
+            "role": "model",
+            "parts": [
+                {
+                "text": context_prompt
+                }
+            ]
+        },
+    ]
+
+    complete_system_prompt.append(
+        {
+            "role": "user",
+            "parts": [
+                {
+                    "text": query
+                }
+            ]
+        }
+    )
+    return complete_system_prompt
+
+
+def configure_pipeline(cli_args) -> dict:
+    '''
+    Applies the --debug, --llm-backend, --llm-cache and --fast-path options to hackathon_functions and builds the
+    --retrieve-apps index. Runs in the main process and, in --workers mode, once in every worker process.
+
+    :param cli_args: Parsed command line arguments
+    :type cli_args: argparse.Namespace
+    :return: paced flag (fixed sleep between queries), llm_cache, intent_resolver and retriever (None when not enabled)
+    :rtype: dict
+    '''
+    import hackathon_functions
+    if cli_args.debug:
+        hackathon_functions.DEBUG = True
+
+    # Only the SDK calls need the fixed sleep; offline backends have no limits and the http one retries 429s itself
+    paced = cli_args.llm_backend in ("gemini", "record")
+    if cli_args.llm_backend != "gemini":
+        from llm_backends import GeminiRestBackend, RecordingBackend, ReplayBackend
+        if cli_args.llm_backend == "http":
+            hackathon_functions.set_llm_backend(GeminiRestBackend(deadline_s=cli_args.llm_deadline))
+        elif cli_args.llm_backend == "record":
+            hackathon_functions.set_llm_backend(RecordingBackend(cli_args.llm_record_file))
+        elif cli_args.llm_backend == "replay":
+            hackathon_functions.set_llm_backend(ReplayBackend.from_recording(cli_args.llm_record_file, cli_args.llm_latency))
+        else:
+            hackathon_functions.set_llm_backend(ReplayBackend.from_solutions("test-queries-with-solutions.json", cli_args.llm_latency))
+
+    llm_cache = None
+    if cli_args.llm_cache:
+        from llm_cache import LLMResponseCache
+        llm_cache = LLMResponseCache(cli_args.llm_cache)
+        hackathon_functions.set_llm_cache(llm_cache)
+
+    intent_resolver = None
+    if cli_args.fast_path:
+        from intent_resolver import IntentResolver
+        with open("apps.json", "r") as f:
+            intent_resolver = IntentResolver(json.load(f))
+        hackathon_functions.set_intent_resolver(intent_resolver)
+
+    retriever = None
+    if cli_args.retrieve_apps:
+        from app_retriever import AppRetriever
+        with open("apps.json", "r") as f:
+            retriever = AppRetriever(json.load(f), cli_args.retrieve_apps)
+
+    return {"paced": paced, "llm_cache": llm_cache, "intent_resolver": intent_resolver, "retriever": retriever}
+
+def run_queries(test_i: str, queries: list, context_prompt: str, functions: dict, apps_dataset: dict, scenario_nodes: list,
+                cli_args, pipeline: dict, results_writer: ResultsWriter, query_offset: int=0) -> int:
+    '''
+    Sends the queries of one test (or a chunk of them) to Gemini, processes the function calls and appends the results.
+
     :param test_i: Test identifier
     :type test_i: str
-    :param state: The result state after executing the function
-    :type state: str
-    :param chosen_node: The node chosen for the app placement
-    :type chosen_node: str
+    :param queries: User queries, in order
+    :type queries: list
+    :param functions: Function declarations of functions.json
+    :type functions: dict
+    :param scenario_nodes: List of edge nodes of the test scenario
+    :type scenario_nodes: list
+    :param pipeline: Result of configure_pipeline
+    :type pipeline: dict
+    :param query_offset: Position of the first query within the test, used in the trace attributes
+    :type query_offset: int
+    :return: Prompt plus completion tokens spent
+    :rtype: int
+    '''
+    from hackathon_functions import task_call_gemini, task_process_function_calls
+
+    tokens_count = 0
+
+    # In stateful mode the placements of each query are applied to the scenario before the next one
+    cluster_state = None
+    if cli_args.stateful:
+        from cluster_state import ClusterState
+        cluster_state = ClusterState(scenario_nodes, apps_dataset)
+
+    # With --retrieve-apps every query gets its own context prompt, with only its relevant apps and nodes
+    retriever = pipeline["retriever"]
+    def query_prompt(query: str) -> list:
+        if retriever is None:
+            return build_complete_system_prompt(context_prompt, query)
+        return build_complete_system_prompt(retriever.context_prompt(query, scenario_nodes), query)
+
+    # In concurrent mode all the Gemini calls of the test are issued first; responses keep the order of the queries
+    responses = None
+    if cli_args.concurrency > 1:
+        from async_executor import PACED_REQUESTS_PER_MINUTE, execute_queries_concurrently
+        responses = execute_queries_concurrently(
+            [query_prompt(query) for query in queries],
+            {"deploy_app": functions["deploy_app"], "migrate_app": functions["migrate_app"], "stop_app": functions["stop_app"]},
+            max_in_flight=cli_args.concurrency,
+            requests_per_minute=cli_args.rpm or (PACED_REQUESTS_PER_MINUTE if pipeline["paced"] else None),
+            tokens_per_minute=cli_args.tpm,
+        )
+
+    #---------------------------- QUERIES LOOP: PROCESS EACH USER QUERY ------------------#
+    for query_i, query in enumerate(queries, start=query_offset):
+        ############################################### TASK:CALL GEMINI WITH TOOLS ################################################
+        if responses is not None:
+            response = responses[query_i - query_offset]
+        else:
+            response = task_call_gemini(
+                complete_system_prompt=query_prompt(query),
+                deploy_app=functions["deploy_app"],
+                migrate_app=functions["migrate_app"],
+                stop_app=functions["stop_app"],
+            )
+        ###################################################### END TASK CALL GEMINI WITH TOOLS ################################################
+
+        print(f"--- Query: {query} ---")
+        print(f"Respuesta del modelo: {response} \n")
+
+        # In case there is more than one function call in the response, we process them all
+        states = []
+        chosen_nodes = []
+
+        ################################## TASK:PROCESS FUNCTION CALLS ################################################
+
+        for function in response["function"]:
+            with TRACER.span("process_function_call", test=test_i, query=query_i, function=function["function_name"]):
+                if cluster_state is not None:
+                    state, chosen_node = cluster_state.process(function)
+                else:
+                    state, chosen_node = task_process_function_calls(function, apps_dataset, scenario_nodes)
+
+        ################################## END TASK PROCESS FUNCTION CALLS ################################################
+
+            # Append individual function result
+            print(f"Resultado de la función: {state} \n")
+            states.append(state)
+            chosen_nodes.append(chosen_node)
+
+        # Append results to file to analyze later
+        with TRACER.span("result_write", test=test_i, query=query_i, prompt_tokens=response["prompt_tokens"], completion_tokens=response["completion_tokens"]):
+            results_writer.append(query, response, test_i, states, chosen_nodes)
+        tokens_count += response["prompt_tokens"] + response["completion_tokens"]
+
+        # Sleep between queries to avoid rate limits (not needed offline or with the retrying http backend, and replaced by the rate limiter in concurrent mode)
+        if pipeline["paced"] and responses is None:
+            time.sleep(1)
+
+    # The state pins the indexes of the scenario in the caches until the test is over
+    if cluster_state is not None:
+        cluster_state.detach()
+
+    return tokens_count
+
+def load_datasets(cli_args) -> tuple:
     '''
-    if "results.json" not in os.listdir():
-        with open("results.json", "w") as f:
-            json.dump({test_i: []}, f, indent=4)
-    
-    if os.path.getsize("results.json") == 0:
-        with open("results.json", "w") as f:
-            json.dump({test_i: []}, f, indent=4)
+    Loads apps.json and scenarios.json, as slotted records (records.py, with a binary cache next to each file)
+    when --records is given and as plain dicts otherwise.
 
-    with open("results.json", "r") as f:
-        results_data = json.load(f)
+    :return: Applications dataset and scenarios dataset
+    :rtype: tuple
+    '''
+    if cli_args.records:
+        from records import load_apps, load_scenarios
+        return load_apps("apps.json"), load_scenarios("scenarios.json")
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    return apps_dataset, scenarios_dataset
+
+def make_shards(test_queries_dataset: dict, chunk_size: int=0) -> list:
+    '''
+    Splits the tests into the units of work of --workers mode, in the order their results go in results.json.
+
+    :param test_queries_dataset: Content of test-queries-with-solutions.json
+    :type test_queries_dataset: dict
+    :param chunk_size: Maximum queries per shard; 0 keeps every test in one shard
+    :type chunk_size: int
+    :return: (shard index, test identifier, position of the first query, queries) tuples
+    :rtype: list
+    '''
+    shards = []
+    for test_i, items in test_queries_dataset.items():
+        queries = [item["query"] for item in items]
+        step = chunk_size if chunk_size > 0 else max(len(queries), 1)
+        for start in range(0, len(queries), step):
+            shards.append((len(shards), test_i, start, queries[start:start + step]))
+    return shards
+
+def _init_worker(cli_args):
+    '''Initializer of the worker processes: configures the pipeline and loads the datasets once per process.'''
+    if cli_args.trace:
+        TRACER.enable()
+    from tool_declarations import complete_functions
+    _WORKER["apps_dataset"], _WORKER["scenarios_dataset"] = load_datasets(cli_args)
+    with open("functions.json", "r") as f:
+        _WORKER["functions"] = complete_functions(json.load(f), _WORKER["apps_dataset"])
+    _WORKER["cli_args"] = cli_args
+    _WORKER["pipeline"] = configure_pipeline(cli_args)
+
+def _run_shard(shard: tuple) -> dict:
+    '''
+    Runs one shard in a worker process, writing its results to results.<shard index>.jsonl.
+
+    :param shard: One of the tuples of make_shards
+    :type shard: tuple
+    :return: Shard index, results path, worker pid, tokens, trace spans and fast path / cache counters of the shard
+    :rtype: dict
+    '''
+    from hackathon_functions import task_generate_context_prompt
+
+    shard_i, test_i, start, queries = shard
+    cli_args = _WORKER["cli_args"]
+    pipeline = _WORKER["pipeline"]
+    intent_resolver = pipeline["intent_resolver"]
+    llm_cache = pipeline["llm_cache"]
+    # Counters of the process before the shard, to report only what the shard added
+    resolver_before = (intent_resolver.hits, intent_resolver.calls) if intent_resolver is not None else (0, 0)
+    cache_before = llm_cache.stats() if llm_cache is not None else {}
+
+    print(f"------------------------------- TEST: {test_i} (queries {start}-{start + len(queries) - 1}, pid {os.getpid()}) -------------------------------\n")
+    path = f"results.{shard_i:04d}.jsonl"
+    with ResultsWriter(path) as results_writer:
+        with TRACER.span("context_prompt", test=test_i):
+            context_prompt = task_generate_context_prompt(_WORKER["apps_dataset"], _WORKER["scenarios_dataset"], _WORKER["functions"], test_i)
+        tokens = run_queries(test_i, queries, context_prompt, _WORKER["functions"], _WORKER["apps_dataset"], _WORKER["scenarios_dataset"][test_i],
+                             cli_args, pipeline, results_writer, query_offset=start)
+
+    spans = [dict(span, pid=os.getpid()) for span in TRACER.spans]
+    TRACER.spans.clear()
+    cache_after = llm_cache.stats() if llm_cache is not None else {}
+    return {
+        "shard": shard_i,
+        "path": path,
+        "pid": os.getpid(),
+        "tokens": tokens,
+        "spans": spans,
+        "fast_path": (intent_resolver.hits - resolver_before[0], intent_resolver.calls - resolver_before[1]) if intent_resolver is not None else (0, 0),
+        "llm_cache": {key: cache_after[key] - cache_before[key] for key in ("hits", "misses", "tokens_saved") if key in cache_after},
+    }
+
+def run_workers(test_queries_dataset: dict, cli_args) -> dict:
+    '''
+    Runs the shards of make_shards on a pool of cli_args.workers processes and compacts their results into results.json
+    in shard order, so the file is the same whatever the order in which the shards finish.
+
+    :param test_queries_dataset: Content of test-queries-with-solutions.json
+    :type test_queries_dataset: dict
+    :param cli_args: Parsed command line arguments
+    :type cli_args: argparse.Namespace
+    :return: Tokens spent by each worker pid, plus the merged fast path and cache counters
+    :rtype: dict
+    '''
+    from concurrent.futures import ProcessPoolExecutor
 
-        if test_i not in results_data:
-            results_data[test_i] = []
+    # A stateful test must see its queries in order in one process, so it is never split
+    chunk_size = 0 if cli_args.stateful else cli_args.chunk_size
+    shards = make_shards(test_queries_dataset, chunk_size)
 
-    results_data[test_i].append({"query": query, "execution_result": {"function": response["function"]}, "chosen_node": chosen_node, "state": state})
+    with ProcessPoolExecutor(max_workers=cli_args.workers, initializer=_init_worker, initargs=(cli_args,)) as executor:
+        shard_results = list(executor.map(_run_shard, shards))
 
-    with open("results.json", "w") as f:
-        json.dump(results_data, f, indent=4, ensure_ascii=False)
+    compact_results([shard_result["path"] for shard_result in shard_results], "results.json")
+    # results.json now holds every shard, so the per-shard files are not left behind in the working directory
+    for shard_result in shard_results:
+        os.remove(shard_result["path"])
+
+    tokens_per_worker = {}
+    fast_path = [0, 0]
+    llm_cache = {}
+    for shard_result in shard_results:
+        tokens_per_worker[shard_result["pid"]] = tokens_per_worker.get(shard_result["pid"], 0) + shard_result["tokens"]
+        TRACER.spans.extend(shard_result["spans"])
+        fast_path[0] += shard_result["fast_path"][0]
+        fast_path[1] += shard_result["fast_path"][1]
+        for key, value in shard_result["llm_cache"].items():
+            llm_cache[key] = llm_cache.get(key, 0) + value
+    return {"tokens_per_worker": tokens_per_worker, "fast_path": fast_path, "llm_cache": llm_cache}
+
+def build_parser() -> argparse.ArgumentParser:
+    '''Command line options of main.py, shared with the resident service of placement_service.py.'''
+    parser = argparse.ArgumentParser(description="Execute the test queries with Gemini and store the results in results.json")
+    parser.add_argument("--stateful", action="store_true", help="Commit every deploy/migrate/stop to the scenario so later calls see the updated CPU/RAM usage")
+    parser.add_argument("--llm-cache", metavar="DIR", default=None, help="Reuse Gemini responses stored in DIR and store the new ones, keyed by model, prompt, query and tools")
+    parser.add_argument("--llm-backend", choices=["gemini", "http", "record", "replay", "stub"], default="gemini", help="gemini calls the API with the SDK, http calls its REST endpoint with pooled connections, retries and a circuit breaker, record also saves every response, replay answers from saved responses and stub answers with the expected results of the test queries, both offline")
+    parser.add_argument("--llm-deadline", metavar="SECONDS", type=float, default=60.0, help="Maximum seconds per call of the http backend, retries included")
+    parser.add_argument("--llm-record-file", metavar="PATH", default="llm_recordings.jsonl", help="JSONL file written in record mode and read in replay mode")
+    parser.add_argument("--llm-latency", metavar="SECONDS", type=float, default=0.0, help="Latency injected in each replay/stub call")
+    parser.add_argument("--concurrency", metavar="N", type=int, default=1, help="Maximum number of Gemini calls in flight; above 1 the queries of each test are sent concurrently")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed in concurrent mode (60 by default with the gemini and record backends)")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed in concurrent mode")
+    parser.add_argument("--retrieve-apps", metavar="K", type=int, default=0, help="Send with each query only its K most relevant apps (and their nodes) instead of the whole catalogue; 0 sends the whole context prompt")
+    parser.add_argument("--fast-path", action="store_true", help="Resolve unambiguous queries locally (app name, intent verb and KPIs found in the text) and only send the rest to Gemini")
+    parser.add_argument("--trace", metavar="PATH", default=None, help="Record timing spans of every stage, print a summary and save them as a JSON trace in PATH")
+    parser.add_argument("--debug", action="store_true", help="Print the [DEBUG] messages of the placement logic")
+    parser.add_argument("--workers", metavar="N", type=int, default=1, help="Run the tests on N processes; each one writes results.<shard>.jsonl and they are merged into results.json in test order and removed")
+    parser.add_argument("--records", action="store_true", help="Load apps.json and scenarios.json as compact slotted records, cached in binary form next to each file")
+    parser.add_argument("--chunk-size", metavar="N", type=int, default=0, help="With --workers, split each test into chunks of N queries (ignored with --stateful); 0 keeps whole tests")
+    return parser
 
 if __name__ == "__main__":    
 
+    cli_args = build_parser().parse_args()
+
+    if cli_args.trace:
+        TRACER.enable()
+
     # See if we can import all the functions and variables from hackathon_functions.py
     try:
         from hackathon_functions import KPIS_PREFERENCES, KPIS_ORDER_OPERAND
@@ -73,90 +383,66 @@ if __name__ == "__main__":
         exit(1)
     print("Imported functions from hackathon_functions.py successfully.")
 
+    pipeline = configure_pipeline(cli_args)
+    if cli_args.llm_backend != "gemini":
+        print(f"Using LLM backend: {cli_args.llm_backend}")
+    llm_cache = pipeline["llm_cache"]
+    intent_resolver = pipeline["intent_resolver"]
+
     #------------------------------------------ NOW WE START THE TESTS ---------------------------------------------#
     # Delete previous results file if exists
     if "results.json" in os.listdir():
         os.remove("results.json")
 
     # Load scenarios, apps and functions datasets
-    with open("apps.json", "r") as f:
-        apps_dataset = json.load(f)
+    apps_dataset, scenarios_dataset = load_datasets(cli_args)
 
-    with open("scenarios.json", "r") as f:
-        scenarios_dataset = json.load(f)
+    # Empty declarations of functions.json are generated from the app catalogue (see tool_declarations.py)
+    from tool_declarations import complete_functions, declarations_report
+    functions = complete_functions(functions, apps_dataset)
+    report = declarations_report(functions, apps_dataset)
+    print(f"Tool declarations: ~{report['total_tokens']} tokens (catalogue per call: ~{report['per_call_tokens_before']} -> ~{report['per_call_tokens_after']} tokens)")
 
     with open("test-queries-with-solutions.json", "r") as f:
         test_queries_dataset = json.load(f)
 
     #------------------------------- MAIN LOOP: EXECUTE TESTS --------------------------------#
-    
-    for test_i in test_queries_dataset.keys():    
-        print(f"------------------------------- TEST: {test_i} -------------------------------\n")
-        queries = [item["query"] for item in test_queries_dataset[test_i]]
-
-        ###################################### TASK: GENERATE CONTEXT PROMPT ################################################
-        context_prompt = task_generate_context_prompt(apps_dataset, scenarios_dataset, functions, test_i)
-        ####################################### END TASK: GENERATE CONTEXT PROMPT ################################################
-        
-        #---------------------------- QUERIES LOOP: PROCESS EACH USER QUERY ------------------#
-        for query in queries:
-            complete_system_prompt = [
-                {
-                    "role": "model",
-                    "parts": [
-                        {
-                        "text": context_prompt
-                        }
-                    ]
-                },
-            ]
 
-            complete_system_prompt.append(
-                {
-                    "role": "user",
-                    "parts": [
-                        {
-                            "text": query
-                        }
-                    ]
-                }
-            )
+    if cli_args.workers > 1:
+        merged = run_workers(test_queries_dataset, cli_args)
+        tokens_count_total = sum(merged["tokens_per_worker"].values())
+        for worker_i, (pid, tokens) in enumerate(sorted(merged["tokens_per_worker"].items())):
+            print(f"TOKENS WORKER {worker_i} (pid {pid}):", tokens)
+    else:
+        # Results are streamed to results.jsonl and compacted into results.json at the end
+        results_writer = ResultsWriter("results.jsonl")
 
-            ############################################### TASK:CALL GEMINI WITH TOOLS ################################################
-            response = task_call_gemini(
-                complete_system_prompt=complete_system_prompt,
-                deploy_app=deploy_app,
-                migrate_app=migrate_app,
-                stop_app=stop_app,
-            )
-            ###################################################### END TASK CALL GEMINI WITH TOOLS ################################################
+        for test_i in test_queries_dataset.keys():    
+            print(f"------------------------------- TEST: {test_i} -------------------------------\n")
+            queries = [item["query"] for item in test_queries_dataset[test_i]]
 
-            print(f"--- Query: {query} ---")
-            print(f"Respuesta del modelo: {response} \n")
-        
-            # In case there is more than one function call in the response, we process them all
-            states = []
-            chosen_nodes = []
-
-            ################################## TASK:PROCESS FUNCTION CALLS ################################################
-
-            for function in response["function"]:
-                state, chosen_node = task_process_function_calls(function, apps_dataset, scenarios_dataset[test_i])
-            
-            ################################## END TASK PROCESS FUNCTION CALLS ################################################
-            
-                # Append individual function result
-                print(f"Resultado de la función: {state} \n")
-                states.append(state)
-                chosen_nodes.append(chosen_node)
-
-            # Append results to file to analyze later
-            append_to_results_file(query, response, test_i, states, chosen_nodes)
-            tokens_count_total += response["prompt_tokens"] + response["completion_tokens"]
-
-            # Sleep between queries to avoid rate limits
-            time.sleep(1)
+            ###################################### TASK: GENERATE CONTEXT PROMPT ################################################
+            with TRACER.span("context_prompt", test=test_i):
+                context_prompt = task_generate_context_prompt(apps_dataset, scenarios_dataset, functions, test_i)
+            ####################################### END TASK: GENERATE CONTEXT PROMPT ################################################
+
+            tokens_count_total += run_queries(test_i, queries, context_prompt, functions, apps_dataset, scenarios_dataset[test_i], cli_args, pipeline, results_writer)
+
+        results_writer.close()
+        compact_results("results.jsonl", "results.json")
 
     print("-------------------------------------------------\n")
     print("TOTAL TOKENS USED SO FAR:", tokens_count_total)
-
+    if cli_args.workers > 1:
+        if llm_cache is not None:
+            print("LLM CACHE:", merged["llm_cache"])
+        if intent_resolver is not None:
+            print(f"FAST PATH: {merged['fast_path'][0]}/{merged['fast_path'][1]} queries resolved locally")
+    else:
+        if llm_cache is not None:
+            print("LLM CACHE:", llm_cache.stats())
+        if intent_resolver is not None:
+            print(f"FAST PATH: {intent_resolver.hits}/{intent_resolver.calls} queries resolved locally")
+    if cli_args.trace:
+        TRACER.print_summary()
+        TRACER.export_trace(cli_args.trace)
@@ -0,0 +1,180 @@
+import bisect
+import math
+
+from hackathon_functions import KPIS_PREFERENCES, KPIS_ORDER_OPERAND
+from identity_cache import IdentityCache
+
+# Node indexes already built per scenario list, keyed by the identity of the list
+_INDEXES = IdentityCache()
+
+
+class KpiRanks:
+    '''
+    Sorted values of one KPI over the nodes of a scenario, with the position each node has in the ranking
+    of one category. Threshold queries return bitsets in that ranking space: bit r is set when the node
+    ranked r-th for the category satisfies the threshold.
+
+    A bitset of the sorted prefix is stored every block positions, so a range costs one bisect, one stored
+    bitset and at most block bit operations.
+    '''
+
+    def __init__(self, values: list, rank_of_row: list):
+        '''
+        :param values: Value of the KPI for every node, in scenario order
+        :type values: list
+        :param rank_of_row: Position of every node in the category ranking
+        :type rank_of_row: list
+        '''
+        rows = sorted(range(len(values)), key=values.__getitem__)
+        self.values = [values[row] for row in rows]
+        self.ranks = [rank_of_row[row] for row in rows]
+        self.block = max(64, math.isqrt(len(rows)))
+        self.all_bits = (1 << len(rows)) - 1
+
+        self.prefix_bits = [0]
+        bits = 0
+        for position, rank in enumerate(self.ranks, start=1):
+            bits |= 1 << rank
+            if position % self.block == 0:
+                self.prefix_bits.append(bits)
+
+    def _first(self, count: int) -> int:
+        '''Bitset of the count nodes with the lowest values.'''
+        checkpoint = count // self.block
+        bits = self.prefix_bits[checkpoint]
+        for rank in self.ranks[checkpoint * self.block:count]:
+            bits |= 1 << rank
+        return bits
+
+    def at_most(self, threshold: float) -> int:
+        '''Bitset of the nodes whose value is <= threshold.'''
+        return self._first(bisect.bisect_right(self.values, threshold))
+
+    def at_least(self, threshold: float) -> int:
+        '''Bitset of the nodes whose value is >= threshold.'''
+        return self.all_bits ^ self._first(bisect.bisect_left(self.values, threshold))
+
+
+class NodeRankIndex:
+    '''
+    Per-scenario index of the static node KPIs: one node ranking per 5G category, computed once with the same
+    stable sort as logic_app_placement, and one KpiRanks per KPI of each category for the user thresholds.
+
+    A placement intersects the threshold bitsets and walks the set bits from the lowest rank, returning the first
+    node with enough free CPU and RAM, so no request sorts or filters the whole node list. Free resources are read
+    from the node dicts when a candidate is checked, so deploys committed to the scenario are always seen.
+    '''
+
+    def __init__(self, edge_nodes: list):
+        '''
+        :param edge_nodes: List of edge nodes in the scenario, as loaded from scenarios.json
+        :type edge_nodes: list
+        '''
+        self.edge_nodes = edge_nodes
+        self.orders = {}
+        self.ranks = {}
+        self.kpi_ranks = {}
+        for app_category, preferences in KPIS_PREFERENCES.items():
+            order = sorted(range(len(edge_nodes)), key=lambda row: tuple(
+                KPIS_ORDER_OPERAND[kpi_name] * edge_nodes[row]["server_kpis"][kpi_name] for kpi_name in preferences))
+            rank_of_row = [0] * len(order)
+            for rank, row in enumerate(order):
+                rank_of_row[row] = rank
+            self.orders[app_category] = order
+            self.ranks[app_category] = rank_of_row
+            self.kpi_ranks[app_category] = {
+                kpi_name: KpiRanks([node["server_kpis"][kpi_name] for node in edge_nodes], rank_of_row)
+                for kpi_name in preferences
+            }
+
+    def allowed(self, app_category: str, kpis_user: dict):
+        '''
+        Bitset, in the ranking of app_category, of the nodes that meet the user KPIs relevant for the category.
+        KPIs where lower is better are upper bounds, the rest are lower bounds. Returns None when no KPI applies.
+        '''
+        bits = None
+        for kpi_name, kpi_value in kpis_user.items():
+            ranks = self.kpi_ranks[app_category].get(kpi_name)
+            if ranks is None:
+                continue
+            kpi_bits = ranks.at_most(kpi_value) if KPIS_ORDER_OPERAND[kpi_name] > 0 else ranks.at_least(kpi_value)
+            bits = kpi_bits if bits is None else bits & kpi_bits
+        return bits
+
+    def _fits(self, row: int, cpu_cores: float, ram_gb: float, current_node: str, usage_overrides: dict=None) -> bool:
+        node = self.edge_nodes[row]
+        if node["node_id"] == current_node:
+            return False
+        override = usage_overrides.get(node["node_id"]) if usage_overrides else None
+        if override is not None:
+            cpu_used, ram_used = override[0], override[1]
+        else:
+            usage = node["server_current_usage"]
+            cpu_used, ram_used = usage.get("cpu_cores", 0), usage.get("ram_gb", 0)
+        return node["server_capabilities"]["cpu_cores"] - cpu_used >= cpu_cores and node["server_capabilities"]["ram_gb"] - ram_used >= ram_gb
+
+    def place(self, app_name: str, apps_data: dict, kpis_user: dict={}, current_node: str=None, usage_overrides: dict=None) -> str:
+        '''
+        Same contract as logic_app_placement.
+
+        :param app_name: Name of the application to be deployed/migrated
+        :type app_name: str
+        :param apps_data: Dataset containing application requirements
+        :type apps_data: dict
+        :param kpis_user: User-defined KPIs for deployment/migration
+        :type kpis_user: dict
+        :param current_node: Current node where the application is deployed (if migrating)
+        :type current_node: str
+        :param usage_overrides: (cpu_used, ram_used, ...) of the nodes whose usage differs from the node dicts,
+            keyed by node_id, as kept by a Simulation branch
+        :type usage_overrides: dict
+        :return: Selected edge node ID or error message
+        :rtype: str
+        '''
+        if app_name not in apps_data:
+            return "Aplicación no encontrada en el dataset."
+
+        requirements = apps_data[app_name]["min_requirements"]
+        cpu_cores, ram_gb = requirements["cpu_cores"], requirements["ram_gb"]
+
+        app_category = apps_data[app_name]["category_5G"]
+        if app_category not in KPIS_PREFERENCES:
+            # Like logic_app_placement, a scenario without free resources wins over the unknown category
+            if not any(self._fits(row, cpu_cores, ram_gb, current_node, usage_overrides) for row in range(len(self.edge_nodes))):
+                return "NO_NODES_AVAILABLE"
+            return "Categoría de aplicación no reconocida."
+
+        order = self.orders[app_category]
+
+        bits = self.allowed(app_category, kpis_user)
+        if bits is None:
+            for row in order:
+                if self._fits(row, cpu_cores, ram_gb, current_node, usage_overrides):
+                    return self.edge_nodes[row]["node_id"]
+            return "NO_NODES_AVAILABLE"
+
+        while bits:
+            lowest = bits & -bits
+            row = order[lowest.bit_length() - 1]
+            if self._fits(row, cpu_cores, ram_gb, current_node, usage_overrides):
+                return self.edge_nodes[row]["node_id"]
+            bits ^= lowest
+        return "NO_NODES_AVAILABLE"
+
+
+def get_node_index(edge_nodes: list) -> NodeRankIndex:
+    '''
+    Returns the NodeRankIndex of a scenario list, building it only the first time the list is seen.
+    Call clear_node_index_cache if nodes are added or removed, or their KPIs change.
+    '''
+    return _INDEXES.get_or_build(edge_nodes, NodeRankIndex)
+
+
+def clear_node_index_cache():
+    '''Drops every cached NodeRankIndex.'''
+    _INDEXES.clear()
+
+
+def index_app_placement(app_name: str, apps_data: dict, edge_nodes: list, kpis_user: dict={}, current_node: str=None) -> str:
+    '''Drop-in replacement of logic_app_placement backed by the cached NodeRankIndex of edge_nodes.'''
+    return get_node_index(edge_nodes).place(app_name, apps_data, kpis_user, current_node)
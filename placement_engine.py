@@ -0,0 +1,258 @@
+import numpy as np
+
+from hackathon_functions import KPIS_PREFERENCES, KPIS_ORDER_OPERAND
+from identity_cache import IdentityCache
+
+# Column order of the KPI matrix; the same six KPIs used by KPIS_ORDER_OPERAND
+KPI_NAMES = tuple(KPIS_ORDER_OPERAND.keys())
+KPI_COLUMN = {kpi_name: i for i, kpi_name in enumerate(KPI_NAMES)}
+
+# Node columns already built per scenario list, keyed by the identity of the list
+_COLUMNS_CACHE = IdentityCache()
+
+
+class NodeColumns:
+    '''
+    Columnar view of the edge nodes of one scenario, with one NumPy array per node attribute.
+
+    Row i of every array describes the node self.node_ids[i], in the same order as the scenario list,
+    so the first feasible row after ranking is the same node the dict based placement would pick.
+    '''
+
+    def __init__(self, edge_nodes: list):
+        '''
+        :param edge_nodes: List of edge nodes in the scenario, as loaded from scenarios.json
+        :type edge_nodes: list
+        '''
+        n = len(edge_nodes)
+        self.node_ids = [node["node_id"] for node in edge_nodes]
+        self.index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+        self.cpu_capacity = np.empty(n, dtype=np.float64)
+        self.ram_capacity = np.empty(n, dtype=np.float64)
+        self.cpu_used = np.zeros(n, dtype=np.float64)
+        self.ram_used = np.zeros(n, dtype=np.float64)
+        self.kpis = np.empty((n, len(KPI_NAMES)), dtype=np.float64)
+
+        for i, node in enumerate(edge_nodes):
+            self.cpu_capacity[i] = node["server_capabilities"]["cpu_cores"]
+            self.ram_capacity[i] = node["server_capabilities"]["ram_gb"]
+            usage = node["server_current_usage"]
+            self.cpu_used[i] = usage.get("cpu_cores", 0)
+            self.ram_used[i] = usage.get("ram_gb", 0)
+            self.kpis[i] = [node["server_kpis"][kpi_name] for kpi_name in KPI_NAMES]
+
+        # Node KPIs are static, so the ranking of each category is computed once
+        self._category_orders = {}
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def set_usage(self, node_id: str, cpu_cores: float, ram_gb: float):
+        '''Updates the CPU and RAM in use of node_id after a committed placement.'''
+        i = self.index[node_id]
+        self.cpu_used[i] = cpu_cores
+        self.ram_used[i] = ram_gb
+
+    def kpi(self, kpi_name: str) -> np.ndarray:
+        '''Returns the column with the values of kpi_name for every node.'''
+        return self.kpis[:, KPI_COLUMN[kpi_name]]
+
+    def resources_mask(self, cpu_cores: float, ram_gb: float, current_node: str=None) -> np.ndarray:
+        '''
+        Vectorized equivalent of task_select_nodes_with_resources.
+
+        :param cpu_cores: CPU cores required by the application
+        :type cpu_cores: float
+        :param ram_gb: RAM (GB) required by the application
+        :type ram_gb: float
+        :param current_node: Node to exclude when migrating
+        :type current_node: str
+        :return: Boolean mask of the nodes with enough free CPU and RAM
+        :rtype: np.ndarray
+        '''
+        mask = (self.cpu_capacity - self.cpu_used >= cpu_cores) & (self.ram_capacity - self.ram_used >= ram_gb)
+        if current_node in self.index:
+            mask[self.index[current_node]] = False
+        return mask
+
+    def kpis_mask(self, mask: np.ndarray, app_category: str, kpis_user: dict) -> np.ndarray:
+        '''
+        Applies the user KPI thresholds that are relevant for the category on top of mask.
+        KPIs where lower is better are upper bounds, the rest are lower bounds.
+        '''
+        for kpi_name, kpi_value in kpis_user.items():
+            if kpi_name not in KPIS_PREFERENCES[app_category]:
+                continue
+            if KPIS_ORDER_OPERAND[kpi_name] > 0:
+                mask &= self.kpi(kpi_name) <= kpi_value
+            else:
+                mask &= self.kpi(kpi_name) >= kpi_value
+        return mask
+
+    def best_node(self, mask: np.ndarray, app_category: str) -> int:
+        '''
+        Returns the row of the first node in lexicographic KPIS_PREFERENCES order among the masked nodes, or -1.
+
+        Instead of sorting, each preferred KPI narrows the candidates to the rows that reach its optimum,
+        and ties left after the three KPIs are broken by scenario order, like the stable sort does.
+        '''
+        candidates = mask.copy()
+        for kpi_name in KPIS_PREFERENCES[app_category]:
+            if not candidates.any():
+                return -1
+            values = KPIS_ORDER_OPERAND[kpi_name] * self.kpi(kpi_name)
+            candidates &= values == values[candidates].min()
+        rows = np.flatnonzero(candidates)
+        return int(rows[0]) if len(rows) else -1
+
+    def category_order(self, app_category: str) -> np.ndarray:
+        '''
+        Returns the rows of every node sorted by the KPIS_PREFERENCES of app_category.
+        np.lexsort is stable, so ties keep scenario order as in logic_app_placement.
+        '''
+        order = self._category_orders.get(app_category)
+        if order is None:
+            keys = [KPIS_ORDER_OPERAND[kpi_name] * self.kpi(kpi_name) for kpi_name in reversed(KPIS_PREFERENCES[app_category])]
+            order = np.lexsort(keys)
+            self._category_orders[app_category] = order
+        return order
+
+    def place(self, app_name: str, apps_data: dict, kpis_user: dict={}, current_node: str=None) -> str:
+        '''
+        Same contract as logic_app_placement, computed with masked array operations.
+
+        :param app_name: Name of the application to be deployed/migrated
+        :type app_name: str
+        :param apps_data: Dataset containing application requirements
+        :type apps_data: dict
+        :param kpis_user: User-defined KPIs for deployment/migration
+        :type kpis_user: dict
+        :param current_node: Current node where the application is deployed (if migrating)
+        :type current_node: str
+        :return: Selected edge node ID or error message
+        :rtype: str
+        '''
+        if app_name not in apps_data:
+            return "Aplicación no encontrada en el dataset."
+
+        requirements = apps_data[app_name]["min_requirements"]
+        mask = self.resources_mask(requirements["cpu_cores"], requirements["ram_gb"], current_node)
+        if not mask.any():
+            return "NO_NODES_AVAILABLE"
+
+        app_category = apps_data[app_name]["category_5G"]
+        if app_category not in KPIS_PREFERENCES:
+            return "Categoría de aplicación no reconocida."
+
+        if len(kpis_user) > 0:
+            mask = self.kpis_mask(mask, app_category, kpis_user)
+
+        row = self.best_node(mask, app_category)
+        return self.node_ids[row] if row >= 0 else "NO_NODES_AVAILABLE"
+
+
+def get_node_columns(edge_nodes: list) -> NodeColumns:
+    '''
+    Returns the NodeColumns of a scenario list, building them only the first time the list is seen.
+    Call clear_node_columns_cache if the node dicts are modified in place outside a ClusterState.
+    '''
+    return _COLUMNS_CACHE.get_or_build(edge_nodes, NodeColumns)
+
+
+def cached_node_columns(edge_nodes: list):
+    '''Returns the NodeColumns already built for a scenario list, or None without building them.'''
+    return _COLUMNS_CACHE.get(edge_nodes)
+
+
+def clear_node_columns_cache():
+    '''Drops every cached NodeColumns.'''
+    _COLUMNS_CACHE.clear()
+
+
+def numpy_app_placement(app_name: str, apps_data: dict, edge_nodes, kpis_user: dict={}, current_node: str=None) -> str:
+    '''
+    Drop-in replacement of logic_app_placement backed by NodeColumns.
+
+    :param edge_nodes: List of edge nodes in the scenario, or their NodeColumns
+    :type edge_nodes: list | NodeColumns
+    :return: Selected edge node ID or error message
+    :rtype: str
+    '''
+    columns = edge_nodes if isinstance(edge_nodes, NodeColumns) else get_node_columns(edge_nodes)
+    return columns.place(app_name, apps_data, kpis_user, current_node)
+
+
+def deploy_apps_batch(requests: list, apps_dataset: dict, scenario_nodes, strategy: str="greedy") -> list:
+    '''
+    Places many applications in one pass over the scenario, decrementing the free CPU and RAM of each chosen node
+    before placing the next one. Every request is ranked with the precomputed category_order of the scenario,
+    so there is no per-request filtering of dicts or sorting. If a ClusterState is attached to the scenario,
+    each successful placement is also committed to it.
+
+    :param requests: List of (app_name, args) pairs, args being the user-defined KPIs as in deploy_app_func
+    :type requests: list
+    :param apps_dataset: Dataset containing application requirements
+    :type apps_dataset: dict
+    :param scenario_nodes: List of edge nodes in the scenario, or their NodeColumns
+    :type scenario_nodes: list | NodeColumns
+    :param strategy: "greedy" places the requests in the given order, "largest_first" places the apps
+        with the highest CPU (then RAM) requirements first
+    :type strategy: str
+    :return: One (state, chosen_node) pair per request, in the order of requests
+    :rtype: list
+    '''
+    from hackathon_functions import deploy_state_message
+
+    if strategy not in ("greedy", "largest_first"):
+        raise ValueError(f"Unknown batch placement strategy: {strategy}")
+
+    columns = scenario_nodes if isinstance(scenario_nodes, NodeColumns) else get_node_columns(scenario_nodes)
+    free_cpu = columns.cpu_capacity - columns.cpu_used
+    free_ram = columns.ram_capacity - columns.ram_used
+
+    placement_order = list(range(len(requests)))
+    if strategy == "largest_first":
+        def requirements_key(i):
+            app_name = requests[i][0]
+            if app_name not in apps_dataset:
+                return (0, 0)
+            requirements = apps_dataset[app_name]["min_requirements"]
+            return (-requirements["cpu_cores"], -requirements["ram_gb"])
+        placement_order.sort(key=requirements_key)
+
+    cluster_state = None
+    if not isinstance(scenario_nodes, NodeColumns):
+        from cluster_state import get_cluster_state
+        cluster_state = get_cluster_state(scenario_nodes)
+
+    results = [None] * len(requests)
+    for i in placement_order:
+        app_name, args = requests[i]
+        kpis_user = {arg: float(args[arg]) for arg in args if arg != "app_name"}
+        chosen_node = "NO_NODES_AVAILABLE"
+
+        if app_name not in apps_dataset:
+            chosen_node = "Aplicación no encontrada en el dataset."
+        elif apps_dataset[app_name]["category_5G"] not in KPIS_PREFERENCES:
+            chosen_node = "Categoría de aplicación no reconocida."
+        else:
+            requirements = apps_dataset[app_name]["min_requirements"]
+            app_category = apps_dataset[app_name]["category_5G"]
+            mask = (free_cpu >= requirements["cpu_cores"]) & (free_ram >= requirements["ram_gb"])
+            if len(kpis_user) > 0:
+                mask = columns.kpis_mask(mask, app_category, kpis_user)
+
+            order = columns.category_order(app_category)
+            feasible = order[mask[order]]
+            if len(feasible):
+                row = int(feasible[0])
+                chosen_node = columns.node_ids[row]
+                free_cpu[row] -= requirements["cpu_cores"]
+                free_ram[row] -= requirements["ram_gb"]
+                if cluster_state is not None:
+                    cluster_state.commit("deploy_app", app_name, chosen_node)
+
+        results[i] = (deploy_state_message(app_name, chosen_node), chosen_node)
+
+    return results
@@ -0,0 +1,441 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
+import math
+import os
+import time
+from urllib.parse import urlsplit
+
+from main import build_complete_system_prompt, build_parser, configure_pipeline, load_datasets
+from tracing import TRACER
+
+# Endpoint -> function name of the placement calls accepted directly, without going through Gemini
+OPERATIONS = {"/deploy": "deploy_app", "/migrate": "migrate_app", "/stop": "stop_app"}
+
+# Largest request body accepted, in bytes
+MAX_BODY_BYTES = 1 << 20
+
+# Latency samples kept per endpoint for the percentiles of /metrics
+LATENCY_WINDOW = 2048
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 502: "Bad Gateway"}
+
+
+class RequestError(Exception):
+    '''Request rejected with an HTTP status and a message for the client.'''
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def validate_args(function_name: str, args: dict):
+    '''
+    Checks the args of a function call before anything is committed: a string app_name and, for deploy_app and
+    migrate_app, only KPI names of KPIS_ORDER_OPERAND with finite numeric values.
+
+    :raises RequestError: 400 with the first invalid argument
+    '''
+    from hackathon_functions import KPIS_ORDER_OPERAND
+
+    if not isinstance(args.get("app_name"), str):
+        raise RequestError(400, "Falta el campo app_name")
+    for arg_name, value in args.items():
+        if arg_name == "app_name":
+            continue
+        if function_name == "stop_app" or arg_name not in KPIS_ORDER_OPERAND:
+            raise RequestError(400, f"Argumento {arg_name} no válido en {function_name}")
+        try:
+            valid = not isinstance(value, bool) and math.isfinite(float(value))
+        except (TypeError, ValueError):
+            valid = False
+        if not valid:
+            raise RequestError(400, f"El KPI {arg_name} debe ser un número, no {value!r}")
+
+
+def _percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class PlacementService:
+    '''
+    Resident placement service: the datasets, the context prompts, the node indexes and (with --stateful) the
+    ClusterState of every scenario are loaded once and kept warm across requests.
+
+    Requests go through a micro-batcher: the ones that arrive within batch_window_s of each other (at most
+    batch_size) form a batch whose Gemini calls are issued concurrently, and whose function calls are then
+    processed in arrival order in a single executor hop, so a stateful scenario sees them one after the other
+    exactly as main.py would. A request that fails only fails its own future: the args of all its function calls
+    are validated before the first one is committed, and the rest of the batch goes on.
+    '''
+
+    def __init__(self, apps_dataset: dict, scenarios_dataset: dict, functions: dict, cli_args, pipeline: dict, batch_size: int=32, batch_window_s: float=0.002):
+        '''
+        :param functions: Function declarations of functions.json
+        :type functions: dict
+        :param cli_args: Parsed command line arguments (stateful, concurrency, rpm and tpm are used)
+        :type cli_args: argparse.Namespace
+        :param pipeline: Result of configure_pipeline
+        :type pipeline: dict
+        :param batch_size: Maximum requests per batch
+        :type batch_size: int
+        :param batch_window_s: Seconds a batch waits for more requests after the first one
+        :type batch_window_s: float
+        '''
+        self.apps_dataset = apps_dataset
+        self.scenarios_dataset = scenarios_dataset
+        self.tools = {"deploy_app": functions["deploy_app"], "migrate_app": functions["migrate_app"], "stop_app": functions["stop_app"]}
+        self.functions = functions
+        self.cli_args = cli_args
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.batch_window_s = batch_window_s
+        self.context_prompts = {}
+        self.cluster_states = {}
+        self.queue = None
+        self.rate_limiter = None
+        self.server = None
+        self.batcher = None
+        # One thread for the function calls, so batches are processed one after the other off the event loop
+        self.executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="placement")
+        self.started_at = time.monotonic()
+        self.counters = {"requests": collections.Counter(), "errors": collections.Counter(), "batches": 0, "batched_requests": 0, "max_batch": 0,
+                         "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+
+    def warm(self):
+        '''
+        Builds the context prompt, the node index and (with --stateful) the ClusterState of every scenario,
+        recovered from its event log when --event-log is given.
+        '''
+        from hackathon_functions import task_generate_context_prompt
+        from node_index import get_node_index
+
+        for scenario_name, scenario_nodes in self.scenarios_dataset.items():
+            self.context_prompts[scenario_name] = task_generate_context_prompt(self.apps_dataset, self.scenarios_dataset, self.functions, scenario_name)
+            get_node_index(scenario_nodes)
+            if self.cli_args.stateful and self.cli_args.event_log:
+                # Restarts resume from the latest snapshot of the scenario log plus its tail
+                from event_log import EventSourcedClusterState
+                os.makedirs(self.cli_args.event_log, exist_ok=True)
+                self.cluster_states[scenario_name] = EventSourcedClusterState(os.path.join(self.cli_args.event_log, f"{scenario_name}.evlog"),
+                                                                              scenario_nodes, self.apps_dataset)
+            elif self.cli_args.stateful:
+                from cluster_state import ClusterState
+                self.cluster_states[scenario_name] = ClusterState(scenario_nodes, self.apps_dataset)
+
+    async def start(self, host: str="127.0.0.1", port: int=8080, unix_socket: str=None):
+        '''
+        Warms the state and starts listening on host:port, or on unix_socket when given.
+
+        :return: The asyncio server; its sockets give the bound address when port is 0
+        '''
+        from async_executor import PACED_REQUESTS_PER_MINUTE, RateLimiter
+
+        await asyncio.to_thread(self.warm)
+        self.queue = asyncio.Queue()
+        self.rate_limiter = RateLimiter(self.cli_args.rpm or (PACED_REQUESTS_PER_MINUTE if self.pipeline.get("paced") else None), self.cli_args.tpm)
+        self.batcher = asyncio.create_task(self._batch_loop())
+        if unix_socket:
+            self.server = await asyncio.start_unix_server(self._handle_connection, path=unix_socket)
+        else:
+            self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher is not None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+        self.executor.shutdown(wait=True)
+        from event_log import EventSourcedClusterState
+        from identity_cache import release
+        for cluster_state in self.cluster_states.values():
+            if isinstance(cluster_state, EventSourcedClusterState):
+                cluster_state.close()
+        # The indexes and states built for the scenarios are owned by the service and go away with it
+        for scenario_nodes in self.scenarios_dataset.values():
+            release(scenario_nodes)
+
+    #------------------------------------------ BATCHING ---------------------------------------------#
+
+    async def submit(self, scenario_name: str, query: str=None, function: dict=None) -> dict:
+        '''
+        Queues a free-text query (sent to Gemini) or a single function call and waits for its result.
+
+        :return: query, function calls, states, chosen nodes and tokens, like a record of results.json
+        :rtype: dict
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((scenario_name, query, function, future))
+        return await future
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window_s
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self._run_batch(batch)
+            except Exception as error:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    async def _run_batch(self, batch: list):
+        from async_executor import call_gemini_concurrently
+
+        self.counters["batches"] += 1
+        self.counters["batched_requests"] += len(batch)
+        self.counters["max_batch"] = max(self.counters["max_batch"], len(batch))
+
+        # Gemini calls of the whole batch at once; a failed call only fails its own request
+        queries = [(i, scenario_name, query) for i, (scenario_name, query, _, _) in enumerate(batch) if query is not None]
+        responses = {}
+        if queries:
+            retriever = self.pipeline.get("retriever")
+            prompts = [build_complete_system_prompt(retriever.context_prompt(query, self.scenarios_dataset[scenario_name]) if retriever is not None
+                                                    else self.context_prompts[scenario_name], query) for _, scenario_name, query in queries]
+            outcomes = await call_gemini_concurrently(prompts, self.tools, max(self.cli_args.concurrency, 1), self.rate_limiter, return_exceptions=True)
+            for (i, _, _), outcome in zip(queries, outcomes):
+                responses[i] = outcome
+
+        jobs = []
+        for i, (scenario_name, query, function, future) in enumerate(batch):
+            response = responses.get(i, {"function": [function], "prompt_tokens": 0, "completion_tokens": 0})
+            if isinstance(response, BaseException):
+                future.set_exception(RequestError(502, f"Error llamando a Gemini: {response}"))
+                continue
+            jobs.append((scenario_name, query, response, future))
+
+        results = await asyncio.get_running_loop().run_in_executor(self.executor, self._process_jobs, jobs)
+        for (*_, future), result in zip(jobs, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _process_jobs(self, jobs: list) -> list:
+        '''
+        Processes the function calls of every job in arrival order (runs on the placement thread, one batch at a time).
+        A job that fails gets its exception in place of its result, so the other jobs of the batch are unaffected.
+        '''
+        results = []
+        for scenario_name, query, response, _ in jobs:
+            try:
+                results.append(self._process_job(scenario_name, query, response))
+            except RequestError as error:
+                results.append(error)
+            except Exception as error:
+                results.append(RequestError(500, f"Error procesando la petición: {error}"))
+        return results
+
+    def _process_job(self, scenario_name: str, query: str, response: dict) -> dict:
+        '''Validates and then processes the function calls of one job, returning its record.'''
+        from hackathon_functions import task_process_function_calls
+
+        if query is not None:
+            # The tokens are spent even if the answer turns out to be invalid
+            self.counters["llm_calls"] += 1
+            self.counters["prompt_tokens"] += response["prompt_tokens"]
+            self.counters["completion_tokens"] += response["completion_tokens"]
+        for function in response["function"]:
+            if function.get("function_name") not in self.tools:
+                raise RequestError(400, f"Función {function.get('function_name')} no reconocida")
+            validate_args(function["function_name"], function.get("args", {}))
+
+        cluster_state = self.cluster_states.get(scenario_name)
+        states = []
+        chosen_nodes = []
+        for function in response["function"]:
+            with TRACER.span("process_function_call", test=scenario_name, function=function["function_name"]):
+                if cluster_state is not None:
+                    state, chosen_node = cluster_state.process(function)
+                else:
+                    state, chosen_node = task_process_function_calls(function, self.apps_dataset, self.scenarios_dataset[scenario_name])
+            states.append(state)
+            chosen_nodes.append(chosen_node)
+
+        return {"scenario": scenario_name, "query": query, "execution_result": {"function": response["function"]},
+                "chosen_node": chosen_nodes, "state": states,
+                "prompt_tokens": response["prompt_tokens"], "completion_tokens": response["completion_tokens"]}
+
+    #------------------------------------------ HTTP ---------------------------------------------#
+
+    async def dispatch(self, method: str, path: str, body: bytes) -> dict:
+        '''
+        Routes one request. GET /health and /metrics; POST /query {"scenario", "query"} sends the query to Gemini;
+        POST /deploy, /migrate and /stop take {"scenario", "app_name", KPI args...} as the function call itself.
+
+        :raises RequestError: Unknown path, wrong method, invalid body or invalid function call args
+        '''
+        if path in ("/health", "/metrics"):
+            if method != "GET":
+                raise RequestError(405, f"Método {method} no permitido en {path}")
+            return {"status": "ok"} if path == "/health" else self.metrics()
+
+        if path != "/query" and path not in OPERATIONS:
+            raise RequestError(404, f"Ruta {path} no encontrada")
+        if method != "POST":
+            raise RequestError(405, f"Método {method} no permitido en {path}")
+
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            raise RequestError(400, "El cuerpo no es JSON válido")
+        if not isinstance(payload, dict):
+            raise RequestError(400, "El cuerpo debe ser un objeto JSON")
+        scenario_name = payload.get("scenario")
+        if scenario_name not in self.scenarios_dataset:
+            raise RequestError(404, f"Escenario {scenario_name} no encontrado")
+
+        if path == "/query":
+            if not isinstance(payload.get("query"), str) or not payload["query"].strip():
+                raise RequestError(400, "Falta el campo query")
+            return await self.submit(scenario_name, query=payload["query"])
+
+        args = {key: value for key, value in payload.items() if key != "scenario"}
+        validate_args(OPERATIONS[path], args)
+        return await self.submit(scenario_name, function={"function_name": OPERATIONS[path], "args": args})
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''Minimal HTTP/1.1 server loop with keep-alive: one JSON request and response at a time per connection.'''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                path = urlsplit(target).path
+                started = time.perf_counter()
+                length = int(headers.get("content-length", 0))
+                try:
+                    if length > MAX_BODY_BYTES:
+                        raise RequestError(413, f"Cuerpo de más de {MAX_BODY_BYTES} bytes")
+                    body = await reader.readexactly(length)
+                    status, payload = 200, await self.dispatch(method, path, body)
+                except RequestError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, payload = 500, {"error": f"Error interno: {error}"}
+
+                endpoint = path if path in OPERATIONS or path in ("/query", "/health", "/metrics") else "other"
+                self.counters["requests"][endpoint] += 1
+                if status != 200:
+                    self.counters["errors"][status] += 1
+                self.latencies[endpoint].append((time.perf_counter() - started) * 1000)
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close" and status != 413
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(f"{version} {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def metrics(self) -> dict:
+        '''
+        Requests and errors per endpoint, latency percentiles (ms) over the last LATENCY_WINDOW requests of each
+        endpoint, batching, Gemini tokens, queued requests, LLM cache and fast path counters, and the trace summary
+        when tracing is enabled.
+        '''
+        latency_ms = {}
+        for endpoint, samples in self.latencies.items():
+            values = sorted(samples)
+            latency_ms[endpoint] = {"p50": _percentile(values, 0.5), "p95": _percentile(values, 0.95), "p99": _percentile(values, 0.99), "max": values[-1]}
+
+        counters = self.counters
+        metrics = {
+            "uptime_s": time.monotonic() - self.started_at,
+            "requests": dict(counters["requests"]),
+            "errors": {str(status): count for status, count in counters["errors"].items()},
+            "latency_ms": latency_ms,
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "batches": {"count": counters["batches"], "mean_size": counters["batched_requests"] / counters["batches"] if counters["batches"] else 0.0,
+                        "max_size": counters["max_batch"]},
+            "llm": {"calls": counters["llm_calls"], "prompt_tokens": counters["prompt_tokens"], "completion_tokens": counters["completion_tokens"]},
+            "stateful": bool(self.cluster_states),
+        }
+        if self.pipeline.get("llm_cache") is not None:
+            metrics["llm_cache"] = self.pipeline["llm_cache"].stats()
+        if self.pipeline.get("intent_resolver") is not None:
+            metrics["fast_path"] = {"hits": self.pipeline["intent_resolver"].hits, "calls": self.pipeline["intent_resolver"].calls}
+        from event_log import EventSourcedClusterState
+        event_logs = {scenario_name: {"events": cluster_state.seq, **cluster_state.stats}
+                      for scenario_name, cluster_state in self.cluster_states.items() if isinstance(cluster_state, EventSourcedClusterState)}
+        if event_logs:
+            metrics["event_log"] = event_logs
+        if TRACER.enabled:
+            metrics["trace"] = TRACER.summary()
+        return metrics
+
+
+async def serve(service: PlacementService, host: str, port: int, unix_socket: str=None):
+    server = await service.start(host, port, unix_socket)
+    print(f"Servicio de placement escuchando en {unix_socket or ', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
+if __name__ == "__main__":
+    parser = build_parser()
+    parser.description = "Resident placement service: loads the datasets once and answers deploy/migrate/stop and free-text queries over HTTP"
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix-socket", metavar="PATH", default=None, help="Listen on this Unix socket instead of host:port")
+    parser.add_argument("--batch-size", type=int, default=32, help="Maximum requests processed per batch")
+    parser.add_argument("--event-log", metavar="DIR", default=None, help="With --stateful, record every committed call in DIR/<scenario>.evlog and resume from it on restart")
+    parser.add_argument("--batch-window-ms", type=float, default=2.0, help="Milliseconds a batch waits for more requests after the first one")
+    cli_args = parser.parse_args()
+
+    if cli_args.trace:
+        TRACER.enable()
+    pipeline = configure_pipeline(cli_args)
+    apps_dataset, scenarios_dataset = load_datasets(cli_args)
+    from tool_declarations import complete_functions
+    with open("functions.json", "r") as f:
+        functions = complete_functions(json.load(f), apps_dataset)
+
+    service = PlacementService(apps_dataset, scenarios_dataset, functions, cli_args, pipeline, cli_args.batch_size, cli_args.batch_window_ms / 1000)
+    try:
+        asyncio.run(serve(service, cli_args.host, cli_args.port, cli_args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+    if cli_args.trace:
+        TRACER.export_trace(cli_args.trace)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+from llm_backends import estimate_tokens
+from records import to_json_default
+
+# Short column names of the node table, in order, with the server_kpis key they come from
+NODE_KPI_COLUMNS = [
+    ("lat_ms", "latency_ms"),
+    ("thr_mbps", "throughput_mbps"),
+    ("disp_pct", "availability_percent"),
+    ("perd_pct", "packet_loss_percent"),
+    ("dens", "connection_density"),
+    ("efic", "energy_efficiency"),
+]
+
+# Context prompts already built, least recently used first, keyed by the rows they are made of
+_PROMPT_CACHE = OrderedDict()
+
+# Maximum number of context prompts kept; with --retrieve-apps every query may build its own
+PROMPT_CACHE_SIZE = 256
+
+
+def content_hash(*parts) -> str:
+    '''SHA-256 of the JSON serialization of parts, independent of dict key order (records hash as their dicts).'''
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=to_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _format_value(value) -> str:
+    return f"{value:g}" if isinstance(value, (int, float)) else str(value)
+
+
+def encode_scenario(scenario_nodes: list) -> str:
+    '''
+    Encodes the nodes of one scenario as a table with one row per node and columns separated by |.
+
+    :param scenario_nodes: List of edge nodes in the scenario
+    :type scenario_nodes: list
+    :return: Header row followed by one row per node
+    :rtype: str
+    '''
+    header = ["id", "zona"] + [column for column, _ in NODE_KPI_COLUMNS] + ["apps"]
+    rows = ["|".join(header)]
+    for node in scenario_nodes:
+        row = [node["node_id"], node["zone"]]
+        row += [_format_value(node["server_kpis"][kpi_name]) for _, kpi_name in NODE_KPI_COLUMNS]
+        row.append(";".join(node["server_current_usage"].get("apps", [])))
+        rows.append("|".join(row))
+    return "\n".join(rows)
+
+
+def encode_apps(apps_dataset: dict) -> str:
+    '''
+    Encodes the application catalogue as a table with one row per app: name, 5G category and description.
+
+    :param apps_dataset: Dataset containing the applications, keyed by name
+    :type apps_dataset: dict
+    :return: Header row followed by one row per app
+    :rtype: str
+    '''
+    rows = ["app|cat|descripcion"]
+    for app_name, app in apps_dataset.items():
+        rows.append(f"{app_name}|{app['category_5G']}|{app['description']}")
+    return "\n".join(rows)
+
+
+def encode_apps_section(apps_dataset: dict) -> str:
+    '''The app table with its heading, as spliced into the context prompt.'''
+    return "\n\nAplicaciones que se pueden desplegar (una fila por app):\n" + encode_apps(apps_dataset)
+
+
+def _prompt_key(apps_dataset: dict, scenario_nodes: list, rules: str) -> tuple:
+    '''
+    Key of a context prompt: the rules plus the fields of every app and node row shown in it, as tuples.
+    Hashing them is far cheaper than serializing the whole datasets, and a node whose running apps change
+    (stateful mode) gets a new key.
+    '''
+    apps_key = None if apps_dataset is None else tuple((app_name, app["category_5G"], app["description"]) for app_name, app in apps_dataset.items())
+    nodes_key = tuple((node["node_id"], node["zone"], *(node["server_kpis"][kpi_name] for _, kpi_name in NODE_KPI_COLUMNS),
+                       *node["server_current_usage"].get("apps", ())) for node in scenario_nodes)
+    return rules, apps_key, nodes_key
+
+
+def build_context_prompt(apps_dataset: dict, scenario_nodes: list, rules: str) -> tuple:
+    '''
+    Builds the context prompt of one scenario with the compact table encodings, memoized in a bounded LRU,
+    so running the same scenario again (or another test with identical nodes) reuses the prompt.
+
+    :param apps_dataset: Dataset containing the applications, or None to leave the app table out (the function
+        declarations carry the catalogue)
+    :type apps_dataset: dict
+    :param scenario_nodes: List of edge nodes of the active scenario only
+    :type scenario_nodes: list
+    :param rules: Placement rules appended at the end of the prompt
+    :type rules: str
+    :return: Context prompt and its estimated size in tokens
+    :rtype: tuple
+    '''
+    key = _prompt_key(apps_dataset, scenario_nodes, rules)
+    cached = _PROMPT_CACHE.get(key)
+    if cached is not None:
+        _PROMPT_CACHE.move_to_end(key)
+        return cached
+
+    context_prompt = (
+        "Eres un asistente para gestionar aplicaciones en una red de nodos edge. "
+        "Nodos edge del escenario (una fila por nodo, columnas separadas por |, apps separadas por ;):\n"
+        + encode_scenario(scenario_nodes)
+        + (encode_apps_section(apps_dataset) if apps_dataset is not None else "")
+        + "\n\n" + rules
+    )
+    cached = (context_prompt, estimate_tokens(context_prompt))
+    _PROMPT_CACHE[key] = cached
+    while len(_PROMPT_CACHE) > PROMPT_CACHE_SIZE:
+        _PROMPT_CACHE.popitem(last=False)
+    return cached
+
+
+def clear_prompt_cache():
+    '''Drops every memoized context prompt.'''
+    _PROMPT_CACHE.clear()
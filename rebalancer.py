@@ -0,0 +1,186 @@
+import argparse
+import heapq
+import json
+import time
+
+from hackathon_functions import KPIS_PREFERENCES
+from simulation import Simulation
+
+# CPU/RAM fraction above which a node counts as overloaded. Placements never take a node past 100%, so the
+# default leaves 20% of headroom: moves that bring hot nodes back under it are worth some loss of KPI fit
+DEFAULT_MAX_UTILISATION = 0.8
+
+
+class Rebalancer:
+    '''
+    Local search that plans migrate_app calls to improve a whole scenario.
+
+    The objective adds, for every running app, the rank of its node in the KPIS_PREFERENCES ordering of its category
+    (divided by the number of nodes, so 0 is the best node and ~1 the worst) and, weighted by capacity_weight, how far
+    each node's CPU and RAM usage is above max_utilisation. Placements never push a node past its capacity, so the
+    default (DEFAULT_MAX_UTILISATION) is a headroom target below 1.0; with 1.0 the overload term would always be 0
+    and no move would ever free capacity. A move is what migrate_app would do for the app: take its first running
+    node and place it on the best other node with enough free resources. Moves are taken greedily by
+    gain with lazy re-evaluation, pass after pass, until no move improves the objective, max_moves is reached or the
+    time budget runs out. Every accepted move lowers the objective, so the search cannot cycle.
+    '''
+
+    def __init__(self, scenario_nodes: list, apps_dataset: dict, max_utilisation: float=DEFAULT_MAX_UTILISATION, capacity_weight: float=1.0, min_gain: float=1e-9):
+        '''
+        :param scenario_nodes: List of edge nodes in the scenario, never modified
+        :type scenario_nodes: list
+        :param apps_dataset: Dataset containing application requirements
+        :type apps_dataset: dict
+        :param max_utilisation: CPU/RAM fraction above which a node counts as overloaded
+        :type max_utilisation: float
+        :param capacity_weight: Weight of the overload term against the KPI fit term
+        :type capacity_weight: float
+        :param min_gain: Minimum objective improvement for a move to be planned
+        :type min_gain: float
+        '''
+        self.simulation = Simulation(scenario_nodes, apps_dataset)
+        self.apps_dataset = apps_dataset
+        self.max_utilisation = max_utilisation
+        self.capacity_weight = capacity_weight
+        self.min_gain = min_gain
+        self.capacity = {node["node_id"]: (node["server_capabilities"]["cpu_cores"], node["server_capabilities"]["ram_gb"]) for node in scenario_nodes}
+
+    def _overload(self, node_id: str, cpu_used: float, ram_used: float) -> float:
+        cpu_cores, ram_gb = self.capacity[node_id]
+        overload = 0.0
+        if cpu_cores:
+            overload += max(cpu_used / cpu_cores - self.max_utilisation, 0.0)
+        if ram_gb:
+            overload += max(ram_used / ram_gb - self.max_utilisation, 0.0)
+        return overload
+
+    def _fit(self, app_category: str, node_id: str) -> float:
+        simulation = self.simulation
+        return simulation.index.ranks[app_category][simulation.position[node_id]] / max(len(simulation.nodes), 1)
+
+    def _movable(self, app_name: str) -> bool:
+        app = self.apps_dataset.get(app_name)
+        return app is not None and app["category_5G"] in KPIS_PREFERENCES
+
+    def objective(self) -> float:
+        '''Current value of the objective (lower is better).'''
+        simulation = self.simulation
+        total = 0.0
+        for node in simulation.nodes:
+            cpu_used, ram_used, apps = simulation.usage(node["node_id"])
+            total += self.capacity_weight * self._overload(node["node_id"], cpu_used, ram_used)
+            for app_name in apps:
+                if self._movable(app_name):
+                    total += self._fit(self.apps_dataset[app_name]["category_5G"], node["node_id"])
+        return total
+
+    def evaluate(self, app_name: str) -> tuple:
+        '''
+        Returns (gain, source node, target node) of migrating app_name now, or (0, source, None) if it cannot move.
+        '''
+        simulation = self.simulation
+        running_nodes = simulation.nodes_of(app_name)
+        if not running_nodes:
+            return 0.0, None, None
+        src = running_nodes[0]
+        dst = simulation.index.place(app_name, self.apps_dataset, {}, src, simulation.overrides)
+        if dst not in simulation.position:
+            return 0.0, src, None
+
+        app_category = self.apps_dataset[app_name]["category_5G"]
+        requirements = self.apps_dataset[app_name]["min_requirements"]
+        src_cpu, src_ram, _ = simulation.usage(src)
+        dst_cpu, dst_ram, _ = simulation.usage(dst)
+        # Same floor at zero as the usage update of a migration
+        src_after = (max(src_cpu - requirements["cpu_cores"], 0), max(src_ram - requirements["ram_gb"], 0))
+        capacity_gain = (self._overload(src, src_cpu, src_ram) - self._overload(src, *src_after)
+                         - self._overload(dst, dst_cpu + requirements["cpu_cores"], dst_ram + requirements["ram_gb"]) + self._overload(dst, dst_cpu, dst_ram))
+        gain = self._fit(app_category, src) - self._fit(app_category, dst) + self.capacity_weight * capacity_gain
+        return gain, src, dst
+
+    def plan(self, max_moves: int=50, time_budget_s: float=5.0) -> dict:
+        '''
+        Runs the local search on the simulation branch.
+
+        :param max_moves: Maximum number of migrations in the plan
+        :type max_moves: int
+        :param time_budget_s: Maximum seconds of search
+        :type time_budget_s: float
+        :return: moves (app, from, to, gain), calls (migrate_app function calls that replay the plan in order),
+            objective before and after, stop reason (converged, max_moves or time_budget), elapsed seconds and
+            the summary of the simulation branch
+        :rtype: dict
+        '''
+        started = time.perf_counter()
+        objective_before = self.objective()
+        moves = []
+        reason = "converged"
+
+        running_apps = sorted({app_name for node in self.simulation.nodes for app_name in self.simulation.usage(node["node_id"])[2] if self._movable(app_name)})
+        while reason == "converged":
+            moved_in_pass = 0
+            # Max-heap of possibly stale gains; a popped app is re-evaluated and only moved if it still beats the rest
+            heap = [(-gain, app_name) for app_name in running_apps for gain in [self.evaluate(app_name)[0]] if gain > self.min_gain]
+            heapq.heapify(heap)
+            while heap:
+                if len(moves) >= max_moves:
+                    reason = "max_moves"
+                    break
+                if time.perf_counter() - started > time_budget_s:
+                    reason = "time_budget"
+                    break
+
+                _, app_name = heapq.heappop(heap)
+                gain, src, dst = self.evaluate(app_name)
+                if gain <= self.min_gain:
+                    continue
+                if heap and gain < -heap[0][0]:
+                    heapq.heappush(heap, (-gain, app_name))
+                    continue
+
+                _, chosen_node = self.simulation.apply({"function_name": "migrate_app", "args": {"app_name": app_name}})
+                moves.append({"app_name": app_name, "from": src, "to": chosen_node, "gain": gain})
+                moved_in_pass += 1
+                # The app may still gain from another move (its next instance, or a better node freed later)
+                next_gain = self.evaluate(app_name)[0]
+                if next_gain > self.min_gain:
+                    heapq.heappush(heap, (-next_gain, app_name))
+
+            if reason == "converged" and moved_in_pass == 0:
+                break
+
+        return {
+            "moves": moves,
+            "calls": [{"function_name": "migrate_app", "args": {"app_name": move["app_name"]}} for move in moves],
+            "objective_before": objective_before,
+            "objective_after": self.objective(),
+            "reason": reason,
+            "elapsed_s": time.perf_counter() - started,
+            "summary": self.simulation.summary(),
+        }
+
+
+def plan_rebalance(scenario_nodes: list, apps_dataset: dict, max_moves: int=50, time_budget_s: float=5.0, **options) -> dict:
+    '''Plans the migrations that rebalance a scenario; options are passed to Rebalancer. See Rebalancer.plan.'''
+    return Rebalancer(scenario_nodes, apps_dataset, **options).plan(max_moves, time_budget_s)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the migrate_app calls that rebalance a scenario of scenarios.json")
+    parser.add_argument("scenario", help="Scenario name, e.g. test1")
+    parser.add_argument("--max-moves", type=int, default=50)
+    parser.add_argument("--time-budget", type=float, default=5.0, help="Seconds of search")
+    parser.add_argument("--max-utilisation", type=float, default=DEFAULT_MAX_UTILISATION, help="CPU/RAM fraction above which a node counts as overloaded")
+    parser.add_argument("--capacity-weight", type=float, default=1.0, help="Weight of the overload term against the KPI fit term")
+    cli_args = parser.parse_args()
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+
+    result = plan_rebalance(scenarios_dataset[cli_args.scenario], apps_dataset, cli_args.max_moves, cli_args.time_budget,
+                            max_utilisation=cli_args.max_utilisation, capacity_weight=cli_args.capacity_weight)
+    for move in result["moves"]:
+        print(f"migrate_app {move['app_name']}: {move['from']} -> {move['to']} (ganancia {move['gain']:.4f})")
+    print(f"Objetivo: {result['objective_before']:.4f} -> {result['objective_after']:.4f} ({len(result['moves'])} movimientos, {result['reason']}, {result['elapsed_s']:.2f}s)")
@@ -0,0 +1,291 @@
+import json
+import marshal
+import os
+from collections.abc import Mapping, MutableMapping
+
+# server_kpis keys of scenarios.json, stored as slots of EdgeNode
+SERVER_KPIS = ("latency_ms", "throughput_mbps", "availability_percent", "packet_loss_percent", "connection_density", "energy_efficiency")
+
+# Bumped whenever the layout of the records or of the cache changes, so old binary caches are rebuilt
+CACHE_VERSION = 2
+
+
+class EdgeNode:
+    '''
+    Compact record of one edge node of scenarios.json: every capability, KPI and usage value is a slot.
+
+    Subscripting returns light views with the shape of the JSON dicts (node["server_kpis"]["latency_ms"],
+    node["server_current_usage"].setdefault("apps", []), ...), so every function written for the dicts accepts
+    the records as well. Hot loops can read the slots directly instead. Usage values that were absent in the JSON
+    are None, so to_dict gives back the original dict.
+    '''
+
+    __slots__ = ("node_id", "zone", "cpu_cores", "ram_gb") + SERVER_KPIS + ("cpu_used", "ram_used", "apps")
+
+    def __init__(self, node_id: str, zone: str, cpu_cores: float, ram_gb: float, kpis: tuple, cpu_used: float=None, ram_used: float=None, apps: list=None):
+        '''
+        :param kpis: Values of the server KPIs in SERVER_KPIS order
+        :type kpis: tuple
+        :param cpu_used: CPU cores in use, None if the node has no usage entry
+        :param ram_used: RAM (GB) in use, None if the node has no usage entry
+        :param apps: Applications running on the node, None if the node has no usage entry
+        '''
+        self.node_id = node_id
+        self.zone = zone
+        self.cpu_cores = cpu_cores
+        self.ram_gb = ram_gb
+        for kpi_name, value in zip(SERVER_KPIS, kpis):
+            setattr(self, kpi_name, value)
+        self.cpu_used = cpu_used
+        self.ram_used = ram_used
+        self.apps = apps
+
+    @classmethod
+    def from_dict(cls, node: dict):
+        usage = node["server_current_usage"]
+        return cls(node["node_id"], node["zone"], node["server_capabilities"]["cpu_cores"], node["server_capabilities"]["ram_gb"],
+                   tuple(node["server_kpis"][kpi_name] for kpi_name in SERVER_KPIS),
+                   usage.get("cpu_cores"), usage.get("ram_gb"), usage.get("apps"))
+
+    def to_dict(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "zone": self.zone,
+            "server_capabilities": {"cpu_cores": self.cpu_cores, "ram_gb": self.ram_gb},
+            "server_kpis": {kpi_name: getattr(self, kpi_name) for kpi_name in SERVER_KPIS},
+            "server_current_usage": dict(_Usage(self)),
+        }
+
+    def free_cpu(self) -> float:
+        return self.cpu_cores - (self.cpu_used or 0)
+
+    def free_ram(self) -> float:
+        return self.ram_gb - (self.ram_used or 0)
+
+    def __getitem__(self, key: str):
+        if key == "node_id":
+            return self.node_id
+        if key == "zone":
+            return self.zone
+        if key == "server_kpis":
+            return _Kpis(self)
+        if key == "server_capabilities":
+            return _Capabilities(self)
+        if key == "server_current_usage":
+            return _Usage(self)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_row(self) -> tuple:
+        '''Constructor arguments of the record, as plain values.'''
+        return (self.node_id, self.zone, self.cpu_cores, self.ram_gb, tuple(getattr(self, kpi_name) for kpi_name in SERVER_KPIS),
+                self.cpu_used, self.ram_used, self.apps)
+
+    def __reduce__(self):
+        return (EdgeNode, self.to_row())
+
+    def __repr__(self) -> str:
+        return f"EdgeNode({self.node_id!r})"
+
+
+class App:
+    '''Compact record of one application of apps.json, subscriptable like the JSON dict.'''
+
+    __slots__ = ("name", "app_id", "category_5G", "description", "cpu_cores", "ram_gb")
+
+    def __init__(self, name: str, app_id: str, category_5G: str, description: str, cpu_cores: float, ram_gb: float):
+        self.name = name
+        self.app_id = app_id
+        self.category_5G = category_5G
+        self.description = description
+        self.cpu_cores = cpu_cores
+        self.ram_gb = ram_gb
+
+    @classmethod
+    def from_dict(cls, name: str, app: dict):
+        return cls(name, app["app_id"], app["category_5G"], app["description"], app["min_requirements"]["cpu_cores"], app["min_requirements"]["ram_gb"])
+
+    def to_dict(self) -> dict:
+        return {
+            "app_id": self.app_id,
+            "category_5G": self.category_5G,
+            "description": self.description,
+            "min_requirements": {"cpu_cores": self.cpu_cores, "ram_gb": self.ram_gb},
+        }
+
+    def __getitem__(self, key: str):
+        if key in ("app_id", "category_5G", "description"):
+            return getattr(self, key)
+        if key == "min_requirements":
+            return _Capabilities(self)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_row(self) -> tuple:
+        '''Constructor arguments of the record, as plain values.'''
+        return (self.name, self.app_id, self.category_5G, self.description, self.cpu_cores, self.ram_gb)
+
+    def __reduce__(self):
+        return (App, self.to_row())
+
+    def __repr__(self) -> str:
+        return f"App({self.name!r})"
+
+
+class _Kpis(Mapping):
+    '''server_kpis view of an EdgeNode.'''
+
+    __slots__ = ("record",)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key: str):
+        if key not in SERVER_KPIS:
+            raise KeyError(key)
+        return getattr(self.record, key)
+
+    def __iter__(self):
+        return iter(SERVER_KPIS)
+
+    def __len__(self) -> int:
+        return len(SERVER_KPIS)
+
+
+class _Capabilities(Mapping):
+    '''server_capabilities view of an EdgeNode, or min_requirements view of an App.'''
+
+    __slots__ = ("record",)
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key: str):
+        if key == "cpu_cores":
+            return self.record.cpu_cores
+        if key == "ram_gb":
+            return self.record.ram_gb
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("cpu_cores", "ram_gb"))
+
+    def __len__(self) -> int:
+        return 2
+
+
+class _Usage(MutableMapping):
+    '''Writable server_current_usage view of an EdgeNode; a key is present while its slot is not None.'''
+
+    __slots__ = ("record",)
+
+    SLOTS = {"cpu_cores": "cpu_used", "ram_gb": "ram_used", "apps": "apps"}
+
+    def __init__(self, record):
+        self.record = record
+
+    def __getitem__(self, key: str):
+        value = getattr(self.record, self.SLOTS[key]) if key in self.SLOTS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value):
+        if key not in self.SLOTS:
+            raise KeyError(key)
+        setattr(self.record, self.SLOTS[key], value)
+
+    def __delitem__(self, key: str):
+        self[key]
+        setattr(self.record, self.SLOTS[key], None)
+
+    def __iter__(self):
+        return (key for key, slot in self.SLOTS.items() if getattr(self.record, slot) is not None)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def to_json_default(value):
+    '''default= hook of json.dumps that serializes records as their JSON dicts.'''
+    if isinstance(value, (EdgeNode, App)):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _load_cached(json_path: str, build, to_rows, from_rows, use_cache: bool):
+    '''
+    Returns build(json content), reusing the cache stored next to json_path when it was written by the same
+    CACHE_VERSION for the same size and modification time of the JSON file.
+
+    The cache holds to_rows(records), plain tuples, lists and dicts written with marshal, and from_rows turns them
+    back into records. Unlike a pickle it names no class or function, so a cache file planted next to the JSON
+    cannot run code when it is loaded; a malformed one is just rebuilt.
+    '''
+    cache_path = json_path + ".cache"
+    stat = os.stat(json_path)
+    signature = (CACHE_VERSION, stat.st_size, stat.st_mtime_ns)
+
+    if use_cache:
+        try:
+            with open(cache_path, "rb") as f:
+                cached_signature, rows = marshal.loads(f.read())
+            if cached_signature == signature:
+                return from_rows(rows)
+        except (OSError, EOFError, ValueError, TypeError, KeyError, AttributeError):
+            pass
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = build(json.load(f))
+
+    if use_cache:
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(marshal.dumps((signature, to_rows(data))))
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+    return data
+
+
+def load_scenarios(path: str="scenarios.json", use_cache: bool=True) -> dict:
+    '''
+    Loads scenarios.json as lists of EdgeNode records.
+
+    :param path: Scenarios JSON file
+    :type path: str
+    :param use_cache: Read and write the binary cache path + ".cache"
+    :type use_cache: bool
+    :return: Scenario name -> list of EdgeNode
+    :rtype: dict
+    '''
+    return _load_cached(path, lambda scenarios: {name: [EdgeNode.from_dict(node) for node in nodes] for name, nodes in scenarios.items()},
+                        lambda scenarios: {name: [node.to_row() for node in nodes] for name, nodes in scenarios.items()},
+                        lambda rows: {name: [EdgeNode(*row) for row in node_rows] for name, node_rows in rows.items()}, use_cache)
+
+
+def load_apps(path: str="apps.json", use_cache: bool=True) -> dict:
+    '''
+    Loads apps.json as App records.
+
+    :param path: Applications JSON file
+    :type path: str
+    :param use_cache: Read and write the binary cache path + ".cache"
+    :type use_cache: bool
+    :return: App name -> App
+    :rtype: dict
+    '''
+    return _load_cached(path, lambda apps: {name: App.from_dict(name, app) for name, app in apps.items()},
+                        lambda apps: {name: app.to_row() for name, app in apps.items()},
+                        lambda rows: {name: App(*row) for name, row in rows.items()}, use_cache)
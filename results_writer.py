@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+
+class ResultsWriter:
+    '''
+    Append-only results sink: one JSON line per query, buffered and fsynced at most every fsync_interval_s seconds.
+
+    A buffered result is synced by the next append once the interval has passed or, if no append comes (a slow
+    model call), by a timer at the end of the interval, so a crash loses at most the last fsync_interval_s seconds
+    of results and never corrupts the ones already written. compact_results turns the JSONL file into the
+    results.json layout expected by tests.py.
+    '''
+
+    def __init__(self, path: str="results.jsonl", fsync_interval_s: float=1.0, truncate: bool=True):
+        '''
+        :param path: JSONL file where the results are appended
+        :type path: str
+        :param fsync_interval_s: Minimum seconds between two flush+fsync of the buffer
+        :type fsync_interval_s: float
+        :param truncate: Start from an empty file instead of appending to an existing one
+        :type truncate: bool
+        '''
+        self.path = path
+        self.fsync_interval_s = fsync_interval_s
+        self.file = open(path, "w" if truncate else "a", encoding="utf-8")
+        self.last_sync = time.monotonic()
+        self.count = 0
+        # The timer thread and the writer share the file
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def append(self, query: str, response: dict, test_i: str, state: list, chosen_node: list="N/A"):
+        '''
+        Appends the result of one query, with the same arguments the old append_to_results_file took.
+
+        :param query: The user query
+        :type query: str
+        :param response: The model response, with function calls
+        :type response: dict
+        :param test_i: Test identifier
+        :type test_i: str
+        :param state: The result state after executing the function
+        :type state: list
+        :param chosen_node: The node chosen for the app placement
+        :type chosen_node: list
+        '''
+        record = {"test": test_i, "query": query, "execution_result": {"function": response["function"]}, "chosen_node": chosen_node, "state": state}
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.count += 1
+
+            elapsed = time.monotonic() - self.last_sync
+            if elapsed >= self.fsync_interval_s:
+                self._sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.fsync_interval_s - elapsed, self._timed_sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def _timed_sync(self):
+        with self.lock:
+            self.timer = None
+            if not self.file.closed:
+                self._sync()
+
+    def sync(self):
+        '''Flushes the buffer and forces it to disk.'''
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_results(jsonl_path: str):
+    '''
+    Yields the records of a results JSONL file in order, skipping a truncated last line left by a crash.
+
+    :param jsonl_path: File written by ResultsWriter
+    :type jsonl_path: str
+    '''
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def compact_results(jsonl_paths, json_path: str="results.json") -> dict:
+    '''
+    Groups the records of one or more results JSONL files by test, in order, and writes them as results.json.
+    The file is written to a temporary path first and then renamed, so results.json is never left half written.
+
+    :param jsonl_paths: File, or list of files, written by ResultsWriter
+    :type jsonl_paths: str | list
+    :param json_path: Output file, with the layout expected by tests.py
+    :type json_path: str
+    :return: The compacted results
+    :rtype: dict
+    '''
+    if isinstance(jsonl_paths, str):
+        jsonl_paths = [jsonl_paths]
+
+    results_data = {}
+    for jsonl_path in jsonl_paths:
+        for record in iter_results(jsonl_path):
+            test_i = record.pop("test")
+            results_data.setdefault(test_i, []).append(record)
+
+    tmp_path = json_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results_data, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, json_path)
+    return results_data
+
+
+if __name__ == "__main__":
+    # Rebuild results.json from the JSONL files of an interrupted run: python results_writer.py results.jsonl [...]
+    import sys
+    compact_results(sys.argv[1:] or ["results.jsonl"], "results.json")
@@ -0,0 +1,196 @@
+from hackathon_functions import deploy_state_message, migrate_state_message, stop_state_message
+from app_index import get_app_index
+from node_index import get_node_index
+from records import SERVER_KPIS
+
+
+class Simulation:
+    '''
+    What-if branch of a scenario: runs deploy/migrate/stop calls without touching the scenario nodes.
+
+    A branch stores only the usage of the nodes it changed, as node_id -> (cpu_used, ram_used, apps) tuples, and the
+    locations of the apps it moved; everything else is read from the scenario and its AppNodeIndex. fork() copies
+    those small dicts and never the nodes, and placements go through the shared NodeRankIndex of the scenario with
+    the branch usage on top, so hundreds of branches cost little more than the nodes they touch.
+    The scenario must not be modified while its simulations are in use.
+    '''
+
+    def __init__(self, scenario_nodes: list, apps_dataset: dict):
+        '''
+        :param scenario_nodes: List of edge nodes in the scenario, never modified
+        :type scenario_nodes: list
+        :param apps_dataset: Dataset containing application requirements
+        :type apps_dataset: dict
+        '''
+        self.nodes = scenario_nodes
+        self.apps_dataset = apps_dataset
+        self.position = {node["node_id"]: i for i, node in enumerate(scenario_nodes)}
+        self.index = get_node_index(scenario_nodes)
+        self.app_index = get_app_index(scenario_nodes)
+        self.overrides = {}
+        self.app_nodes = {}
+        self.log = []
+        self.stats = {"placed": 0, "rejected": 0, "stopped": 0, "kpi_sums": dict.fromkeys(SERVER_KPIS, 0.0)}
+
+    def fork(self):
+        '''Returns a new branch that starts from the current state of this one.'''
+        branch = Simulation.__new__(Simulation)
+        branch.nodes = self.nodes
+        branch.apps_dataset = self.apps_dataset
+        branch.position = self.position
+        branch.index = self.index
+        branch.app_index = self.app_index
+        branch.overrides = dict(self.overrides)
+        branch.app_nodes = dict(self.app_nodes)
+        branch.log = list(self.log)
+        branch.stats = {**self.stats, "kpi_sums": dict(self.stats["kpi_sums"])}
+        return branch
+
+    def usage(self, node_id: str) -> tuple:
+        '''Returns (cpu_used, ram_used, apps) of node_id in this branch.'''
+        override = self.overrides.get(node_id)
+        return override if override is not None else self._base_usage(node_id)
+
+    def nodes_of(self, app_name: str) -> list:
+        '''Returns the nodes running app_name in this branch, in the order AppNodeIndex.nodes_of would give.'''
+        nodes = self.app_nodes.get(app_name)
+        return list(nodes) if nodes is not None else self.app_index.nodes_of(app_name)
+
+    def _move_app(self, function_name: str, app_name: str, chosen_node: str, current_node: str):
+        '''Same update as AppNodeIndex.apply, written to the app locations of the branch.'''
+        nodes = self.nodes_of(app_name)
+        if function_name in ("migrate_app", "stop_app") and nodes:
+            nodes.remove(current_node if current_node in nodes else nodes[0])
+        if function_name in ("deploy_app", "migrate_app"):
+            nodes.append(chosen_node)
+            nodes.sort(key=self.position.__getitem__)
+        self.app_nodes[app_name] = tuple(nodes)
+
+    def _change_usage(self, node_id: str, app_name: str, sign: int):
+        '''Same update as ClusterState._change_usage, written to the overrides of the branch.'''
+        cpu_used, ram_used, apps = self.usage(node_id)
+        requirements = self.apps_dataset[app_name]["min_requirements"]
+        if sign > 0:
+            apps = apps + (app_name,)
+        elif app_name in apps:
+            apps = list(apps)
+            apps.remove(app_name)
+            apps = tuple(apps)
+        self.overrides[node_id] = (max(cpu_used + sign * requirements["cpu_cores"], 0), max(ram_used + sign * requirements["ram_gb"], 0), apps)
+
+    def _place(self, app_name: str, args: dict, current_node: str=None) -> str:
+        kpis_user = {arg: float(args[arg]) for arg in args if arg != "app_name"}
+        chosen_node = self.index.place(app_name, self.apps_dataset, kpis_user, current_node, self.overrides)
+        if chosen_node in self.position:
+            self.stats["placed"] += 1
+            for kpi_name, value in self.nodes[self.position[chosen_node]]["server_kpis"].items():
+                self.stats["kpi_sums"][kpi_name] += value
+        else:
+            self.stats["rejected"] += 1
+        return chosen_node
+
+    def apply(self, function: dict) -> tuple:
+        '''
+        Runs one call like ClusterState.process, committing its outcome to this branch only.
+
+        :param function: Function call with function_name and args
+        :type function: dict
+        :return: State message and chosen node, as task_process_function_calls
+        :rtype: tuple
+        '''
+        function_name = function["function_name"]
+        args = function["args"]
+        app_name = args.get("app_name")
+        running_nodes = self.nodes_of(app_name)
+        current_node = running_nodes[0] if running_nodes else None
+
+        if function_name == "deploy_app":
+            chosen_node = self._place(app_name, args)
+            state = deploy_state_message(app_name, chosen_node)
+        elif function_name == "migrate_app":
+            chosen_node = self._place(app_name, args, current_node)
+            state = migrate_state_message(app_name, current_node, chosen_node)
+        elif function_name == "stop_app":
+            chosen_node = "N/A"
+            state = stop_state_message(app_name, current_node)
+        else:
+            return f"Función {function_name} no reconocida.", "N/A"
+
+        # Same rules as ClusterState.commit: unknown apps and failed placements change nothing
+        if app_name in self.apps_dataset and (function_name == "stop_app" or chosen_node in self.position):
+            if function_name in ("migrate_app", "stop_app") and current_node is not None:
+                self._change_usage(current_node, app_name, -1)
+                if function_name == "stop_app":
+                    self.stats["stopped"] += 1
+            if function_name in ("deploy_app", "migrate_app"):
+                self._change_usage(chosen_node, app_name, 1)
+            self._move_app(function_name, app_name, chosen_node, current_node)
+
+        self.log.append((function_name, app_name, chosen_node))
+        return state, chosen_node
+
+    def run(self, plan: list) -> list:
+        '''Applies every function call of plan in order and returns their (state, chosen_node) pairs.'''
+        return [self.apply(function) for function in plan]
+
+    def diff(self, other=None) -> dict:
+        '''
+        Returns the nodes whose usage differs between this branch and other (the unmodified scenario by default).
+
+        :return: node_id -> {"before": (cpu_used, ram_used, apps), "after": (cpu_used, ram_used, apps)}
+        :rtype: dict
+        '''
+        other_overrides = other.overrides if other is not None else {}
+        changes = {}
+        for node_id in self.overrides.keys() | other_overrides.keys():
+            before = other.usage(node_id) if other is not None else self._base_usage(node_id)
+            after = self.usage(node_id)
+            if before != after:
+                changes[node_id] = {"before": before, "after": after}
+        return changes
+
+    def _base_usage(self, node_id: str) -> tuple:
+        usage = self.nodes[self.position[node_id]]["server_current_usage"]
+        return usage.get("cpu_cores", 0), usage.get("ram_gb", 0), tuple(usage.get("apps", []))
+
+    def summary(self) -> dict:
+        '''
+        Outcome of the branch: placements, rejections, stops, nodes changed, CPU/RAM utilisation of the whole
+        scenario and mean KPIs of the nodes chosen by successful placements.
+        '''
+        cpu_capacity = ram_capacity = cpu_used = ram_used = 0
+        for node in self.nodes:
+            cpu_capacity += node["server_capabilities"]["cpu_cores"]
+            ram_capacity += node["server_capabilities"]["ram_gb"]
+            node_cpu, node_ram, _ = self.usage(node["node_id"])
+            cpu_used += node_cpu
+            ram_used += node_ram
+        placed = self.stats["placed"]
+        return {
+            "placed": placed,
+            "rejected": self.stats["rejected"],
+            "stopped": self.stats["stopped"],
+            "changed_nodes": len(self.diff()),
+            "cpu_utilisation": cpu_used / cpu_capacity if cpu_capacity else 0.0,
+            "ram_utilisation": ram_used / ram_capacity if ram_capacity else 0.0,
+            "chosen_kpis": {kpi_name: total / placed for kpi_name, total in self.stats["kpi_sums"].items()} if placed else {},
+        }
+
+
+def compare_plans(base: Simulation, plans: dict) -> dict:
+    '''
+    Runs every plan on its own fork of base and summarizes each one.
+
+    :param base: Branch the plans start from
+    :type base: Simulation
+    :param plans: Plan name -> list of function calls
+    :type plans: dict
+    :return: Plan name -> summary, plus the branch itself under "simulation" for further forking or diffing
+    :rtype: dict
+    '''
+    comparison = {}
+    for name, plan in plans.items():
+        branch = base.fork()
+        branch.run(plan)
+        comparison[name] = {**branch.summary(), "simulation": branch}
+    return comparison
@@ -3,6 +3,7 @@ import os
 import dotenv
 from hackathon_functions import gemini_api_call
 import json
+import functools
 from hackathon_functions import KPIS_PREFERENCES, KPIS_ORDER_OPERAND
 
 def test_kpis_preferences():
@@ -79,9 +80,1080 @@ def test_gemini_call_with_tool():
     if result["function"] == []:
         pytest.fail("El llm no devolvió una función")
 
+def test_import_does_not_load_llm_sdk():
+    """Verifica que importar la lógica de placement no carga el SDK de Gemini ni necesita GEMINI_API_KEY"""
+    import subprocess
+    import sys
+
+    env = {key: value for key, value in os.environ.items() if key != "GEMINI_API_KEY"}
+    code = "import sys, hackathon_functions; sys.exit(1 if any(name.startswith('google.genai') for name in sys.modules) else 0)"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        pytest.fail(f"Importar hackathon_functions carga el SDK de Gemini o falla sin GEMINI_API_KEY: {result.stderr}")
+
+def test_numpy_engine_matches_solutions():
+    """Verifica que el motor NumPy de placement_engine elige los mismos nodos que las soluciones para deploy_app y migrate_app"""
+    from placement_engine import NodeColumns
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    for suite_name, expected_list in solutions.items():
+        columns = NodeColumns(scenarios_dataset[suite_name])
+        for i, expected_item in enumerate(expected_list):
+            for j, function in enumerate(expected_item["expected_result"]["function"]):
+                if function["function_name"] == "stop_app":
+                    continue
+                app_name = function["args"]["app_name"]
+                kpis_user = {arg: float(value) for arg, value in function["args"].items() if arg != "app_name"}
+                current_node = None
+                if function["function_name"] == "migrate_app":
+                    current_node = next(node["node_id"] for node in scenarios_dataset[suite_name] if app_name in node["server_current_usage"].get("apps", []))
+
+                chosen_node = columns.place(app_name, apps_dataset, kpis_user, current_node)
+                if chosen_node != expected_item["chosen_node"][j]:
+                    pytest.fail(f"Nodo incorrecto con el motor NumPy en {suite_name}[Número {i+1}]. Esperado: {expected_item['chosen_node'][j]}, Obtenido: {chosen_node}")
+
+
+def test_app_index_keeps_scenario_order():
+    """Verifica que AppNodeIndex mantiene los nodos en el orden del escenario con add/remove/move/apply y descarta los nodos que no existen"""
+    from app_index import AppNodeIndex
+
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+
+    for suite_name, scenario_nodes in scenarios_dataset.items():
+        index = AppNodeIndex(scenario_nodes)
+        for node in scenario_nodes:
+            for app_name in node["server_current_usage"].get("apps", []):
+                expected = [n["node_id"] for n in scenario_nodes if app_name in n["server_current_usage"].get("apps", [])]
+                if index.nodes_of(app_name) != expected:
+                    pytest.fail(f"Nodos de {app_name} en {suite_name} incorrectos. Esperado: {expected}, Obtenido: {index.nodes_of(app_name)}")
+
+    # Nodes are inserted by scenario position, so a migration to an earlier node makes it the current one
+    index = AppNodeIndex([{"node_id": f"n{i}", "server_current_usage": {"apps": []}} for i in range(1, 6)])
+    index.add("app", "n3")
+    index.add("app", "n1")
+    index.add("app", "n2")
+    if index.nodes_of("app") != ["n1", "n2", "n3"] or index.current_node("app") != "n1":
+        pytest.fail(f"add debería mantener el orden del escenario, quedó {index.nodes_of('app')}")
+    index.move("app", "n1", "n4")
+    if index.nodes_of("app") != ["n2", "n3", "n4"]:
+        pytest.fail(f"move debería quitar el nodo origen y colocar el destino en su posición, quedó {index.nodes_of('app')}")
+    index.move("app", "n4", "n1")
+    if index.nodes_of("app") != ["n1", "n2", "n3"]:
+        pytest.fail(f"Migrar a un nodo anterior debería dejarlo el primero, quedó {index.nodes_of('app')}")
+    index.remove("app")
+    if index.nodes_of("app") != ["n2", "n3"]:
+        pytest.fail(f"remove sin nodo debería quitar el primero, quedó {index.nodes_of('app')}")
+
+    for chosen_node in ("NO_NODES_AVAILABLE", "Aplicación no encontrada en el dataset.", "Categoría de aplicación no reconocida.", None):
+        index.apply("deploy_app", "app", chosen_node)
+        index.apply("migrate_app", "app", chosen_node, "n3")
+    if index.nodes_of("app") != ["n2", "n3"]:
+        pytest.fail(f"Una colocación fallida no debe cambiar el índice, quedó {index.nodes_of('app')}")
+    index.apply("deploy_app", "app", "n1")
+    index.apply("migrate_app", "app", "n5", "n2")
+    index.apply("stop_app", "app", "N/A", "n3")
+    if index.nodes_of("app") != ["n1", "n5"]:
+        pytest.fail(f"apply no respeta el orden de las operaciones, quedó {index.nodes_of('app')}")
+    index.apply("stop_app", "app", "N/A")
+    index.apply("stop_app", "app", "N/A")
+    if "app" in index or index.current_node("app") is not None:
+        pytest.fail("Una app detenida en todos sus nodos debería desaparecer del índice")
+
+def test_identity_caches_are_bounded_and_released():
+    """Verifica que las cachés por identidad de lista no retienen escenarios sin límite y se liberan al terminar con ellos"""
+    import gc
+    import weakref
+    from identity_cache import IdentityCache, release
+    from placement_engine import get_node_columns
+
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+
+    cache = IdentityCache(maxsize=2)
+    lists = [[i] for i in range(3)]
+    for key_list in lists:
+        cache.get_or_build(key_list, len)
+    if len(cache) != 2 or cache.get(lists[0]) is not None:
+        pytest.fail(f"La caché debería quedarse con las 2 listas más recientes, tiene {len(cache)}")
+    if cache.get([2]) is not None:
+        pytest.fail("Una lista distinta con el mismo contenido no debe reutilizar la entrada de otra")
+
+    scenario_nodes = list(scenarios_dataset["test1"])
+    columns = weakref.ref(get_node_columns(scenario_nodes))
+    if get_node_columns(scenario_nodes) is not columns():
+        pytest.fail("get_node_columns debería reutilizar las columnas de la misma lista")
+    release(scenario_nodes)
+    gc.collect()
+    if columns() is not None:
+        pytest.fail("Las columnas del escenario siguen vivas después de release()")
+
+def test_cluster_states_keep_their_index_past_the_cache_size():
+    """Verifica que con más escenarios vivos que el tamaño de la caché cada estado conserva el índice que leen migrate y stop"""
+    import copy
+    from app_index import _INDEX_CACHE, get_app_index
+    from cluster_state import ClusterState, get_cluster_state
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenario_nodes = json.load(f)["test1"]
+
+    app_name = "Live Concert 360"
+    states = [ClusterState(copy.deepcopy(scenario_nodes), apps_dataset) for _ in range(_INDEX_CACHE.maxsize + 8)]
+    first = states[0]
+    deployed = [first.process({"function_name": "deploy_app", "args": {"app_name": app_name}})[1] for _ in range(2)]
+    if get_app_index(first.nodes) is not first.app_index or get_cluster_state(first.nodes) is not first:
+        pytest.fail("El índice o el estado del primer escenario se han expulsado de la caché mientras el estado seguía vivo")
+    if get_app_index(first.nodes).nodes_of(app_name)[-2:] != deployed:
+        pytest.fail(f"El índice que leen migrate y stop no ve los despliegues. Esperado: {deployed}, Obtenido: {get_app_index(first.nodes).nodes_of(app_name)}")
+    expected_nodes = first.app_index.nodes_of(app_name)
+    first.process({"function_name": "stop_app", "args": {"app_name": app_name}})
+    if first.app_index.nodes_of(app_name) != expected_nodes[1:]:
+        pytest.fail(f"stop_app no ha parado la app en su nodo actual. Antes: {expected_nodes}, después: {first.app_index.nodes_of(app_name)}")
+
+    for state in states:
+        state.detach()
+    if any(get_cluster_state(state.nodes) is not None for state in states) or len(_INDEX_CACHE) > _INDEX_CACHE.maxsize:
+        pytest.fail(f"detach() debería liberar los estados y sus índices: quedan {len(_INDEX_CACHE)} índices")
+def test_node_index_matches_solutions():
+    """Verifica que el índice pre-ordenado de node_index elige los mismos nodos que las soluciones para deploy_app y migrate_app"""
+    from node_index import NodeRankIndex
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    for suite_name, expected_list in solutions.items():
+        index = NodeRankIndex(scenarios_dataset[suite_name])
+        for i, expected_item in enumerate(expected_list):
+            for j, function in enumerate(expected_item["expected_result"]["function"]):
+                if function["function_name"] == "stop_app":
+                    continue
+                app_name = function["args"]["app_name"]
+                kpis_user = {arg: float(value) for arg, value in function["args"].items() if arg != "app_name"}
+                current_node = None
+                if function["function_name"] == "migrate_app":
+                    current_node = next(node["node_id"] for node in scenarios_dataset[suite_name] if app_name in node["server_current_usage"].get("apps", []))
+
+                chosen_node = index.place(app_name, apps_dataset, kpis_user, current_node)
+                if chosen_node != expected_item["chosen_node"][j]:
+                    pytest.fail(f"Nodo incorrecto con el índice pre-ordenado en {suite_name}[Número {i+1}]. Esperado: {expected_item['chosen_node'][j]}, Obtenido: {chosen_node}")
+
+def test_records_load_and_place_like_dicts(tmp_path):
+    """Verifica que los registros compactos (y su caché binaria) reproducen el JSON y eligen los mismos nodos"""
+    import shutil
+    from hackathon_functions import logic_app_placement
+    from records import load_apps, load_scenarios
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    shutil.copy("apps.json", tmp_path / "apps.json")
+    shutil.copy("scenarios.json", tmp_path / "scenarios.json")
+    for _ in range(2):
+        # The first pass parses the JSON and writes the cache, the second one reads the cache
+        apps_records = load_apps(str(tmp_path / "apps.json"))
+        scenarios_records = load_scenarios(str(tmp_path / "scenarios.json"))
+        if {name: app.to_dict() for name, app in apps_records.items()} != apps_dataset:
+            pytest.fail("Los registros de apps no reproducen apps.json")
+        if {name: [node.to_dict() for node in nodes] for name, nodes in scenarios_records.items()} != scenarios_dataset:
+            pytest.fail("Los registros de nodos no reproducen scenarios.json")
+    if not (tmp_path / "scenarios.json.cache").exists():
+        pytest.fail("No se ha escrito la caché binaria de scenarios.json")
+
+    # A pickle planted as cache must not run, it is just rebuilt from the JSON
+    import pickle
+    planted = tmp_path / "planted"
+    with open(tmp_path / "apps.json.cache", "wb") as f:
+        f.write(pickle.dumps(type("Planted", (), {"__reduce__": lambda self: (os.mkdir, (str(planted),))})()))
+    if {name: app.to_dict() for name, app in load_apps(str(tmp_path / "apps.json")).items()} != apps_dataset or planted.exists():
+        pytest.fail("Una caché manipulada no debería ejecutarse ni cambiar los registros de apps")
+
+    for suite_name, expected_list in solutions.items():
+        for expected_item in expected_list:
+            for j, function in enumerate(expected_item["expected_result"]["function"]):
+                if function["function_name"] != "deploy_app":
+                    continue
+                kpis_user = {arg: float(value) for arg, value in function["args"].items() if arg != "app_name"}
+                chosen_node = logic_app_placement(function["args"]["app_name"], apps_records, scenarios_records[suite_name], kpis_user)
+                if chosen_node != expected_item["chosen_node"][j]:
+                    pytest.fail(f"Nodo incorrecto con registros compactos en {suite_name}. Esperado: {expected_item['chosen_node'][j]}, Obtenido: {chosen_node}")
+
+def test_http_transport_retries_against_stub():
+    """Verifica que el transporte HTTP reintenta 503/429 (respetando Retry-After), reutiliza conexiones y abre el circuito"""
+    from http_transport import CircuitBreaker, CircuitOpenError, HttpTransport, RetryPolicy, StubServer, TransportError
+    from llm_backends import GeminiRestBackend
+
+    response = {
+        "candidates": [{"content": {"parts": [{"functionCall": {"name": "stop_app", "args": {"app_name": "SmartCity Traffic AI"}}}]}}],
+        "usageMetadata": {"promptTokenCount": 12, "candidatesTokenCount": 4},
+    }
+    faults = [{"status": 503}, {"status": 429, "headers": {"Retry-After": "0.05"}}]
+    with StubServer(response, faults) as server:
+        transport = HttpTransport(server.base_url, retry_policy=RetryPolicy(base_delay_s=0.01))
+        backend = GeminiRestBackend("clave", server.base_url, transport)
+        expected = {"function": [{"function_name": "stop_app", "args": {"app_name": "SmartCity Traffic AI"}}], "prompt_tokens": 12, "completion_tokens": 4}
+        for _ in range(3):
+            result = backend.generate([], "Apaga SmartCity Traffic AI")
+            if result != expected:
+                pytest.fail(f"Respuesta incorrecta del backend HTTP. Esperado: {expected}, Obtenido: {result}")
+        if transport.stats["retries"] != 2:
+            pytest.fail(f"Deberían haberse reintentado el 503 y el 429, hubo {transport.stats['retries']} reintentos")
+        if transport.pool.created != 1:
+            pytest.fail(f"Las llamadas deberían reutilizar una sola conexión, se crearon {transport.pool.created}")
+        if server.requests[0]["headers"]["x-goog-api-key"] != "clave":
+            pytest.fail("La clave de la API no se envía en la cabecera x-goog-api-key")
+
+    with StubServer(response, [{"status": 500}] * 10) as server:
+        transport = HttpTransport(server.base_url, retry_policy=RetryPolicy(max_attempts=2, base_delay_s=0.01), circuit_breaker=CircuitBreaker(2, 60))
+        with pytest.raises(TransportError):
+            transport.post_json("/", {})
+        with pytest.raises(CircuitOpenError):
+            transport.post_json("/", {})
+        if len(server.requests) != 2:
+            pytest.fail(f"Con el circuito abierto no deberían llegar más peticiones al servidor, llegaron {len(server.requests)}")
+
+def test_simulation_matches_cluster_state_without_mutating():
+    """Verifica que una rama de simulación da los mismos resultados que ClusterState sin modificar el escenario"""
+    import copy
+    from cluster_state import ClusterState
+    from simulation import Simulation, compare_plans
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    for suite_name, expected_list in solutions.items():
+        nodes = scenarios_dataset[suite_name]
+        original = copy.deepcopy(nodes)
+        plan = [function for expected_item in expected_list for function in expected_item["expected_result"]["function"]]
+
+        base = Simulation(nodes, apps_dataset)
+        comparison = compare_plans(base, {"todo": plan, "solo_despliegues": [f for f in plan if f["function_name"] == "deploy_app"]})
+        if nodes != original:
+            pytest.fail(f"La simulación ha modificado el escenario {suite_name}")
+        if base.diff() != {}:
+            pytest.fail(f"La simulación base de {suite_name} no debería tener cambios: {base.diff()}")
+
+        cluster_state = ClusterState(copy.deepcopy(nodes), apps_dataset)
+        expected = [cluster_state.process(function) for function in plan]
+        cluster_state.detach()
+        obtained = base.fork().run(plan)
+        if obtained != expected:
+            pytest.fail(f"La simulación de {suite_name} no coincide con ClusterState. Esperado: {expected}, Obtenido: {obtained}")
+
+        branch = comparison["todo"]["simulation"]
+        for node in cluster_state.nodes:
+            usage = node["server_current_usage"]
+            expected_usage = (usage.get("cpu_cores", 0), usage.get("ram_gb", 0), tuple(usage.get("apps", [])))
+            if branch.usage(node["node_id"]) != expected_usage:
+                pytest.fail(f"Uso incorrecto de {node['node_id']} en la simulación. Esperado: {expected_usage}, Obtenido: {branch.usage(node['node_id'])}")
+        if not comparison["todo"]["changed_nodes"] == len(branch.diff()) <= len(nodes):
+            pytest.fail(f"compare_plans cuenta mal los nodos cambiados en {suite_name}: {comparison['todo']['changed_nodes']}")
+
+def test_rebalancer_plans_replayable_improving_moves():
+    """Verifica que el plan de rebalanceo mejora el objetivo, respeta el máximo de movimientos y se reproduce con migrate_app"""
+    import copy
+    from cluster_state import ClusterState
+    from rebalancer import Rebalancer
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+
+    for suite_name, nodes in scenarios_dataset.items():
+        original = copy.deepcopy(nodes)
+        result = Rebalancer(nodes, apps_dataset).plan(max_moves=3, time_budget_s=5)
+        if nodes != original:
+            pytest.fail(f"El rebalanceo ha modificado el escenario {suite_name}")
+        if len(result["moves"]) > 3:
+            pytest.fail(f"El plan de {suite_name} supera el máximo de 3 movimientos: {len(result['moves'])}")
+        if result["objective_after"] > result["objective_before"]:
+            pytest.fail(f"El plan de {suite_name} empeora el objetivo: {result['objective_before']} -> {result['objective_after']}")
+        if any(move["gain"] <= 0 for move in result["moves"]):
+            pytest.fail(f"El plan de {suite_name} incluye movimientos sin ganancia: {result['moves']}")
+
+        cluster_state = ClusterState(copy.deepcopy(nodes), apps_dataset)
+        replayed = [cluster_state.process(call)[1] for call in result["calls"]]
+        cluster_state.detach()
+        if replayed != [move["to"] for move in result["moves"]]:
+            pytest.fail(f"Las llamadas migrate_app no reproducen el plan de {suite_name}. Esperado: {[move['to'] for move in result['moves']]}, Obtenido: {replayed}")
+
+    # With the default headroom a hot node is relieved even if the app moves to a slightly worse ranked node
+    kpis = {"latency_ms": 10, "throughput_mbps": 1000, "availability_percent": 99.9, "packet_loss_percent": 0.01, "connection_density": 10000, "energy_efficiency": 1}
+    hot_nodes = [{"node_id": f"node_{i}", "zone": "Madrid", "server_capabilities": {"cpu_cores": 100, "ram_gb": 100}, "server_kpis": dict(kpis),
+                  "server_current_usage": {"cpu_cores": 95, "ram_gb": 95, "apps": ["App caliente"]} if i == 0 else {"cpu_cores": 0, "ram_gb": 0, "apps": []}}
+                 for i in range(10)]
+    hot_apps = {"App caliente": {"app_id": "hot", "category_5G": "eMBB", "description": "", "min_requirements": {"cpu_cores": 20, "ram_gb": 20}}}
+    moves = Rebalancer(hot_nodes, hot_apps).plan()["moves"]
+    if [(move["from"], move["to"]) for move in moves] != [("node_0", "node_1")]:
+        pytest.fail(f"Con el margen por defecto el planificador debería liberar el nodo saturado: {moves}")
+    if Rebalancer(hot_nodes, hot_apps, max_utilisation=1.0).plan()["moves"]:
+        pytest.fail("Con max_utilisation=1.0 ningún nodo cuenta como sobrecargado y no debería haber movimientos")
+
+def test_placement_service_answers_like_main():
+    """Verifica que el servicio residente responde queries, llamadas directas y métricas como main.py, agrupando peticiones"""
+    import argparse
+    import asyncio
+    import concurrent.futures
+    import http.client
+    import hackathon_functions
+    from llm_backends import ReplayBackend
+    from placement_service import PlacementService
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("functions.json", "r") as f:
+        functions = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+    suite_name, expected_list = next(iter(solutions.items()))
+    cli_args = argparse.Namespace(stateful=False, event_log=None, concurrency=4, rpm=None, tpm=None)
+
+    def request(port, method, path, payload=None):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        connection.request(method, path, body=json.dumps(payload) if payload is not None else None)
+        response = connection.getresponse()
+        result = response.status, json.loads(response.read())
+        connection.close()
+        return result
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        clients = concurrent.futures.ThreadPoolExecutor(len(expected_list))
+        service = PlacementService(apps_dataset, scenarios_dataset, functions, cli_args, {}, batch_window_s=0.05)
+        server = await service.start(port=0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            answers = await asyncio.gather(*(loop.run_in_executor(clients, request, port, "POST", "/query", {"scenario": suite_name, "query": item["query"]}) for item in expected_list))
+            first_function = expected_list[0]["expected_result"]["function"][0]
+            direct = await loop.run_in_executor(clients, request, port, "POST", "/" + first_function["function_name"].split("_")[0], {"scenario": suite_name, **first_function["args"]})
+            missing = await loop.run_in_executor(clients, request, port, "POST", "/query", {"scenario": "no-existe", "query": "hola"})
+            invalid = await loop.run_in_executor(clients, request, port, "POST", "/deploy", {"scenario": suite_name, "app_name": first_function["args"]["app_name"], "latency_ms": "abc"})
+            # A bad call queued in the same batch as a good one only fails itself
+            mixed = await asyncio.gather(service.submit(suite_name, function=first_function),
+                                         service.submit(suite_name, function={"function_name": "deploy_app", "args": {"app_name": first_function["args"]["app_name"], "latency_ms": "abc"}}),
+                                         return_exceptions=True)
+            metrics = await loop.run_in_executor(clients, request, port, "GET", "/metrics")
+        finally:
+            await service.close()
+            clients.shutdown()
+        return answers, direct, missing, invalid, mixed, metrics
+
+    hackathon_functions.set_llm_backend(ReplayBackend.from_solutions("test-queries-with-solutions.json"))
+    try:
+        answers, direct, missing, invalid, mixed, metrics = asyncio.run(run())
+    finally:
+        hackathon_functions.set_llm_backend(None)
+
+    for (status, answer), expected_item in zip(answers, expected_list):
+        if status != 200:
+            pytest.fail(f"La query '{expected_item['query']}' ha devuelto el estado {status}: {answer}")
+        if answer["execution_result"]["function"] != expected_item["expected_result"]["function"]:
+            pytest.fail(f"Llamadas incorrectas para '{expected_item['query']}'. Esperado: {expected_item['expected_result']['function']}, Obtenido: {answer['execution_result']['function']}")
+        if answer["chosen_node"] != expected_item["chosen_node"]:
+            pytest.fail(f"Nodos incorrectos para '{expected_item['query']}'. Esperado: {expected_item['chosen_node']}, Obtenido: {answer['chosen_node']}")
+        if answer["state"] != expected_item["state"]:
+            pytest.fail(f"Estados incorrectos para '{expected_item['query']}'. Esperado: {expected_item['state']}, Obtenido: {answer['state']}")
+    expected_direct = {**direct[1], "chosen_node": expected_list[0]["chosen_node"][:1], "state": expected_list[0]["state"][:1]}
+    if direct != (200, expected_direct):
+        pytest.fail(f"La llamada directa no responde como main.py. Esperado: {(200, expected_direct)}, Obtenido: {direct}")
+    if missing[0] != 404:
+        pytest.fail(f"Un escenario inexistente debería devolver 404, no {missing}")
+    if invalid[0] != 400:
+        pytest.fail(f"Un KPI no numérico debería devolver 400, no {invalid}")
+    if isinstance(mixed[0], BaseException) or mixed[0]["chosen_node"] != direct[1]["chosen_node"]:
+        pytest.fail(f"La llamada válida del lote no debería fallar por la inválida: {mixed[0]}")
+    if getattr(mixed[1], "status", None) != 400:
+        pytest.fail(f"La llamada inválida del lote debería fallar con 400: {mixed[1]!r}")
+    if metrics[0] != 200:
+        pytest.fail(f"/metrics ha devuelto el estado {metrics[0]}")
+    if metrics[1]["requests"]["/query"] != len(expected_list) + 1:
+        pytest.fail(f"Número de peticiones /query incorrecto. Esperado: {len(expected_list) + 1}, Obtenido: {metrics[1]['requests']['/query']}")
+    if metrics[1]["batches"]["count"] >= len(expected_list) + 3:
+        pytest.fail(f"Las peticiones no se han agrupado en lotes: {metrics[1]['batches']}")
+    if metrics[1]["llm"]["calls"] != len(expected_list):
+        pytest.fail(f"Número de llamadas a Gemini incorrecto. Esperado: {len(expected_list)}, Obtenido: {metrics[1]['llm']['calls']}")
+
+def test_tool_declarations_cover_solutions():
+    """Verifica que las declaraciones generadas aceptan todas las llamadas esperadas y se reutilizan para el mismo catálogo"""
+    from hackathon_functions import task_generate_context_prompt
+    from prompt_builder import encode_apps_section
+    from tool_declarations import build_declarations, complete_functions, declarations_report
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    declarations = build_declarations(apps_dataset)
+    if build_declarations(dict(apps_dataset)) is not declarations:
+        pytest.fail("Las declaraciones del mismo catálogo no se reutilizan")
+    for expected_list in solutions.values():
+        for expected_item in expected_list:
+            for function in expected_item["expected_result"]["function"]:
+                properties = declarations[function["function_name"]]["parameters"]["properties"]
+                if function["args"]["app_name"] not in properties["app_name"]["enum"]:
+                    pytest.fail(f"La app {function['args']['app_name']} no está en el enum de {function['function_name']}")
+                for arg_name, value in function["args"].items():
+                    if arg_name not in properties:
+                        pytest.fail(f"El argumento {arg_name} no está declarado en {function['function_name']}")
+                    if arg_name != "app_name" and not isinstance(value, (int, float)):
+                        pytest.fail(f"El KPI {arg_name} de {function['function_name']} no es numérico: {value!r}")
+
+    handwritten = {"name": "stop_app", "description": "Para una app", "parameters": {"type": "OBJECT", "properties": {}}}
+    functions = complete_functions({"deploy_app": {}, "migrate_app": {}, "stop_app": handwritten}, apps_dataset)
+    if functions["stop_app"] is not handwritten:
+        pytest.fail("La declaración escrita a mano de stop_app se ha sustituido")
+    if functions["deploy_app"] != declarations["deploy_app"]:
+        pytest.fail("La declaración vacía de deploy_app no se ha generado")
+    report = declarations_report(declarations, apps_dataset)
+    if not report["total_tokens"] == sum(report["per_function"].values()) > 0:
+        pytest.fail(f"Total de tokens incorrecto: {report}")
+    if report["enum_copies"] != 3:
+        pytest.fail(f"Las tres funciones deberían restringir app_name al enum de apps: {report['enum_copies']} copias")
+    # The catalogue moves from the prompt to the declarations, so every call gets cheaper
+    if report["per_call_tokens_after"] != report["total_tokens"] or report["per_call_tokens_saved"] <= 0:
+        pytest.fail(f"Las declaraciones deberían costar menos por llamada que la tabla de apps que sustituyen: {report}")
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with_table = task_generate_context_prompt(apps_dataset, scenarios_dataset, {"deploy_app": {}, "migrate_app": {}, "stop_app": {}}, "test1")
+    without_table = task_generate_context_prompt(apps_dataset, scenarios_dataset, complete_functions({"deploy_app": {}, "migrate_app": {}, "stop_app": {}}, apps_dataset), "test1")
+    if encode_apps_section(apps_dataset) not in with_table or "app|cat|descripcion" in without_table:
+        pytest.fail("El prompt de contexto solo debería omitir la tabla de apps cuando las declaraciones generadas llevan el catálogo")
+
+def test_app_retriever_recall_and_flat_prompt():
+    """Verifica que la recuperación por query encuentra todas las apps esperadas y que el prompt no crece con el catálogo"""
+    from app_retriever import AppRetriever
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    report = AppRetriever(apps_dataset, 3).recall(solutions)
+    if report["recall"] != 1.0:
+        pytest.fail(f"La recuperación no encuentra todas las apps esperadas: {report['misses']}")
+
+    # With hundreds of unrelated apps the expected ones are still found and the prompts keep their size
+    grown = dict(apps_dataset)
+    for i in range(500):
+        grown[f"Filler App {i}"] = {"app_id": f"filler{i}", "category_5G": "eMBB", "description": f"Catálogo de relleno número {i} sin relación",
+                                    "min_requirements": {"cpu_cores": 1, "ram_gb": 1}}
+    small, large = AppRetriever(apps_dataset, 3), AppRetriever(grown, 3)
+    large_report = large.recall(solutions)
+    if large_report["recall"] != 1.0:
+        pytest.fail(f"Con el catálogo ampliado faltan apps esperadas: {large_report['misses']}")
+    sizes = {"small": 0, "large": 0}
+    for suite_name, expected_list in solutions.items():
+        for expected_item in expected_list:
+            sizes["small"] += len(small.context_prompt(expected_item["query"], scenarios_dataset[suite_name]))
+            sizes["large"] += len(large.context_prompt(expected_item["query"], scenarios_dataset[suite_name]))
+    if sizes["large"] >= 1.1 * sizes["small"]:
+        pytest.fail(f"El prompt crece con el catálogo. Catálogo original: {sizes['small']} caracteres, ampliado: {sizes['large']}")
+
+def test_event_log_recovers_and_answers_point_in_time(tmp_path):
+    """Verifica que el log de eventos recupera el estado desde snapshot más cola, descarta escrituras cortadas y responde consultas en un evento dado"""
+    import copy
+    from cluster_state import ClusterState
+    from event_log import EventSourcedClusterState
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    calls = [function for expected_list in solutions.values() for expected_item in expected_list for function in expected_item["expected_result"]["function"]]
+    calls = (calls + [{"function_name": "stop_app", "args": {"app_name": app_name}} for app_name in apps_dataset]) * 3
+    path = str(tmp_path / "test1.evlog")
+
+    expected_nodes = copy.deepcopy(scenarios_dataset["test1"])
+    expected_state = ClusterState(expected_nodes, apps_dataset)
+    logged = EventSourcedClusterState(path, copy.deepcopy(scenarios_dataset["test1"]), apps_dataset, snapshot_interval=25, keep_snapshots=2)
+    history = {}
+    for seq, function in enumerate(calls, start=1):
+        logged_result, expected_result = logged.process(function), expected_state.process(function)
+        if logged_result != expected_result:
+            pytest.fail(f"El evento {seq} ({function}) difiere de ClusterState. Esperado: {expected_result}, Obtenido: {logged_result}")
+        history[seq] = copy.deepcopy(expected_nodes)
+    logged.close()
+
+    # A record cut by a crash and a zero-filled tail (preallocated blocks) are ignored and dropped
+    for tail in (b"\x20\x00\x01\x02", bytes(64)):
+        with open(path, "ab") as f:
+            f.write(tail)
+        size_with_tail = os.path.getsize(path)
+        recovered_nodes = copy.deepcopy(scenarios_dataset["test1"])
+        recovered = EventSourcedClusterState(path, recovered_nodes, apps_dataset, snapshot_interval=25, keep_snapshots=2)
+        if recovered.seq != len(calls):
+            pytest.fail(f"Eventos recuperados incorrectos con la cola {tail!r}. Esperado: {len(calls)}, Obtenido: {recovered.seq}")
+        if recovered.stats["replayed"] != len(calls) % 25:
+            pytest.fail(f"Eventos reproducidos tras el snapshot incorrectos. Esperado: {len(calls) % 25}, Obtenido: {recovered.stats['replayed']}")
+        if recovered_nodes != expected_nodes:
+            pytest.fail(f"Los nodos recuperados con la cola {tail!r} no coinciden con los esperados")
+        if recovered.cluster_state.app_index.app_nodes != expected_state.app_index.app_nodes:
+            pytest.fail(f"El índice de apps recuperado con la cola {tail!r} no coincide con el esperado")
+        if len(recovered.snapshots()) != 3:
+            pytest.fail(f"Número de snapshots incorrecto. Esperado: 3, Obtenido: {len(recovered.snapshots())}")
+        if os.path.getsize(path) != size_with_tail - len(tail):
+            pytest.fail(f"La cola {tail!r} no se ha eliminado del log")
+
+        for seq in (1, 24, 25, 26, len(calls) // 2, len(calls)):
+            for node in history[seq]:
+                usage = node["server_current_usage"]
+                expected_usage = {"cpu_cores": usage.get("cpu_cores", 0), "ram_gb": usage.get("ram_gb", 0), "apps": usage.get("apps", [])}
+                obtained_usage = recovered.state_at(node["node_id"], seq)
+                if obtained_usage != expected_usage:
+                    pytest.fail(f"Estado de {node['node_id']} en el evento {seq} incorrecto. Esperado: {expected_usage}, Obtenido: {obtained_usage}")
+        recovered.close()
+
+def test_cluster_state_commits_placements():
+    """Verifica que ClusterState aplica deploy/stop al uso de los nodos y que su índice de capacidad libre coincide con el filtrado completo"""
+    from cluster_state import ClusterState
+    from hackathon_functions import task_select_nodes_with_resources
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenario_nodes = json.load(f)["test1"]
+
+    cluster_state = ClusterState(scenario_nodes, apps_dataset)
+    app_name = "Live Concert 360"
+    requirements = apps_dataset[app_name]["min_requirements"]
+
+    _, chosen_node = cluster_state.process({"function_name": "deploy_app", "args": {"app_name": app_name}})
+    node = next(node for node in scenario_nodes if node["node_id"] == chosen_node)
+    cpu_after_deploy = node["server_current_usage"]["cpu_cores"]
+    if app_name not in node["server_current_usage"]["apps"]:
+        pytest.fail(f"La app {app_name} no aparece en el nodo {chosen_node} tras desplegarla")
+
+    for cpu_cores, ram_gb in [(0, 0), (16, 32), (64, 128), (128, 512)]:
+        expected = [n["node_id"] for n in scenario_nodes if n["server_capabilities"]["cpu_cores"] - n["server_current_usage"].get("cpu_cores", 0) >= cpu_cores and n["server_capabilities"]["ram_gb"] - n["server_current_usage"].get("ram_gb", 0) >= ram_gb]
+        obtained = [n["node_id"] for n in task_select_nodes_with_resources(scenario_nodes, cpu_cores, ram_gb)]
+        if expected != obtained:
+            pytest.fail(f"Nodos con recursos incorrectos para {cpu_cores} CPU / {ram_gb} GB. Esperado: {expected}, Obtenido: {obtained}")
+
+    cluster_state.process({"function_name": "stop_app", "args": {"app_name": app_name}})
+    cluster_state.detach()
+    if node["server_current_usage"]["cpu_cores"] != cpu_after_deploy - requirements["cpu_cores"]:
+        pytest.fail(f"El uso de CPU del nodo {chosen_node} no se ha liberado al detener {app_name}")
+
+def test_cluster_state_index_matches_linear_scan():
+    """Verifica que, tras cada llamada aplicada por ClusterState, su AppNodeIndex coincide con el recorrido lineal del escenario modificado"""
+    from cluster_state import ClusterState
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenario_nodes = json.load(f)["test1"]
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    cluster_state = ClusterState(scenario_nodes, apps_dataset)
+    for expected_list in solutions.values():
+        for expected_item in expected_list:
+            for function in expected_item["expected_result"]["function"]:
+                cluster_state.process(function)
+                app_name = function["args"]["app_name"]
+                expected = [n["node_id"] for n in scenario_nodes for running in n["server_current_usage"].get("apps", []) if running == app_name]
+                if cluster_state.app_index.nodes_of(app_name) != expected:
+                    pytest.fail(f"Tras {function} el índice no coincide con el recorrido lineal. Esperado: {expected}, Obtenido: {cluster_state.app_index.nodes_of(app_name)}")
+    cluster_state.detach()
+
+def test_deploy_apps_batch_decrements_capacity():
+    """Verifica que deploy_apps_batch coloca cada app como deploy_app_func y descuenta la capacidad de los nodos elegidos"""
+    import copy
+    from placement_engine import deploy_apps_batch
+    from hackathon_functions import deploy_app_func
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenario_nodes = json.load(f)["test1"]
+
+    app_name = "Live Concert 360"
+    first_state, first_node = deploy_app_func(app_name, {"app_name": app_name}, apps_dataset, scenario_nodes)
+
+    results = deploy_apps_batch([(app_name, {"app_name": app_name})] * 20, apps_dataset, copy.deepcopy(scenario_nodes))
+    if results[0] != (first_state, first_node):
+        pytest.fail(f"La primera colocación del lote no coincide con deploy_app_func. Esperado: {(first_state, first_node)}, Obtenido: {results[0]}")
+
+    node = next(node for node in scenario_nodes if node["node_id"] == first_node)
+    requirements = apps_dataset[app_name]["min_requirements"]
+    free_cpu = node["server_capabilities"]["cpu_cores"] - node["server_current_usage"].get("cpu_cores", 0)
+    free_ram = node["server_capabilities"]["ram_gb"] - node["server_current_usage"].get("ram_gb", 0)
+    max_on_node = min(free_cpu // requirements["cpu_cores"], free_ram // requirements["ram_gb"])
+    placed_on_node = sum(1 for _, chosen_node in results if chosen_node == first_node)
+    if placed_on_node != max_on_node:
+        pytest.fail(f"Se colocaron {placed_on_node} instancias en {first_node}, pero solo caben {max_on_node}")
+
+
+def test_llm_cache_evicts_and_accounts_tokens(tmp_path):
+    """Verifica la clave de la caché de respuestas, la expulsión LRU en memoria y en disco, la cuenta de tokens y el uso desde varios hilos"""
+    import concurrent.futures
+    from llm_cache import LLMResponseCache, cache_key
+
+    tools = [{"name": "stop_app"}]
+    if cache_key("modelo", "prompt", tools) != cache_key("modelo", "prompt", [{"name": "stop_app"}]):
+        pytest.fail("La misma llamada debería dar la misma clave")
+    if len({cache_key("modelo", "prompt", tools), cache_key("otro", "prompt", tools), cache_key("modelo", "otro", tools), cache_key("modelo", "prompt", [])}) != 4:
+        pytest.fail("Cambiar el modelo, el prompt o las tools debería cambiar la clave")
+
+    def result(i):
+        return {"function": [{"function_name": "stop_app", "args": {"app_name": f"App {i}"}}], "prompt_tokens": 100 + i, "completion_tokens": 10}
+
+    cache = LLMResponseCache(str(tmp_path / "cache"), max_memory_entries=2)
+    for i in range(3):
+        cache.get_or_call("modelo", f"prompt {i}", tools, lambda i=i: result(i))
+    if list(cache.memory) != [cache_key("modelo", f"prompt {i}", tools) for i in (1, 2)]:
+        pytest.fail("La LRU en memoria debería conservar solo las 2 entradas más recientes")
+
+    # Evicted from memory, the first result is still read from disk with its tokens
+    calls = []
+    if cache.get_or_call("modelo", "prompt 0", tools, lambda: calls.append(1)) != result(0) or calls:
+        pytest.fail("Un acierto en disco debería devolver el resultado guardado sin llamar al modelo")
+    cache.get_or_call("modelo", "vacío", tools, lambda: {"function": [], "prompt_tokens": 5, "completion_tokens": 0})
+    stats = cache.stats()
+    if (stats["hits"], stats["misses"], stats["tokens_saved"], stats["disk_entries"]) != (1, 4, 110, 3):
+        pytest.fail(f"Cuenta de aciertos, fallos o tokens incorrecta: {stats}")
+
+    size = cache.disk_bytes // 3
+    small = LLMResponseCache(str(tmp_path / "cache"), max_disk_bytes=2 * size + size // 2)
+    if small.stats()["disk_entries"] != 3:
+        pytest.fail("La caché debería recuperar las entradas del directorio al abrirse")
+    small.put(cache_key("modelo", "prompt 3", tools), result(3))
+    remaining = sorted(name for name in os.listdir(tmp_path / "cache") if name.endswith(".json"))
+    if len(remaining) != 2 or small.disk_bytes > small.max_disk_bytes or cache_key("modelo", "prompt 3", tools) + ".json" not in remaining:
+        pytest.fail(f"La expulsión en disco debería borrar los ficheros menos usados hasta caber en el límite: {remaining}")
+
+    shared = LLMResponseCache(str(tmp_path / "shared"), max_memory_entries=8)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda i: shared.get_or_call("modelo", f"prompt {i % 16}", tools, lambda: result(i % 16)), range(400)))
+    stats = shared.stats()
+    if stats["hits"] + stats["misses"] != 400 or stats["disk_entries"] != 16 or stats["memory_entries"] != 8:
+        pytest.fail(f"La caché compartida entre hilos perdió cuentas o entradas: {stats}")
+
+def test_llm_cache_separates_stub_from_real_answers(tmp_path, monkeypatch):
+    """Verifica que las respuestas del backend stub guardadas en la caché no se sirven después a una ejecución con Gemini"""
+    import hackathon_functions
+    from llm_backends import ReplayBackend
+    from llm_cache import LLMResponseCache
+
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+    expected_item = next(iter(solutions.values()))[0]
+    tools = [{"name": "deploy_app"}, {"name": "migrate_app"}, {"name": "stop_app"}]
+    real_answer = {"function": [{"function_name": "stop_app", "args": {"app_name": "App real"}}], "prompt_tokens": 7, "completion_tokens": 3}
+    real_calls = []
+    monkeypatch.setattr(hackathon_functions, "gemini_generate_content", lambda tools_list, prompt: real_calls.append(prompt) or real_answer)
+
+    cache = LLMResponseCache(str(tmp_path / "cache"))
+    hackathon_functions.set_llm_cache(cache)
+    try:
+        hackathon_functions.set_llm_backend(ReplayBackend.from_solutions("test-queries-with-solutions.json"))
+        stub = hackathon_functions.task_call_gemini(expected_item["query"], *tools)
+        if stub["function"] != expected_item["expected_result"]["function"]:
+            pytest.fail(f"El backend stub debería responder la solución esperada, respondió {stub}")
+
+        hackathon_functions.set_llm_backend(None)
+        real = hackathon_functions.task_call_gemini(expected_item["query"], *tools)
+        if real != real_answer or len(real_calls) != 1:
+            pytest.fail(f"Una ejecución con Gemini no debe reutilizar la respuesta del stub. Obtenido: {real}")
+        if hackathon_functions.task_call_gemini(expected_item["query"], *tools) != real_answer or len(real_calls) != 1:
+            pytest.fail("La segunda llamada real debería salir de la caché")
+    finally:
+        hackathon_functions.set_llm_backend(None)
+        hackathon_functions.set_llm_cache(None)
+    if cache.stats()["disk_entries"] != 2:
+        pytest.fail(f"Deberían quedar una entrada del stub y otra de Gemini en disco: {cache.stats()}")
+
+def test_token_bucket_paces_calls():
+    """Verifica que TokenBucket empieza vacío y espera al ritmo configurado desde la primera llamada"""
+    import asyncio
+    import time
+    from async_executor import RateLimiter, TokenBucket
+
+    async def run():
+        bucket = TokenBucket(6000)
+        started = time.monotonic()
+        await bucket.acquire(20)
+        first = time.monotonic() - started
+        await bucket.acquire(20)
+        paced = time.monotonic() - started - first
+
+        # A call that used more tokens than estimated delays the next one
+        limiter = RateLimiter(tokens_per_minute=6000)
+        await limiter.acquire(10)
+        limiter.record(10, 40)
+        started = time.monotonic()
+        await limiter.acquire(10)
+        corrected = time.monotonic() - started
+        return first, paced, corrected
+
+    first, paced, corrected = asyncio.run(run())
+    if not 0.15 <= first < 0.6:
+        pytest.fail(f"El cubo debería empezar vacío: 20 unidades a 100 por segundo deberían esperar ~0.2 s, esperaron {first:.3f} s")
+    if not 0.15 <= paced < 0.6:
+        pytest.fail(f"20 unidades a 100 por segundo deberían esperar ~0.2 s, esperaron {paced:.3f} s")
+    if not 0.35 <= corrected < 0.9:
+        pytest.fail(f"El exceso de tokens registrado debería retrasar la siguiente llamada ~0.4 s, esperó {corrected:.3f} s")
+
+def test_concurrent_calls_keep_prompt_order():
+    """Verifica que las llamadas concurrentes respetan el máximo en vuelo y devuelven las respuestas en el orden de los prompts"""
+    import asyncio
+    import threading
+    import time
+    import hackathon_functions
+    from async_executor import call_gemini_concurrently
+
+    class SlowBackend:
+        '''Answers each prompt with its own text, the first prompts being the slowest'''
+        def __init__(self):
+            self.lock = threading.Lock()
+            self.in_flight = 0
+            self.max_in_flight = 0
+
+        def generate(self, tools_list, prompt):
+            with self.lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            time.sleep(0.01 * (10 - int(prompt)))
+            with self.lock:
+                self.in_flight -= 1
+            return {"function": [{"function_name": "stop_app", "args": {"app_name": prompt}}], "prompt_tokens": 1, "completion_tokens": 1}
+
+    backend = SlowBackend()
+    tools = {"deploy_app": {}, "migrate_app": {}, "stop_app": {}}
+    hackathon_functions.set_llm_backend(backend)
+    try:
+        responses = asyncio.run(call_gemini_concurrently([str(i) for i in range(10)], tools, max_in_flight=4))
+    finally:
+        hackathon_functions.set_llm_backend(None)
+
+    if [response["function"][0]["args"]["app_name"] for response in responses] != [str(i) for i in range(10)]:
+        pytest.fail("Las respuestas concurrentes no están en el orden de los prompts")
+    if not 1 < backend.max_in_flight <= 4:
+        pytest.fail(f"Debería haber entre 2 y 4 llamadas en vuelo a la vez, hubo {backend.max_in_flight}")
+
+def test_results_writer_syncs_and_compacts(tmp_path):
+    """Verifica que ResultsWriter vuelca el buffer sin esperar a otra query, que compact_results agrupa por test en orden y que ignora una última línea cortada"""
+    import time
+    from results_writer import ResultsWriter, compact_results
+
+    response = {"function": [{"function_name": "stop_app", "args": {"app_name": "App"}}]}
+    first, second = str(tmp_path / "results.0000.jsonl"), str(tmp_path / "results.0001.jsonl")
+
+    writer = ResultsWriter(first, fsync_interval_s=0.1)
+    writer.append("q1", response, "test1", ["ok"], ["node_1"])
+    time.sleep(0.3)
+    with open(first, "r", encoding="utf-8") as f:
+        if len(f.readlines()) != 1:
+            pytest.fail("El temporizador debería volcar el resultado a disco aunque no lleguen más queries")
+    writer.append("q2", response, "test2", ["ok"], ["node_2"])
+    writer.close()
+
+    with ResultsWriter(second, fsync_interval_s=60) as writer:
+        writer.append("q3", response, "test1", ["ok"], ["node_3"])
+    # A crash while writing leaves the last line cut
+    with open(second, "a", encoding="utf-8") as f:
+        f.write('{"test": "test2", "query": "q4", "execution_res')
+
+    results = compact_results([first, second], str(tmp_path / "results.json"))
+    with open(tmp_path / "results.json", "r", encoding="utf-8") as f:
+        if json.load(f) != results:
+            pytest.fail("results.json no coincide con los resultados compactados")
+    if {test_i: [item["query"] for item in items] for test_i, items in results.items()} != {"test1": ["q1", "q3"], "test2": ["q2"]}:
+        pytest.fail(f"compact_results no agrupa por test en orden o no descarta la línea cortada: {results}")
+    if results["test1"][1] != {"query": "q3", "execution_result": {"function": response["function"]}, "chosen_node": ["node_3"], "state": ["ok"]}:
+        pytest.fail(f"El registro compactado no tiene el formato de results.json: {results['test1'][1]}")
+    if os.path.exists(tmp_path / "results.json.tmp"):
+        pytest.fail("compact_results no debería dejar el fichero temporal")
+
+def test_prompt_cache_is_bounded_and_follows_usage():
+    """Verifica que la caché de prompts de contexto reutiliza escenarios iguales, cambia si cambian las apps de un nodo y no crece sin límite"""
+    import copy
+    import prompt_builder
+    from prompt_builder import build_context_prompt
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenarios_dataset = json.load(f)
+
+    prompt_builder._PROMPT_CACHE.clear()
+    scenario_nodes = scenarios_dataset["test1"]
+    prompt = build_context_prompt(apps_dataset, scenario_nodes, "reglas")
+    if build_context_prompt(copy.deepcopy(apps_dataset), copy.deepcopy(scenario_nodes), "reglas") is not prompt:
+        pytest.fail("Un escenario con el mismo contenido debería reutilizar el prompt cacheado")
+
+    changed = copy.deepcopy(scenario_nodes)
+    changed[0]["server_current_usage"].setdefault("apps", []).append(next(iter(apps_dataset)))
+    changed_prompt = build_context_prompt(apps_dataset, changed, "reglas")
+    if changed_prompt is prompt or next(iter(apps_dataset)) not in changed_prompt[0].split("\n")[2]:
+        pytest.fail("El prompt de un nodo con otras apps en ejecución no puede salir de la caché")
+
+    for i in range(prompt_builder.PROMPT_CACHE_SIZE + 2):
+        build_context_prompt(apps_dataset, scenario_nodes, f"reglas {i}")
+    if len(prompt_builder._PROMPT_CACHE) > prompt_builder.PROMPT_CACHE_SIZE:
+        pytest.fail(f"La caché de prompts creció por encima de su límite: {len(prompt_builder._PROMPT_CACHE)}")
+    if prompt_builder._prompt_key(apps_dataset, scenario_nodes, "reglas") in prompt_builder._PROMPT_CACHE:
+        pytest.fail("La caché de prompts no expulsa las entradas menos usadas")
+    prompt_builder._PROMPT_CACHE.clear()
+
+def test_intent_resolver_never_wrong():
+    """Verifica que el resolvedor local solo responde queries que resuelve igual que las soluciones"""
+    from intent_resolver import IntentResolver, evaluate_resolver
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+
+    report = evaluate_resolver(IntentResolver(apps_dataset), "test-queries-with-solutions.json")
+    if report["wrong"]:
+        pytest.fail(f"El resolvedor local resolvió mal {len(report['wrong'])} queries: {report['wrong']}")
+
+def test_intent_resolver_held_out_paraphrases():
+    """Verifica el resolvedor local con paráfrasis que no están en las soluciones: unidades de RAM/disco, negaciones y cotas al revés van al LLM"""
+    from intent_resolver import IntentResolver
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    resolver = IntentResolver(apps_dataset)
+
+    to_llm = [
+        "Despliega Cloud Gaming Pro con ram de 16 GB",
+        "Despliega Live Concert 360 con 200 GB de disco",
+        "Despliega Cloud Gaming Pro con menos de 2 Gbps",
+        "Despliega Cloud Gaming Pro con una latencia de al menos 30 ms",
+        "Arranca Smart Parking Spot con hasta 3000 conexiones",
+        "No, mejor no lo despliegues Cloud Gaming Pro",
+        "No despliegue Cloud Gaming Pro todavía",
+        "Cancela el despliegue de Cloud Gaming Pro",
+        # The verb after the first app belongs to the clause of the second one
+        "V2X City Navigator, y despliega AR Industrial Assist",
+    ]
+    for query in to_llm:
+        resolved = resolver.resolve(query)
+        if resolved is not None:
+            pytest.fail(f"El resolvedor local debería dejar al LLM '{query}', pero resolvió {resolved['function']}")
+
+    resolved_locally = {
+        "Arranca HoloConference Enterprise con 800 Mbps o más": ("deploy_app", "HoloConference Enterprise", {"throughput_mbps": 800}),
+        "Lánzame Remote Mining Ops con 2 Gbps": ("deploy_app", "Remote Mining Ops", {"throughput_mbps": 2000}),
+        "Instala Haptic Education Lab con packet loss por debajo del 0.2%": ("deploy_app", "Haptic Education Lab", {"packet_loss_percent": 0.2}),
+        "Ejecuta Smart Grid Balancer con densidad de 20,000 dispositivos": ("deploy_app", "Smart Grid Balancer", {"connection_density": 20000}),
+        "Traslada Smart Traffic Lights a otro sitio con latencia inferior a 8 ms": ("migrate_app", "Smart Traffic Lights", {"latency_ms": 8}),
+        "Mueve V2X City Navigator, latencia 12 ms o menos": ("migrate_app", "V2X City Navigator", {"latency_ms": 12}),
+        "Forest Fire Sentinel ha acabado, quítalo": ("stop_app", "Forest Fire Sentinel", {}),
+        "Páralos: Smart Water Metering": ("stop_app", "Smart Water Metering", {}),
+        "Para la app V2X City Navigator y despliega AR Industrial Assist": [("stop_app", "V2X City Navigator", {}), ("deploy_app", "AR Industrial Assist", {})],
+    }
+    for query, calls in resolved_locally.items():
+        resolved = resolver.resolve(query)
+        expected = [{"function_name": function_name, "args": {"app_name": app_name, **kpis}} for function_name, app_name, kpis in (calls if isinstance(calls, list) else [calls])]
+        if resolved is not None and resolved["function"] != expected:
+            pytest.fail(f"Resolución incorrecta de '{query}'. Esperado: {expected}, Obtenido: {resolved['function']}")
+        if resolved is None:
+            pytest.fail(f"El resolvedor local debería resolver '{query}' sin ambigüedad")
+
+def test_benchmark_generators_and_regressions():
+    """Verifica que los generadores del benchmark son deterministas y con la forma de los JSON reales, y que compare detecta regresiones"""
+    from benchmark import compare, generate_apps, generate_requests, generate_scenario, run_benchmarks
+
+    with open("apps.json", "r") as f:
+        real_apps = json.load(f)
+    with open("scenarios.json", "r") as f:
+        real_node = json.load(f)["test1"][0]
+
+    apps_dataset = generate_apps(40, seed=3, base_apps=real_apps)
+    if len(apps_dataset) != 40 or list(apps_dataset)[:len(real_apps)] != list(real_apps):
+        pytest.fail("generate_apps debería incluir primero las apps reales y completar hasta el número pedido")
+    nodes = generate_scenario(50, apps_dataset, seed=3)
+    if nodes != generate_scenario(50, apps_dataset, seed=3) or generate_requests(30, apps_dataset, seed=3) != generate_requests(30, apps_dataset, seed=3):
+        pytest.fail("Los generadores deberían dar el mismo resultado con la misma semilla")
+    for node in nodes:
+        if set(node) != set(real_node) or set(node["server_kpis"]) != set(real_node["server_kpis"]):
+            pytest.fail(f"El nodo sintético no tiene la forma de scenarios.json: {node}")
+        for app_name in node["server_current_usage"].get("apps", []):
+            if app_name not in apps_dataset:
+                pytest.fail(f"El nodo sintético ejecuta una app desconocida: {app_name}")
+    for function in generate_requests(30, apps_dataset, seed=3):
+        if function["function_name"] not in ("deploy_app", "migrate_app", "stop_app") or function["args"]["app_name"] not in apps_dataset:
+            pytest.fail(f"Llamada sintética inválida: {function}")
+
+    results = run_benchmarks([10], n_apps=30, n_requests=20, time_budget_s=0.01)
+    for key, result in results.items():
+        if result["iterations"] < 1 or result["p50_ms"] > result["p99_ms"] or result["peak_memory_kb"] < 0:
+            pytest.fail(f"Resultado de benchmark incoherente en {key}: {result}")
+    baseline = {key: dict(result, p50_ms=result["p50_ms"] / 2) for key, result in results.items()}
+    if {key for key, *_ in compare(results, baseline)} != set(results):
+        pytest.fail("compare debería marcar como regresión una etapa el doble de lenta que la referencia")
+    if compare(results, results):
+        pytest.fail("compare no debería marcar regresiones contra los mismos resultados")
+
+def test_tracer_records_stages_and_tokens(tmp_path, capsys):
+    """Verifica que el tracer no registra nada desactivado, agrega spans y tokens por etapa, exporta la traza y que sin --debug no se imprime nada"""
+    import hackathon_functions
+    from hackathon_functions import logic_app_placement, task_call_gemini
+    from llm_backends import ReplayBackend
+    from tracing import TRACER, Tracer
+
+    with open("apps.json", "r") as f:
+        apps_dataset = json.load(f)
+    with open("scenarios.json", "r") as f:
+        scenario_nodes = json.load(f)["test1"]
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        expected_item = next(iter(json.load(f).values()))[0]
+
+    tracer = Tracer()
+    with tracer.span("llm_call") as span:
+        span["prompt_tokens"] = 10
+    if tracer.spans:
+        pytest.fail("Un tracer desactivado no debería registrar spans")
+
+    tracer.enable()
+    for tokens in (10, 20, 30):
+        with tracer.span("llm_call", query=tokens) as span:
+            span["prompt_tokens"] = tokens
+    with tracer.span("result_write"):
+        pass
+    summary = tracer.summary()
+    if summary["llm_call"]["count"] != 3 or summary["llm_call"]["prompt_tokens"] != 60 or summary["result_write"]["count"] != 1:
+        pytest.fail(f"Resumen de spans incorrecto: {summary}")
+    if sum(summary["llm_call"]["histogram"].values()) != 3:
+        pytest.fail(f"El histograma debería contar los 3 spans: {summary['llm_call']['histogram']}")
+    tracer.export_trace(str(tmp_path / "trace.json"))
+    with open(tmp_path / "trace.json", "r", encoding="utf-8") as f:
+        trace = json.load(f)
+    if len(trace["traceEvents"]) != 4 or trace["traceEvents"][0]["ph"] != "X" or trace["summary"]["llm_call"]["count"] != 3:
+        pytest.fail("La traza exportada no tiene los eventos en formato Chrome trace")
+
+    # The shared tracer sees the stages of the real pipeline, with the tokens of each LLM call
+    capsys.readouterr()
+    previous_enabled, previous_debug = TRACER.enabled, hackathon_functions.DEBUG
+    TRACER.enable()
+    hackathon_functions.DEBUG = False
+    hackathon_functions.set_llm_backend(ReplayBackend.from_solutions("test-queries-with-solutions.json"))
+    try:
+        TRACER.spans.clear()
+        response = task_call_gemini(expected_item["query"], {}, {}, {})
+        logic_app_placement("Live Concert 360", apps_dataset, scenario_nodes, {"latency_ms": 50})
+        names = [span["name"] for span in TRACER.spans]
+        llm_span = next(span for span in TRACER.spans if span["name"] == "llm_call")
+    finally:
+        hackathon_functions.set_llm_backend(None)
+        hackathon_functions.DEBUG = previous_debug
+        TRACER.enabled = previous_enabled
+        TRACER.spans.clear()
+    if llm_span["attrs"]["completion_tokens"] != response["completion_tokens"] or llm_span["attrs"]["source"] != "api":
+        pytest.fail(f"El span de la llamada al LLM no lleva sus tokens: {llm_span}")
+    if not {"placement.select_nodes", "placement.sort"} <= set(names):
+        pytest.fail(f"Faltan las etapas de placement en la traza: {names}")
+    if capsys.readouterr().out:
+        pytest.fail("Sin --debug el placement no debería imprimir nada")
+
+def test_make_shards_keeps_query_order():
+    """Verifica que los fragmentos de --workers cubren todas las queries de cada test, en orden y sin repetirlas"""
+    from main import make_shards
+
+    with open("test-queries-with-solutions.json", "r") as f:
+        test_queries_dataset = json.load(f)
+
+    for chunk_size in [0, 1, 4]:
+        shards = make_shards(test_queries_dataset, chunk_size)
+        if [shard[0] for shard in shards] != list(range(len(shards))):
+            pytest.fail(f"Los fragmentos con chunk_size={chunk_size} no están numerados en orden")
+        rebuilt = {}
+        for _, test_i, start, queries in shards:
+            if start != len(rebuilt.get(test_i, [])):
+                pytest.fail(f"El fragmento de {test_i} empieza en {start}, pero ya había {len(rebuilt.get(test_i, []))} queries")
+            rebuilt.setdefault(test_i, []).extend(queries)
+        expected = {test_i: [item["query"] for item in items] for test_i, items in test_queries_dataset.items()}
+        if list(rebuilt) != list(expected):
+            pytest.fail(f"Los tests de los fragmentos no siguen el orden del dataset. Esperado: {list(expected)}, Obtenido: {list(rebuilt)}")
+        if rebuilt != expected:
+            pytest.fail(f"Los fragmentos con chunk_size={chunk_size} pierden, repiten o reordenan queries")
+
+def test_workers_remove_the_shards(tmp_path):
+    """Verifica que --workers junta los fragmentos en results.json con todas las queries y después borra los results.NNNN.jsonl"""
+    import shutil
+    import subprocess
+    import sys
+
+    with open("test-queries-with-solutions.json", "r") as f:
+        test_queries_dataset = json.load(f)
+    for name in ["apps.json", "scenarios.json", "functions.json", "test-queries-with-solutions.json"]:
+        shutil.copy(name, tmp_path / name)
+
+    run = subprocess.run([sys.executable, os.path.abspath("main.py"), "--llm-backend", "stub", "--workers", "2", "--chunk-size", "4"],
+                         cwd=tmp_path, capture_output=True, text=True)
+    if run.returncode != 0:
+        pytest.fail(f"main.py --workers terminó con error: {run.stderr[-2000:]}")
+    with open(tmp_path / "results.json", "r") as f:
+        results = json.load(f)
+    if {test_i: len(items) for test_i, items in results.items()} != {test_i: len(items) for test_i, items in test_queries_dataset.items()}:
+        pytest.fail("results.json debería tener todas las queries de cada test")
+    leftover = sorted(path.name for path in tmp_path.glob("results.*.jsonl"))
+    if leftover:
+        pytest.fail(f"Los fragmentos deberían borrarse tras compactarlos, quedan {leftover}")
+
+def test_evaluator_scores_and_reports_diffs():
+    """Verifica que el evaluador de una sola pasada puntúa las soluciones al 100% y reporta un nodo cambiado"""
+    import copy
+    from evaluator import evaluate
+
+    with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
+        solutions = json.load(f)
+
+    results = [(suite_name, {"query": item["query"], "execution_result": {"function": item["expected_result"]["function"]},
+                             "chosen_node": item["chosen_node"], "state": item["state"]})
+               for suite_name, expected_list in solutions.items() for item in expected_list]
+    report = evaluate(solutions, results)
+    if not report["correct"] == report["queries"] == len(results):
+        pytest.fail(f"Las soluciones deberían puntuar el 100%: {report['correct']}/{report['queries']}")
+    if report["diffs"]:
+        pytest.fail(f"Las soluciones no deberían tener diferencias: {report['diffs']}")
+
+    results = copy.deepcopy(results)
+    suite_name, wrong_item = results[0]
+    wrong_item["chosen_node"] = ["node_inexistente"] + wrong_item["chosen_node"][1:]
+    report = evaluate(solutions, results[:-1])
+    if report["correct"] != report["queries"] - 2:
+        pytest.fail(f"Con un nodo cambiado y una query que falta deberían fallar 2 queries: {report['correct']}/{report['queries']}")
+    if report["per_suite"][suite_name]["correct"] != report["per_suite"][suite_name]["total"] - 1:
+        pytest.fail(f"La puntuación de {suite_name} debería perder solo la query cambiada: {report['per_suite'][suite_name]}")
+    if [issue["check"] for issue in report["diffs"][0]["issues"]] != ["chosen_node"]:
+        pytest.fail(f"La primera diferencia debería ser el nodo elegido: {report['diffs'][0]}")
+    if report["diffs"][1]["issues"][0]["check"] != "missing":
+        pytest.fail(f"La segunda diferencia debería ser la query que falta: {report['diffs'][1]}")
+
 # Cargar datos de test una sola vez
+@functools.lru_cache(maxsize=None)
 def load_test_data():
-    """Carga los archivos JSON de test"""
+    """Carga los archivos JSON de test (una sola vez por sesión; evaluator.py puntúa results.json sin pytest)"""
     try:
         with open("test-queries-with-solutions.json", "r", encoding='utf-8') as f:
             solutions = json.load(f)
@@ -0,0 +1,202 @@
+import argparse
+import json
+import re
+from collections import defaultdict
+
+from hackathon_functions import KPIS_ORDER_OPERAND
+from intent_resolver import STOPWORDS, normalize
+from llm_backends import estimate_tokens
+from prompt_builder import content_hash, encode_apps_section
+
+# Unit of the KPI arguments whose name does not already give it, as shown to the model in the parameter descriptions
+KPI_UNITS = {
+    "connection_density": "dispositivos/km2",
+    "energy_efficiency": "0-1, alta=1, media=0.5, baja=0",
+}
+
+# Description of each tool; the KPI parameters are only declared for the placement ones
+TOOLS = {
+    "deploy_app": ("Despliega una app en el mejor nodo que cumpla los KPIs.", True),
+    "migrate_app": ("Migra una app a otro nodo que cumpla los KPIs.", True),
+    "stop_app": ("Detiene una app.", False),
+}
+
+# Tool whose app_name description carries the keywords of every app. Every tool has the enum of app names, but
+# the keywords are sent once, and they replace the app table of the context prompt (see catalogue_in_declarations)
+CATALOGUE_TOOL = "deploy_app"
+
+# Description words kept per app, the rarest ones of the catalogue, to find the app of a query that does not name it
+KEYWORDS_PER_APP = 3
+
+# Words (accent-free, lowercase) that say nothing about what an app does
+KEYWORD_STOPWORDS = STOPWORDS | {"plataforma", "servicio", "permite", "requiere", "incluyendo", "usuario", "usuarios",
+                                 "traves", "cualquier", "todos", "donde", "cuando", "estan", "solo"}
+
+# Bumped whenever the shape of the generated declarations changes
+DECLARATIONS_VERSION = 3
+
+# Declarations already generated, keyed by the content hash of the app names and descriptions and the KPI operands
+_DECLARATIONS_CACHE = {}
+
+
+def _kpi_parameter(kpi_name: str) -> dict:
+    unit = KPI_UNITS.get(kpi_name)
+    return {"type": "NUMBER", "description": unit} if unit else {"type": "NUMBER"}
+
+
+def _kpi_bounds(kpis_order_operand: dict) -> str:
+    '''Sentence telling which KPI arguments are maxima, added to the description of the tools that take them.'''
+    maxima = [kpi_name for kpi_name, operand in kpis_order_operand.items() if operand > 0]
+    return f" KPIs opcionales: {', '.join(maxima)} son máximos; el resto, mínimos."
+
+
+def short_names(app_names: list) -> dict:
+    '''App name -> its fewest leading words that no other name starts with, e.g. "TeleSurg" or "Smart Grid Balancer".'''
+    words = {app_name: app_name.split() for app_name in app_names}
+    shortest = {}
+    for app_name, name_words in words.items():
+        for length in range(1, len(name_words) + 1):
+            prefix = name_words[:length]
+            if not any(other_words[:length] == prefix for other, other_words in words.items() if other != app_name):
+                break
+        shortest[app_name] = " ".join(prefix)
+    return shortest
+
+
+def app_keywords(apps_dataset: dict, count: int=KEYWORDS_PER_APP) -> dict:
+    '''
+    App name -> the count words of its description (at least 4 letters, not stopwords) found in the fewest other
+    descriptions, in the order they are written, e.g. "cirugía robótica transmite".
+    '''
+    words = {app_name: [word for word in re.findall(r"[^\W\d_]+", app["description"]) if len(word) >= 4 and normalize(word) not in KEYWORD_STOPWORDS]
+             for app_name, app in apps_dataset.items()}
+    frequency = defaultdict(int)
+    for app_words in words.values():
+        for word in {normalize(word) for word in app_words}:
+            frequency[word] += 1
+    keywords = {}
+    for app_name, app_words in words.items():
+        unique = list(dict.fromkeys(app_words))
+        chosen = set(sorted(unique, key=lambda word: (frequency[normalize(word)], unique.index(word)))[:count])
+        keywords[app_name] = " ".join(word for word in unique if word in chosen)
+    return keywords
+
+
+def build_declarations(apps_dataset: dict, kpis_order_operand: dict=KPIS_ORDER_OPERAND) -> dict:
+    '''
+    Builds the deploy_app, migrate_app and stop_app function declarations from the app catalogue: app_name is an
+    enum of the valid app names in every tool, the app_name of CATALOGUE_TOOL also lists the keywords of each app,
+    and every KPI of kpis_order_operand is an optional number, with its unit when its name does not give it and
+    its bound (maximum or minimum) in the tool description.
+    Memoized by content hash, so the same catalogue always returns the same dict.
+
+    :param apps_dataset: Dataset containing the applications, keyed by name
+    :type apps_dataset: dict
+    :param kpis_order_operand: KPI name -> 1 if the user gives a maximum, -1 if a minimum
+    :type kpis_order_operand: dict
+    :return: Function name -> declaration, in the format of functions.json
+    :rtype: dict
+    '''
+    key = content_hash(DECLARATIONS_VERSION, {app_name: app["description"] for app_name, app in apps_dataset.items()}, kpis_order_operand)
+    cached = _DECLARATIONS_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    app_name = {"type": "STRING", "enum": list(apps_dataset), "description": "Nombre exacto de la app"}
+    # Apps are written by the start of their name, enough to pick them in the enum, and their rarest keywords
+    names = short_names(list(apps_dataset))
+    keywords = app_keywords(apps_dataset)
+    catalogue = "; ".join(f"{names[name]}: {keywords[name]}" for name in apps_dataset)
+    catalogue_app_name = {**app_name, "description": f"Nombre exacto de la app (inicio del nombre: palabras clave): {catalogue}"}
+    kpi_parameters = {kpi_name: _kpi_parameter(kpi_name) for kpi_name in kpis_order_operand}
+    declarations = {}
+    for function_name, (description, with_kpis) in TOOLS.items():
+        properties = {"app_name": catalogue_app_name if function_name == CATALOGUE_TOOL else app_name, **(kpi_parameters if with_kpis else {})}
+        declarations[function_name] = {
+            "name": function_name,
+            "description": description + (_kpi_bounds(kpis_order_operand) if with_kpis else ""),
+            "parameters": {"type": "OBJECT", "properties": properties, "required": ["app_name"]},
+        }
+    _DECLARATIONS_CACHE[key] = declarations
+    return declarations
+
+
+def complete_functions(functions: dict, apps_dataset: dict) -> dict:
+    '''
+    Returns the functions of functions.json with every empty declaration replaced by the generated one,
+    keeping the declarations written by hand.
+
+    :param functions: Content of functions.json
+    :type functions: dict
+    :param apps_dataset: Dataset containing the applications
+    :type apps_dataset: dict
+    :rtype: dict
+    '''
+    if all(functions.get(function_name) for function_name in TOOLS):
+        return functions
+    generated = build_declarations(apps_dataset)
+    return {**functions, **{function_name: generated[function_name] for function_name in TOOLS if not functions.get(function_name)}}
+
+
+def catalogue_in_declarations(functions: dict, apps_dataset: dict) -> bool:
+    '''
+    Returns True if functions carry the generated catalogue of apps_dataset (see complete_functions), in which case
+    the context prompt leaves out its app table.
+    '''
+    declaration = functions.get(CATALOGUE_TOOL)
+    if not declaration:
+        return False
+    return declaration == build_declarations(apps_dataset)[CATALOGUE_TOOL]
+
+
+def declarations_report(declarations: dict, apps_dataset: dict) -> dict:
+    '''
+    Token footprint of the declarations (estimated as the offline backends do), per tool and in total, next to
+    the size of the app table of the context prompt. Both are sent with every call: before, the catalogue was the
+    app table (with empty declarations); with the generated declarations the table is left out of the prompt, so
+    the catalogue costs the declarations alone.
+
+    :return: tokens per function, total tokens, apps table tokens, per-call catalogue tokens before and after,
+        tokens saved per call, copies of the app name enum and number of apps
+    :rtype: dict
+    '''
+    per_function = {function_name: estimate_tokens(json.dumps(declaration, ensure_ascii=False, separators=(",", ":")))
+                    for function_name, declaration in declarations.items()}
+    apps_table_tokens = estimate_tokens(encode_apps_section(apps_dataset))
+    after = sum(per_function.values()) + (0 if catalogue_in_declarations(declarations, apps_dataset) else apps_table_tokens)
+    return {
+        "per_function": per_function,
+        "total_tokens": sum(per_function.values()),
+        "apps_table_tokens": apps_table_tokens,
+        "per_call_tokens_before": apps_table_tokens,
+        "per_call_tokens_after": after,
+        "per_call_tokens_saved": apps_table_tokens - after,
+        "enum_copies": sum(1 for declaration in declarations.values() if "enum" in declaration.get("parameters", {}).get("properties", {}).get("app_name", {})),
+        "apps": len(apps_dataset),
+    }
+
+
+def clear_declarations_cache():
+    '''Drops every memoized set of declarations.'''
+    _DECLARATIONS_CACHE.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the deploy_app/migrate_app/stop_app declarations from apps.json and report their size")
+    parser.add_argument("--apps", default="apps.json")
+    parser.add_argument("--output", metavar="PATH", default=None, help="Write the declarations as JSON in PATH, e.g. functions.json")
+    cli_args = parser.parse_args()
+
+    with open(cli_args.apps, "r", encoding="utf-8") as f:
+        apps_dataset = json.load(f)
+    declarations = build_declarations(apps_dataset)
+    report = declarations_report(declarations, apps_dataset)
+    for function_name, tokens in report["per_function"].items():
+        print(f"{function_name}: ~{tokens} tokens")
+    print(f"Total: ~{report['total_tokens']} tokens para {report['apps']} apps (tabla de apps del prompt: ~{report['apps_table_tokens']} tokens)")
+    print(f"Catálogo por llamada: ~{report['per_call_tokens_before']} tokens con la tabla de apps, ~{report['per_call_tokens_after']} "
+          f"con las declaraciones ({report['per_call_tokens_saved']} menos, {report['enum_copies']} copias del enum de apps)")
+
+    if cli_args.output:
+        with open(cli_args.output, "w", encoding="utf-8") as f:
+            json.dump(declarations, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,123 @@
+import contextlib
+import json
+import statistics
+import threading
+import time
+
+# Upper bounds (ms) of the buckets of the summary histograms; the last bucket is open
+HISTOGRAM_BUCKETS_MS = [0.01, 0.1, 1, 10, 100, 1000, 10000]
+
+
+class Tracer:
+    '''
+    Collects timed spans of the pipeline stages (prompt generation, LLM call, function-call processing,
+    placement and result writing). While disabled, span() returns a shared no-op context manager,
+    so instrumented code pays a single attribute check.
+    '''
+
+    def __init__(self, enabled: bool=False):
+        self.enabled = enabled
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def span(self, name: str, **attrs):
+        '''
+        Times the enclosed block as a span called name. The yielded dict can be updated inside the block
+        to attach values known only at the end, such as the tokens of an LLM response.
+
+        :param name: Stage name, e.g. "llm_call" or "placement.sort"
+        :type name: str
+        '''
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, attrs)
+
+    @contextlib.contextmanager
+    def _span(self, name: str, attrs: dict):
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.spans.append({
+                    "name": name,
+                    "start_ms": (start - self.origin) * 1000,
+                    "duration_ms": (end - start) * 1000,
+                    "thread": threading.get_ident(),
+                    "attrs": attrs,
+                })
+
+    def summary(self) -> dict:
+        '''
+        Aggregates the spans by name.
+
+        :return: For each span name: count, total/p50/p99/max milliseconds, a histogram over HISTOGRAM_BUCKETS_MS
+            and the sum of any token attributes
+        :rtype: dict
+        '''
+        by_name = {}
+        for span in self.spans:
+            by_name.setdefault(span["name"], []).append(span)
+
+        summary = {}
+        for name, spans in by_name.items():
+            durations = sorted(span["duration_ms"] for span in spans)
+            histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+            for duration in durations:
+                bucket = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if duration <= bound), len(HISTOGRAM_BUCKETS_MS))
+                histogram[bucket] += 1
+            tokens = {}
+            for span in spans:
+                for key, value in span["attrs"].items():
+                    if key.endswith("_tokens") and isinstance(value, (int, float)):
+                        tokens[key] = tokens.get(key, 0) + value
+            summary[name] = {
+                "count": len(durations),
+                "total_ms": sum(durations),
+                "p50_ms": statistics.median(durations),
+                "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+                "max_ms": durations[-1],
+                "histogram": dict(zip([f"<={bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"], histogram)),
+                **tokens,
+            }
+        return summary
+
+    def export_trace(self, path: str):
+        '''Writes the spans in Chrome trace event format (viewable in chrome://tracing or Perfetto).'''
+        events = [{
+            "name": span["name"],
+            "ph": "X",
+            "ts": span["start_ms"] * 1000,
+            "dur": span["duration_ms"] * 1000,
+            "pid": span.get("pid", 0),
+            "tid": span["thread"],
+            "args": span["attrs"],
+        } for span in self.spans]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "summary": self.summary()}, f, ensure_ascii=False)
+
+    def print_summary(self):
+        for name, stats in self.summary().items():
+            tokens = "".join(f" {key}={value}" for key, value in stats.items() if key.endswith("_tokens"))
+            print(f"[TRACE] {name}: n={stats['count']} total={stats['total_ms']:.1f}ms p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms{tokens}")
+
+
+class _NoSpan:
+    '''Context manager used while tracing is off; yields a throwaway dict so attrs updates still work.'''
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+# Tracer shared by the whole pipeline; main.py enables it with --trace
+TRACER = Tracer()